@@ -4,6 +4,10 @@ This python module is used to run the temp-o-matic application that displays
 temperature and humidity and the corresponding plot. It also starts the two
 servers that support the web client interface application.
 
+The DHT22 is owned by a single acquisition process that writes its readings to
+a shared-memory ring; the GUI and the Tornado server processes only read the
+ring, so the sensor is read once however many processes show its readings.
+
 """
 import sys
 import os
@@ -13,23 +17,54 @@ import subprocess
 
 from PyQt5.QtWidgets import QApplication
 
+from src.acquisition import AcquisitionWorker
+from src.dht_22 import DHT22Sensor
+from src.filters import SignalConditioner
+from src.reading_ring import ReadingRing
+from src.sensor_drivers import load_sensor_configuration
 from src.temp_o_matic import MainWindow
 from src.server import run_server
 
-def run_tornado_server():
+def run_acquisition(ring_name, ring_condition, stop_event):
+    print("Running Sensor Acquisition!")
+    ring = ReadingRing(ring_name, condition=ring_condition)
+    sensor_configuration = load_sensor_configuration()
+    acquisition_worker = AcquisitionWorker(
+        DHT22Sensor.from_configuration(sensor_configuration), ring=ring,
+        conditioner=SignalConditioner.from_configuration(sensor_configuration))
+    acquisition_worker.start()
+
+    stop_event.wait()
+
+    acquisition_worker.stop()
+    print("Acquisition: {}".format(acquisition_worker.get_metrics()))
+    ring.close()
+
+def run_tornado_server(ring_name, ring_condition):
     print("Running Tornado Server!")
-    run_server()
+    run_server(ReadingRing(ring_name, condition=ring_condition))
 
-def run_application():
+def run_application(ring_name, ring_condition):
     app = QApplication(sys.argv)
-    main_window = MainWindow()
+    main_window = MainWindow(reading_source=ReadingRing(ring_name, condition=ring_condition))
     main_window.show()
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
+    # Shared readings of the sensor, written by the acquisition process only
+    reading_ring = ReadingRing(create=True)
+    reading_condition = multiprocessing.Condition()
+    acquisition_stop = multiprocessing.Event()
+
     # run_application()
-    gui_process = multiprocessing.Process(target=run_application, args=())
-    tornado_process = multiprocessing.Process(target=run_tornado_server, args=())
+    acquisition_process = multiprocessing.Process(
+        target=run_acquisition, args=(reading_ring.name, reading_condition, acquisition_stop))
+    gui_process = multiprocessing.Process(
+        target=run_application, args=(reading_ring.name, reading_condition))
+    tornado_process = multiprocessing.Process(
+        target=run_tornado_server, args=(reading_ring.name, reading_condition))
+
+    acquisition_process.start()
 
     gui_process.start()
 
@@ -42,4 +77,8 @@ if __name__ == "__main__":
     print("GUI has completed")
     tornado_process.join()
 
+    acquisition_stop.set()
+    acquisition_process.join()
+    reading_ring.close()
+
     print("Exiting Application")
@@ -0,0 +1,180 @@
+"""acquisition.py: This is the python module for the background sensor acquisition
+
+This python module is used to read the temperature sensor off the GUI thread
+and the Tornado IOLoop. An acquisition worker thread owns the sensor, reads it
+on a fixed schedule that respects the 2 second minimum between DHT22 reads and
+publishes every result into a latest-value slot and a bounded history. Callers
+get the latest reading immediately, together with its age and the sensor
+status, and never wait on the hardware. When the GUI and the web server run
+as separate processes, the worker runs in its own acquisition process and
+also writes its readings to a shared-memory ReadingRing (see reading_ring.py).
+Readings are published raw and, when the worker has a SignalConditioner (see
+filters.py), filtered as well.
+
+"""
+import collections
+import threading
+import time
+
+from src.reading import Reading
+
+# DHT22 sensors need 2 seconds between reads (see SensorDriver.minimum_interval)
+MINIMUM_READ_INTERVAL = 2.0
+
+# Seconds between the end of one read and the start of the next
+DEFAULT_READ_INTERVAL = 2.5
+
+# Successful readings kept in the history
+DEFAULT_HISTORY_SIZE = 100
+
+
+class AcquisitionWorker(threading.Thread):
+    """ Background thread that owns a sensor and publishes its readings
+    """
+
+    def __init__(self, sensor, interval=DEFAULT_READ_INTERVAL, history_size=DEFAULT_HISTORY_SIZE,
+                 ring=None, conditioner=None):
+        """Initializes the worker, the sensor is read once the thread is started
+
+        Args:
+            sensor: sensor to read (DHT22Sensor), only used by this thread
+            interval: seconds between reads, at least the minimum interval of
+                the sensor driver
+            history_size: number of successful readings kept in the history
+            ring: ReadingRing the readings are also written to (the worker is
+                its only writer)
+            conditioner: SignalConditioner filtering the readings (None
+                publishes the raw values as the filtered ones)
+        """
+        super().__init__(name="acquisition", daemon=True)
+
+        self.sensor = sensor
+        self.ring = ring
+        self.conditioner = conditioner
+        self.interval = max(interval, getattr(sensor, "minimum_interval", MINIMUM_READ_INTERVAL))
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+        # Latest-value slot: last successful reading and the current sensor status
+        self.latest = Reading("Warming Up", sequence=0)
+        self.sequence = 0  # Number of successful readings
+
+        self.history = collections.deque(maxlen=history_size)
+
+        self.metrics = {
+            "reads": 0,
+            "failures": 0,
+            "last_read_seconds": 0.0,
+            "max_read_seconds": 0.0,
+        }
+
+    def run(self):
+        """ Reads the sensor every interval until stopped """
+        # Sleep through the warm up of the sensor
+        self.stop_event.wait(self.sensor.time_until_ready())
+
+        while not self.stop_event.is_set():
+            start_time = time.monotonic()
+            result = self.sensor.get_current_reading()
+            self.publish(result, time.monotonic() - start_time)
+
+            # Failed reads are retried after the backoff of the sensor retry policy
+            if result.status == "New":
+                self.stop_event.wait(self.interval)
+            else:
+                self.stop_event.wait(self.sensor.time_until_next_read())
+
+    def publish(self, result, read_seconds):
+        """ Stores the result of a sensor read in the slot and the history
+
+        Args:
+            result: Reading from DHT22Sensor.get_current_reading
+            read_seconds: time the read took
+        """
+        filtered_temperature, filtered_humidity = result.temperature, result.humidity
+        if result.status == "New" and self.conditioner is not None:
+            filtered_temperature, filtered_humidity = self.conditioner.update(
+                result.temperature, result.humidity, result.monotonic)
+
+        if result.status == "New" and self.ring is not None:
+            self.ring.write("Ready", result.temperature, result.humidity,
+                            filtered_temperature, filtered_humidity,
+                            result.ts, result.monotonic)
+        elif result.status != "Busy" and self.ring is not None:
+            self.ring.write(result.status)
+
+        with self.lock:
+            if result.status == "New":
+                # Readings are immutable, the history keeps the published tuple itself
+                self.sequence += 1
+                self.latest = result._replace(
+                    status="Ready", sequence=self.sequence,
+                    filtered_temperature=filtered_temperature,
+                    filtered_humidity=filtered_humidity)
+                self.history.append(self.latest)
+            elif result.status != "Busy":
+                # Keep the last reading, only the status changes
+                self.latest = self.latest._replace(status=result.status)
+
+            if result.status in ("New", "Unavailable", "Offline"):
+                # The hardware was read
+                self.metrics["reads"] += 1
+                self.metrics["last_read_seconds"] = read_seconds
+                self.metrics["max_read_seconds"] = max(
+                    self.metrics["max_read_seconds"], read_seconds)
+                if result.status != "New":
+                    self.metrics["failures"] += 1
+
+    def get_latest(self):
+        """ Gets the latest reading without waiting for the sensor
+
+        Returns:
+            Reading: status of the sensor ('Warming Up', 'Ready', 'Unavailable'
+            or 'Offline'), epoch ts and monotonic time, raw temperature (celsius)
+            and humidity of the last successful reading (None before the first)
+            with their filtered values and its sequence number (see
+            Reading.age for its age)
+        """
+        with self.lock:
+            return self.latest
+
+    def get_history(self, num_of_readings=None):
+        """ Gets the most recent successful readings (Readings), oldest first
+
+        Args:
+            num_of_readings: maximum number of readings (default the whole history)
+        """
+        with self.lock:
+            readings = list(self.history)
+
+        if num_of_readings is not None:
+            readings = readings[-num_of_readings:] if num_of_readings > 0 else []
+
+        return readings
+
+    def when_ready(self, callback):
+        """ Calls callback once the sensor has warmed up (see DHT22Sensor.when_ready) """
+        self.sensor.when_ready(callback)
+
+    def get_metrics(self):
+        """ Gets the acquisition metrics
+
+        Returns:
+            dict: hardware 'reads' and 'failures' since start up, duration of
+            the last and the slowest read, the number of readings published and
+            the read telemetry of the 'sensor' (see DHT22Sensor.get_read_metrics)
+        """
+        with self.lock:
+            metrics = dict(self.metrics)
+            metrics["readings"] = self.sequence
+
+        metrics["sensor"] = self.sensor.get_read_metrics()
+
+        return metrics
+
+    def stop(self, timeout=None):
+        """ Stops the worker after the current read and waits for the thread """
+        self.stop_event.set()
+
+        if self.is_alive():
+            self.join(timeout)
@@ -0,0 +1,247 @@
+"""adaptive_sampling.py: This is the python module for the adaptive logging interval
+
+This python module is used to choose how long the GUI waits before logging
+the next measurement. A fixed interval over-samples a stable room and
+under-samples a temperature racing toward an alarm, so the sampler looks at
+every logged (filtered) reading and picks the next interval from:
+
+ - the rate of change of temperature and humidity: the faster the reading
+   moves, the shorter the interval
+ - the nearness of the reading to the alarm thresholds: inside the alarm
+   margin the interval shrinks toward the minimum
+ - the time until a threshold is crossed at the current rate: at least two
+   readings are logged before it is reached
+
+The interval never drops below the minimum interval of the sensor (2 seconds
+for the DHT22) and, once things are quiet, grows back by at most the backoff
+factor per reading up to the maximum interval. Every decision is printed.
+
+The sampler is set in the sensor configuration file, e.g.
+    {"Sampling": {"Adaptive": true, "MinInterval": 2.0, "MaxInterval": 60.0,
+                  "Interval": 15.0, "TemperatureRate": 0.5, "HumidityRate": 2.0,
+                  "TemperatureMargin": 2.0, "HumidityMargin": 5.0, "Backoff": 1.5,
+                  "RateWindow": 30.0}}
+
+"""
+import collections
+import math
+
+from src.sensor_drivers import DHT22_MINIMUM_INTERVAL
+
+# Default sampling settings, rates are per minute, margins in celsius and percent
+DEFAULT_SAMPLING_CONFIGURATION = {
+    "Adaptive": True,
+    "MinInterval": DHT22_MINIMUM_INTERVAL,
+    "MaxInterval": 60.0,
+    "Interval": 15.0,
+    "TemperatureRate": 0.5,
+    "HumidityRate": 2.0,
+    "TemperatureMargin": 2.0,
+    "HumidityMargin": 5.0,
+    "Backoff": 1.5,
+    "RateWindow": 30.0,
+}
+
+# Fraction of the fast rates below which a change is sensor noise, not a trend
+QUIET_RATE_FRACTION = 0.25
+
+
+class AdaptiveSampler:
+    """ Picks the logging interval from the dynamics and alarm proximity of the readings
+    """
+
+    def __init__(self, min_interval=DHT22_MINIMUM_INTERVAL, max_interval=60.0, interval=15.0,
+                 temperature_rate=0.5, humidity_rate=2.0, temperature_margin=2.0,
+                 humidity_margin=5.0, backoff=1.5, rate_window=30.0, adaptive=True):
+        """Initializes the sampler
+
+        Args:
+            min_interval: shortest interval in seconds (the sensor floor)
+            max_interval: longest interval in seconds, used when things are quiet
+            interval: starting interval in seconds, and the fixed interval when
+                adaptive is off
+            temperature_rate: celsius per minute at which the minimum interval is used
+            humidity_rate: percent per minute at which the minimum interval is used
+            temperature_margin: celsius from an alarm threshold inside which the
+                interval shrinks
+            humidity_margin: percent from an alarm threshold inside which the
+                interval shrinks
+            backoff: largest factor the interval grows by per reading
+            rate_window: seconds the rates are taken over at short intervals, so
+                the 0.1 degree steps of the sensor do not read as fast changes
+            adaptive: False keeps the interval fixed
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        self.temperature_rate = temperature_rate
+        self.humidity_rate = humidity_rate
+        self.temperature_margin = temperature_margin
+        self.humidity_margin = humidity_margin
+        self.backoff = backoff
+        self.rate_window = rate_window
+        self.adaptive = adaptive
+
+        # Recent readings (temperature, humidity, monotonic time) the rates are taken from
+        self.readings = collections.deque()
+
+        self.metrics = {
+            "decisions": 0,
+            "faster": 0,
+            "slower": 0,
+            "at_minimum": 0,
+            "total_interval": 0.0,
+        }
+
+    @classmethod
+    def from_configuration(cls, configuration=None):
+        """ Creates the sampler of a sensor configuration
+
+        Args:
+            configuration: dict with the optional 'Sampling' settings ('Adaptive',
+                'MinInterval', 'MaxInterval', 'Interval', 'TemperatureRate',
+                'HumidityRate', 'TemperatureMargin', 'HumidityMargin', 'Backoff',
+                'RateWindow')
+        """
+        settings = dict(DEFAULT_SAMPLING_CONFIGURATION)
+        settings.update((configuration or {}).get("Sampling", {}))
+
+        return cls(
+            min_interval=settings["MinInterval"],
+            max_interval=settings["MaxInterval"],
+            interval=settings["Interval"],
+            temperature_rate=settings["TemperatureRate"],
+            humidity_rate=settings["HumidityRate"],
+            temperature_margin=settings["TemperatureMargin"],
+            humidity_margin=settings["HumidityMargin"],
+            backoff=settings["Backoff"],
+            rate_window=settings["RateWindow"],
+            adaptive=settings["Adaptive"])
+
+    def reset(self, interval=None):
+        """ Forgets the readings seen so far (e.g. when logging restarts) """
+        self.readings.clear()
+        if interval is not None:
+            self.interval = min(max(interval, self.min_interval), self.max_interval)
+
+    def update(self, temperature, humidity, timestamp, temperature_limits, humidity_limits):
+        """ Adds a logged reading and picks the interval until the next one
+
+        Args:
+            temperature: reading in celsius
+            humidity: humidity percentage
+            timestamp: monotonic time of the reading in seconds
+            temperature_limits: (low, high) alarm thresholds in celsius
+            humidity_limits: (low, high) alarm thresholds in percent
+
+        Returns:
+            float: seconds until the next reading is logged
+        """
+        if not self.adaptive:
+            return self.interval
+
+        # Rates per second since the oldest reading of the rate window, or the last
+        # reading if it is older (none for the first or a repeated reading)
+        while len(self.readings) > 1 and self.readings[0][2] < timestamp - self.rate_window:
+            self.readings.popleft()
+
+        temperature_rate, humidity_rate = 0.0, 0.0
+        if self.readings and timestamp > self.readings[0][2]:
+            elapsed = timestamp - self.readings[0][2]
+            temperature_rate = (temperature - self.readings[0][0]) / elapsed
+            humidity_rate = (humidity - self.readings[0][1]) / elapsed
+
+        if not self.readings or timestamp > self.readings[-1][2]:
+            self.readings.append((temperature, humidity, timestamp))
+
+        temperature_margin = distance_to_limits(temperature, temperature_limits)
+        humidity_margin = distance_to_limits(humidity, humidity_limits)
+
+        # Urgency from 0 (quiet) to 1 (sample as fast as the sensor allows)
+        rate = max(abs(temperature_rate) * 60 / self.temperature_rate,
+                   abs(humidity_rate) * 60 / self.humidity_rate)
+        urgencies = {
+            "rate": (rate - QUIET_RATE_FRACTION) / (1 - QUIET_RATE_FRACTION),
+            "alarm": max(1 - temperature_margin / self.temperature_margin,
+                         1 - humidity_margin / self.humidity_margin),
+        }
+        reason = max(urgencies, key=urgencies.get)
+        urgency = min(max(urgencies[reason], 0.0), 1.0)
+        if urgency == 0.0:
+            reason = "quiet"
+
+        # Geometric between the maximum (urgency 0) and the minimum interval (urgency 1)
+        target = self.max_interval * (self.min_interval / self.max_interval) ** urgency
+
+        # Log at least twice before a threshold is reached at the current rate
+        time_to_alarm = min(
+            time_to_limits(temperature, temperature_rate, temperature_limits),
+            time_to_limits(humidity, humidity_rate, humidity_limits))
+        if 0 < time_to_alarm / 2 < target:
+            target = time_to_alarm / 2
+            reason = "approach"
+
+        # Speed up at once, slow down gradually
+        target = min(max(target, self.min_interval), self.max_interval, self.interval * self.backoff)
+
+        print("Sampling: {:.1f}s -> {:.1f}s ({}, {:+.2f} C/min, {:+.2f} %/min, "
+              "alarm margin {:.1f} C/{:.1f} %)".format(
+                  self.interval, target, reason, temperature_rate * 60, humidity_rate * 60,
+                  temperature_margin, humidity_margin))
+
+        self.metrics["decisions"] += 1
+        self.metrics["total_interval"] += target
+        if target < self.interval:
+            self.metrics["faster"] += 1
+        elif target > self.interval:
+            self.metrics["slower"] += 1
+        if target <= self.min_interval:
+            self.metrics["at_minimum"] += 1
+
+        self.interval = target
+
+        return self.interval
+
+    def get_metrics(self):
+        """ Gets the sampler metrics
+
+        Returns:
+            dict: 'decisions' made, how many were 'faster' or 'slower' than
+            the interval before and 'at_minimum', the 'mean_interval' and the
+            current 'interval' in seconds
+        """
+        metrics = dict(self.metrics)
+        total_interval = metrics.pop("total_interval")
+        metrics["mean_interval"] = total_interval / metrics["decisions"] if metrics["decisions"] else None
+        metrics["interval"] = self.interval
+
+        return metrics
+
+
+def distance_to_limits(value, limits):
+    """ Gets the distance of a value to the nearest of its (low, high) limits
+
+    Returns:
+        float: distance, negative outside the limits
+    """
+    low, high = limits
+
+    return min(value - low, high - value)
+
+
+def time_to_limits(value, rate, limits):
+    """ Gets the seconds until a value moving at rate (per second) reaches one of its limits
+
+    Returns:
+        float: seconds, 0 outside the limits and infinity when moving away from them
+    """
+    low, high = limits
+
+    if not low < value < high:
+        return 0.0
+    if rate > 0:
+        return (high - value) / rate
+    if rate < 0:
+        return (value - low) / -rate
+
+    return math.inf
@@ -0,0 +1,319 @@
+"""archive.py: This is the python module for the columnar measurement archive
+
+This python module is used to archive the SensorData measurements of closed
+days or months into time-partitioned columnar files for offline analysis.
+Partitions are written as Parquet files when pyarrow is installed, otherwise
+as a directory with one NumPy .npy file per column. Both formats are read back
+memory-mapped, so multi-year ranges load without parsing rows.
+
+Rows are read through the streaming cursor path (iter_measurements) and each
+chunk is converted to column arrays in one vectorized step. Partitions are
+written to a temporary name and renamed into place, so a crash never leaves a
+partial partition behind.
+
+Run from the repository root:
+    python3 -m src.archive write --directory archive [--period month]
+    python3 -m src.archive read --directory archive --start 1571600000 --end 1574200000
+
+"""
+import argparse
+import datetime
+import os
+import shutil
+import time
+
+import numpy as np
+
+from src.database import EXPORT_CHUNK_SIZE, MEASUREMENT_COLUMNS, TemperatureDatabase
+from src.storage import DATABASE_CONFIGURATION_FILE, load_database_configuration
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Array type of each archived column
+ARCHIVE_DTYPES = {
+    "id": np.int64,
+    "temperature": np.float32,
+    "humidity": np.float32,
+    "ts": np.float64,
+    "sensor_id": np.int32,
+}
+
+# Partition name format per archive period (UTC)
+PARTITION_FORMATS = {
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+
+def partition_start(timestamp, period):
+    """ Gets the start of the day or month (UTC) holding a time
+
+    Args:
+        timestamp: epoch seconds
+        period: 'day' or 'month'
+
+    Returns:
+        datetime: start of the partition
+    """
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+    if period == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "month":
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    raise ValueError("Unknown archive period: {}".format(period))
+
+
+def next_partition_start(start, period):
+    """ Gets the start of the partition following the one starting at start """
+    if period == "day":
+        return start + datetime.timedelta(days=1)
+
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+
+    return start.replace(month=start.month + 1)
+
+
+def rows_to_columns(rows):
+    """ Converts measurement rows to column arrays in one vectorized step
+
+    Args:
+        rows: MEASUREMENT_COLUMNS tuples
+
+    Returns:
+        dict: column name to NumPy array
+    """
+    table = np.array(rows, dtype=np.float64).reshape(-1, len(MEASUREMENT_COLUMNS))
+
+    return dict(
+        (column, table[:, index].astype(ARCHIVE_DTYPES[column]))
+        for index, column in enumerate(MEASUREMENT_COLUMNS)
+    )
+
+
+class MeasurementArchive:
+    """ Directory of time-partitioned columnar measurement files
+    """
+
+    def __init__(self, directory, period="day", archive_format=None):
+        """Initializes the archive
+
+        Args:
+            directory: archive directory (created if missing)
+            period: partition size, 'day' or 'month'
+            archive_format: 'parquet' or 'npy' (default parquet when pyarrow
+                is installed)
+        """
+        if period not in PARTITION_FORMATS:
+            raise ValueError("Unknown archive period: {}".format(period))
+
+        if archive_format is None:
+            archive_format = "parquet" if pyarrow is not None else "npy"
+        if archive_format == "parquet" and pyarrow is None:
+            raise ValueError("Parquet archives need pyarrow installed")
+        if archive_format not in ("parquet", "npy"):
+            raise ValueError("Unknown archive format: {}".format(archive_format))
+
+        self.directory = directory
+        self.period = period
+        self.archive_format = archive_format
+
+        os.makedirs(directory, exist_ok=True)
+
+    def partition_path(self, start):
+        """ Gets the path of the partition starting at start """
+        name = "{}_{}".format(self.period, start.strftime(PARTITION_FORMATS[self.period]))
+
+        if self.archive_format == "parquet":
+            return os.path.join(self.directory, name + ".parquet")
+
+        return os.path.join(self.directory, name)
+
+    def partition_exists(self, start):
+        """ Checks if the partition starting at start was archived """
+        return os.path.exists(self.partition_path(start))
+
+    def write(self, database, overwrite=False, chunk_size=EXPORT_CHUNK_SIZE, now=None):
+        """ Archives every closed partition of the stored measurements
+
+        The partition holding the current time is still being written to and
+        is left for a later run. Empty partitions are not written.
+
+        Args:
+            database: TemperatureDatabase to archive
+            overwrite: rewrite partitions that were already archived
+            chunk_size: rows read from the database at a time
+            now: current epoch time (default time.time())
+
+        Returns:
+            dict: number of partitions 'written' and 'skipped' and 'rows' archived
+        """
+        archive_results = {"written": 0, "skipped": 0, "rows": 0}
+        first_ts, _ = database.get_time_bounds()
+
+        if first_ts is None:
+            return archive_results
+
+        start = partition_start(first_ts, self.period)
+        current = partition_start(time.time() if now is None else now, self.period)
+
+        while start < current:
+            end = next_partition_start(start, self.period)
+
+            if self.partition_exists(start) and not overwrite:
+                archive_results["skipped"] += 1
+            else:
+                num_of_rows = self.write_partition(
+                    database, start, end.timestamp(), chunk_size)
+                if num_of_rows:
+                    archive_results["written"] += 1
+                    archive_results["rows"] += num_of_rows
+
+            start = end
+
+        return archive_results
+
+    def write_partition(self, database, start, end, chunk_size=EXPORT_CHUNK_SIZE):
+        """ Writes the measurements of one partition
+
+        Args:
+            database: TemperatureDatabase to archive
+            start: partition start (datetime)
+            end: partition end, exclusive (epoch seconds)
+            chunk_size: rows read from the database at a time
+
+        Returns:
+            int: number of rows written
+        """
+        chunks = [
+            rows_to_columns(chunk)
+            for chunk in database.iter_measurements(start.timestamp(), end, chunk_size)
+        ]
+
+        if not chunks:
+            return 0
+
+        columns = dict(
+            (column, np.concatenate([chunk[column] for chunk in chunks]))
+            for column in MEASUREMENT_COLUMNS
+        )
+
+        path = self.partition_path(start)
+        temporary_path = path + ".tmp"
+
+        if self.archive_format == "parquet":
+            table = pyarrow.table(columns)
+            pyarrow.parquet.write_table(table, temporary_path)
+            os.replace(temporary_path, path)
+        else:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            os.makedirs(temporary_path)
+            for column, values in columns.items():
+                np.save(os.path.join(temporary_path, column + ".npy"), values)
+
+            # Directories cannot replace each other, drop the old partition first
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(temporary_path, path)
+
+        return len(columns["id"])
+
+    def read_partition(self, start, columns):
+        """ Memory-maps the columns of one archived partition
+
+        Returns:
+            dict: column name to (read-only) NumPy array
+        """
+        path = self.partition_path(start)
+
+        if self.archive_format == "parquet":
+            table = pyarrow.parquet.read_table(path, columns=list(columns), memory_map=True)
+            return dict(
+                (column, table.column(column).to_numpy()) for column in columns
+            )
+
+        return dict(
+            (column, np.load(os.path.join(path, column + ".npy"), mmap_mode="r"))
+            for column in columns
+        )
+
+    def load(self, start, end, columns=MEASUREMENT_COLUMNS):
+        """ Loads the archived measurements of a time range into arrays
+
+        Args:
+            start: start of the range, inclusive (epoch seconds)
+            end: end of the range, exclusive (epoch seconds)
+            columns: archived columns to load (subset of MEASUREMENT_COLUMNS)
+
+        Returns:
+            dict: column name to NumPy array, ordered by time
+        """
+        for column in columns:
+            if column not in MEASUREMENT_COLUMNS:
+                raise ValueError("Unknown measurement column: {}".format(column))
+
+        # ts is needed to trim the first and last partition
+        read_columns = tuple(columns) + (() if "ts" in columns else ("ts",))
+        parts = []
+
+        partition = partition_start(start, self.period)
+        while partition.timestamp() < end:
+            if self.partition_exists(partition):
+                arrays = self.read_partition(partition, read_columns)
+                inside = (arrays["ts"] >= start) & (arrays["ts"] < end)
+
+                if inside.all():
+                    parts.append(arrays)
+                else:
+                    parts.append(dict(
+                        (column, values[inside]) for column, values in arrays.items()))
+
+            partition = next_partition_start(partition, self.period)
+
+        return dict(
+            (column, np.concatenate([part[column] for part in parts])
+             if parts else np.empty(0, dtype=ARCHIVE_DTYPES[column]))
+            for column in columns
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar SensorData archive")
+    parser.add_argument("action", choices=("write", "read"))
+    parser.add_argument("--directory", default="archive")
+    parser.add_argument("--period", choices=sorted(PARTITION_FORMATS), default="day")
+    parser.add_argument("--format", choices=("parquet", "npy"),
+                        help="partition file format (default parquet if pyarrow is installed)")
+    parser.add_argument("--configuration", default=DATABASE_CONFIGURATION_FILE)
+    parser.add_argument("--overwrite", action="store_true",
+                        help="rewrite partitions that were already archived")
+    parser.add_argument("--start", type=float, help="first epoch time read")
+    parser.add_argument("--end", type=float, help="epoch time reading stops at")
+    args = parser.parse_args()
+
+    measurement_archive = MeasurementArchive(args.directory, args.period, args.format)
+    start_time = time.perf_counter()
+
+    if args.action == "write":
+        sys_db = TemperatureDatabase.from_configuration(
+            load_database_configuration(args.configuration))
+        try:
+            results = measurement_archive.write(sys_db, overwrite=args.overwrite)
+        finally:
+            sys_db.close_connection()
+
+        print("Archived {rows} rows in {written} partitions ({skipped} already archived)".format(
+            **results))
+    else:
+        arrays = measurement_archive.load(args.start or 0, args.end or time.time())
+        print("Loaded {} rows".format(len(arrays["ts"])))
+        if len(arrays["ts"]):
+            print("Temperature mean {:.2f}, humidity mean {:.2f}".format(
+                arrays["temperature"].mean(), arrays["humidity"].mean()))
+
+    print("Done in {:.2f}s".format(time.perf_counter() - start_time))
@@ -0,0 +1,133 @@
+"""async_database.py: This is the python module for non-blocking database access
+
+This python module is used by the web server to query the database without
+blocking the Tornado IOLoop. Queries run on a bounded thread pool with a
+connection borrowed from the shared DatabasePool and are awaited by the
+handlers, so the latency of concurrent clients overlaps instead of adding up.
+
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
+
+from src.database import EXPORT_CHUNK_SIZE, MEASUREMENT_COLUMNS, TemperatureDatabase
+
+
+class AsyncTemperatureDatabase:
+    """ Awaitable TemperatureDatabase queries backed by a connection pool
+    """
+
+    def __init__(self, db_pool, max_workers=None, max_pending=100):
+        """Initializes the executor used to run queries
+
+        Args:
+            db_pool: DatabasePool the queries borrow connections from
+            max_workers: executor threads (default pool size, so every worker
+                can hold a connection)
+            max_pending: queries allowed to queue before callers wait
+        """
+        self.db_pool = db_pool
+        self.max_workers = max_workers or db_pool.max_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="database")
+
+        # Bounds the executor queue, extra callers wait on the IOLoop
+        self.pending_limit = Semaphore(max_pending)
+
+    async def run(self, function, *args, **kwargs):
+        """ Runs function(database, *args, **kwargs) on an executor thread
+
+        Args:
+            function: callable taking a TemperatureDatabase as first argument
+
+        Returns:
+            result of function
+        """
+        call = functools.partial(self._call, function, args, kwargs)
+
+        async with self.pending_limit:
+            return await IOLoop.current().run_in_executor(self.executor, call)
+
+    def _call(self, function, args, kwargs):
+        """ Borrows a pooled connection and runs function (executor thread) """
+        with self.db_pool.connection() as database:
+            return function(database, *args, **kwargs)
+
+    async def get_recent(self, num_of_measurements, since_id=None, columns=MEASUREMENT_COLUMNS,
+                         sensor_id=None):
+        """ Awaitable TemperatureDatabase.get_recent """
+        return await self.run(
+            TemperatureDatabase.get_recent, num_of_measurements, since_id, columns, sensor_id)
+
+    async def get_range(self, start, end, columns=MEASUREMENT_COLUMNS, sensor_id=None):
+        """ Awaitable TemperatureDatabase.get_range """
+        return await self.run(TemperatureDatabase.get_range, start, end, columns, sensor_id)
+
+    async def get_aggregates(self, start, end, bucket, sensor_id=None):
+        """ Awaitable TemperatureDatabase.get_aggregates """
+        return await self.run(TemperatureDatabase.get_aggregates, start, end, bucket, sensor_id)
+
+    async def get_history(self, start, end, max_points=500, sensor_id=None):
+        """ Awaitable TemperatureDatabase.get_history """
+        return await self.run(TemperatureDatabase.get_history, start, end, max_points, sensor_id)
+
+    async def get_sensors(self, hub_id=None):
+        """ Awaitable TemperatureDatabase.get_sensors """
+        return await self.run(TemperatureDatabase.get_sensors, hub_id)
+
+    async def get_measurement(self, id_number):
+        """ Awaitable TemperatureDatabase.get_measurement """
+        return await self.run(TemperatureDatabase.get_measurement, id_number)
+
+    async def get_last_measurement_id(self):
+        """ Awaitable TemperatureDatabase.get_last_measurement_id """
+        return await self.run(TemperatureDatabase.get_last_measurement_id)
+
+    async def get_all_measurements(self):
+        """ Awaitable TemperatureDatabase.get_all_measurements """
+        return await self.run(TemperatureDatabase.get_all_measurements)
+
+    async def iter_measurements(self, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE,
+                                columns=MEASUREMENT_COLUMNS, sensor_id=None):
+        """ Async generator over TemperatureDatabase.iter_measurements
+
+        A pooled connection is held until the generator is exhausted or
+        closed, every chunk is fetched on an executor thread.
+        """
+        loop = IOLoop.current()
+
+        async with self.pending_limit:
+            database = await loop.run_in_executor(self.executor, self.db_pool.acquire)
+
+        chunks = database.iter_measurements(start, end, chunk_size, columns, sensor_id)
+        failed = False
+
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+
+                yield chunk
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # Also runs when the consumer stops early (generator closed)
+            await loop.run_in_executor(
+                self.executor, self._close_stream, database, chunks, failed)
+
+    def _close_stream(self, database, chunks, failed):
+        """ Closes a measurement stream and gives back its connection (executor thread) """
+        chunks.close()
+
+        if failed and not database.check_connection():
+            self.db_pool.discard(database)
+        else:
+            self.db_pool.release(database)
+
+    def close(self):
+        """ Stops the executor once queued queries are done """
+        self.executor.shutdown(wait=True)
@@ -160,6 +160,28 @@ class AWSHandler:
         else:
             print('AWS is not initialized. Please intialize and re-send!')
 
+    def publish_readings(self, topic, batch):
+        ''' Sends the successful readings of a batch as one 'Readings' message
+
+        The readings are sent as columns (one list per field) taken from the
+        batch array instead of one message per reading.
+        '''
+        readings = batch.successful()
+
+        # Nothing to send without readings
+        if not len(readings):
+            return
+
+        msg_payload = {}
+        msg_payload['Command'] = 'Readings'
+        msg_payload['Units'] = 'Celsius'
+        msg_payload['SensorId'] = readings.sensor_id.tolist()
+        msg_payload['Temperature'] = readings.temperature.round(1).tolist()
+        msg_payload['Humidity'] = readings.humidity.round(1).tolist()
+        msg_payload['Timestamp'] = readings.ts.tolist()
+
+        self.send_message(topic, msg_payload)
+
 
 if __name__ == '__main__':
     aws_handler = AWSHandler()
@@ -172,7 +194,7 @@ if __name__ == '__main__':
     msg_payload['Command'] = 'Temperature Alarm'
     msg_payload['Temperature'] = '136'
     msg_payload['Units'] = 'Celsius'
-    msg_payload['Timestamp'] = '10/20/2019 4:16:23'
+    msg_payload['Timestamp'] = 1571602583.0
     msg_payload['Trigger'] = '80'
 
     aws_handler.send_message('temperature', msg_payload)
@@ -182,6 +204,6 @@ if __name__ == '__main__':
     msg_payload['Temperature'] = '70'
     msg_payload['Units'] = 'Celsius'
     msg_payload['Humidity'] = '30'
-    msg_payload['Timestamp'] = '10/20/2019 4:16:23'
+    msg_payload['Timestamp'] = 1571602583.0
 
     aws_handler.send_message('temperature', msg_payload)
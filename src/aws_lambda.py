@@ -18,6 +18,9 @@ def lambda_handler(event, context):
     if payload['Command'] == 'Reading':
         print('Received a reading')
         data_handler(payload)
+    elif payload['Command'] == 'Readings':
+        print('Received a batch of readings')
+        batch_data_handler(payload)
     elif payload['Command'] == 'Temperature Alarm':
         print('Received Temperature Alarm!')
         send_temperature_alarm(payload)
@@ -78,9 +81,30 @@ def data_handler(payload):
     queue_message['Humidity'] = payload['Humidity']
     queue_message['Timestamp'] = payload['Timestamp']
     
+    # Sensor of the reading (only sent by hubs with several sensors)
+    if payload.get('SensorId') is not None:
+        queue_message['SensorId'] = payload['SensorId']
+    
     queue_string = json.dumps(queue_message)
     
     # Create a new message
     response = sqs.send_message(QueueUrl=sqs_queue_url, MessageBody=queue_string)
     
     print('Storing data in SQS')
+
+
+def batch_data_handler(payload):
+    
+    # Sensor of each reading, None for batches sent without one
+    sensor_ids = payload.get('SensorId') or [None] * len(payload['Timestamp'])
+    
+    # Each reading of the batch goes to SQS like a single reading
+    for temperature, humidity, timestamp, sensor_id in zip(
+            payload['Temperature'], payload['Humidity'], payload['Timestamp'], sensor_ids):
+        data_handler({
+            'Temperature': '{:.1f}'.format(temperature),
+            'Units': payload['Units'],
+            'Humidity': '{:.1f}'.format(humidity),
+            'Timestamp': timestamp,
+            'SensorId': sensor_id,
+        })
@@ -308,6 +308,14 @@ $(document).ready(function () {
     updateSQSTable();
   };
 
+  // Formats an epoch timestamp in seconds for display
+  function formatTimestamp(timestamp) {
+    if (typeof timestamp === "number") {
+      return new Date(timestamp * 1000).toLocaleString();
+    }
+    return timestamp;
+  };
+
   function updateSQSTable() {
     var i;
     // Update Datasets
@@ -323,8 +331,8 @@ $(document).ready(function () {
       // Update Humidity
       document.getElementById("humidity"+i.toString()).innerHTML = sqsData[i-1].Humidity + "%";
 
-      // Update Timestamp
-      document.getElementById("timestamp"+i.toString()).innerHTML = sqsData[i-1].Timestamp;
+      // Update Timestamp (epoch seconds, older messages carry a formatted string)
+      document.getElementById("timestamp"+i.toString()).innerHTML = formatTimestamp(sqsData[i-1].Timestamp);
     };
   };
 
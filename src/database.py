@@ -1,83 +1,953 @@
 """database.py: This is the python module for the database functions of the application
 
-This python module is used to interface with the mysql database storing the
+This python module is used to interface with the database storing the
 temperature and humidity readings. This contains a class to provide a list of
 useful functionsthat the main application can use to manipulate and interface
-with the database
+with the database. The database engine (MySQL or SQLite) is a storage backend
+selected with the database configuration (see storage.py)
 
 """
-import pymysql
+import argparse
+import collections
+import datetime
+import time
+
+from src.reading import DEFAULT_SENSOR_ID
+from src.reading_cache import RecentReadingsCache
+from src.storage import (
+    MySQLBackend,
+    create_storage_backend,
+    load_database_configuration,
+)
+
+# Columns of the SensorData table in storage order
+MEASUREMENT_COLUMNS = ("id", "temperature", "humidity", "ts", "sensor_id")
+
+# Columns of the rows returned by get_aggregates
+AGGREGATE_COLUMNS = (
+    "bucket", "count",
+    "temperature_min", "temperature_max", "temperature_mean",
+    "humidity_min", "humidity_max", "humidity_mean",
+)
+
+# Current layout of the sensor tables (1 is the unversioned VARCHAR layout,
+# 2 the typed SensorData table, 3 adds the rollup tables, 4 the sensor_id
+# dimension and the Sensors registry)
+SCHEMA_VERSION = 4
+
+# Rows copied per transaction when migrating an existing table
+MIGRATION_BATCH_SIZE = 5000
+
+# Timestamp formats written by earlier versions of the application
+LEGACY_TIMESTAMP_FORMATS = ("%m/%d/%y %X", "%m/%d/%Y %X", "%m/%d/%y %X %p")
+
+SCHEMA_VERSION_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS SchemaVersion("
+    "version INT NOT NULL, applied_at DOUBLE NOT NULL, PRIMARY KEY (version))"
+)
+
+# Rollup tables and their bucket width in seconds, finest first
+ROLLUP_RESOLUTIONS = (
+    ("SensorData_1m", 60),
+    ("SensorData_1h", 3600),
+    ("SensorData_1d", 86400),
+)
+
+# Rows per chunk streamed by iter_measurements
+EXPORT_CHUNK_SIZE = 1000
+
+# Delays in seconds between attempts to reopen a broken connection
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+
+# Raw rows deleted per transaction by prune_measurements
+PRUNE_BATCH_SIZE = 5000
+
+# Raw rows folded into the rollups per transaction
+ROLLUP_BATCH_SIZE = 50000
+
+# Running count, sum, min and max per sensor and bucket (bucket is its start
+# epoch time), indexed by bucket for queries over all sensors
+ROLLUP_TABLE_DEFINITION = (
+    "sensor_id INT NOT NULL, "
+    "bucket DOUBLE NOT NULL, sample_count INT NOT NULL, "
+    "temperature_sum DOUBLE NOT NULL, temperature_min FLOAT NOT NULL, "
+    "temperature_max FLOAT NOT NULL, humidity_sum DOUBLE NOT NULL, "
+    "humidity_min FLOAT NOT NULL, humidity_max FLOAT NOT NULL, "
+    "PRIMARY KEY (sensor_id, bucket)"
+)
+
+# Columns of the rollup tables without sensor_id
+ROLLUP_VALUE_COLUMNS = (
+    "bucket, sample_count, temperature_sum, temperature_min, temperature_max, "
+    "humidity_sum, humidity_min, humidity_max"
+)
+
+# How each rollup column merges with the values of new measurements
+ROLLUP_MERGES = (
+    ("sample_count", "add"),
+    ("temperature_sum", "add"),
+    ("temperature_min", "min"),
+    ("temperature_max", "max"),
+    ("humidity_sum", "add"),
+    ("humidity_min", "min"),
+    ("humidity_max", "max"),
+)
+
+# Registry of the sensors readings come from, unique per hub
+SENSORS_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS Sensors("
+    "sensor_id {auto_id}, hub_id VARCHAR(64) NOT NULL, name VARCHAR(64) NOT NULL, "
+    "pin INT, created_at DOUBLE NOT NULL, UNIQUE (hub_id, name))"
+)
+
+# Hub and name of the default sensor
+DEFAULT_SENSOR = ("local", "DHT22")
+DEFAULT_SENSOR_PIN = 4
+
+# High-water marks: last SensorData id folded into the rollups ('rollups') and
+# last id deleted by prune_measurements ('pruned'), and the number of prune
+# batches committed ('prunes') so caches of other processes see the deletes
+ROLLUP_STATE_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS RollupState("
+    "name VARCHAR(32) NOT NULL, last_id INT NOT NULL, PRIMARY KEY (name))"
+)
+
+# Position reached in each imported file, written in the transaction of the
+# imported rows (see import_measurements)
+IMPORT_CHECKPOINT_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS ImportCheckpoint("
+    "source VARCHAR(255) NOT NULL, byte_offset BIGINT NOT NULL, "
+    "rows_imported BIGINT NOT NULL, updated_at DOUBLE NOT NULL, PRIMARY KEY (source))"
+)
+
+
+def to_epoch(timestamp):
+    """ Converts a reading timestamp to epoch seconds
+
+    Args:
+        timestamp: epoch seconds, datetime or a string in one of the legacy
+            formats ('%m/%d/%y %X')
+
+    Returns:
+        float: seconds since the epoch
+    """
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.timestamp()
+
+    if isinstance(timestamp, str):
+        for timestamp_format in LEGACY_TIMESTAMP_FORMATS:
+            try:
+                return datetime.datetime.strptime(timestamp, timestamp_format).timestamp()
+            except ValueError:
+                continue
+
+        raise ValueError("Unknown timestamp format: {}".format(timestamp))
+
+    return float(timestamp)
 
 
 class TemperatureDatabase:
-    """ Class that interfaces with the mysql database for the sensor data
+    """ Class that interfaces with the database for the sensor data
     """
 
-    def __init__(self, database_name, user, password, host="localhost"):
-        """Initializes the mysql database
+    def __init__(self, database_name=None, user=None, password=None, host="localhost",
+                 backend=None):
+        """Initializes the database
+
+        Either the MySQL parameters or a storage backend are given.
 
         Args:
-            database_name: database name on machine
-            user: user/login id to access database
-            password: password to identify user
-            host: where the database server is
+            database_name: MySQL database name on machine
+            user: MySQL user/login id to access database
+            password: MySQL password to identify user
+            host: where the MySQL database server is
+            backend: StorageBackend to use instead of MySQL with the parameters above
         """
         # Database Parameters
-        self.host = host
-        self.database_name = database_name
-        self.user = user
-        self.password = password
+        if backend is None:
+            backend = MySQLBackend(database_name, user, password, host)
+        self.backend = backend
         self.db_connection = None
         self.cursor = None
 
+        # Batched writer (disabled until enable_batched_writes is called)
+        self.write_buffer = None
+        self.batch_size = None
+        self.batch_max_age = None
+        self.max_buffered_rows = None
+        self.buffer_start_time = None
+        self.writer_counters = {
+            "buffered": 0, "flushed": 0, "dropped": 0, "flushes": 0, "spooled": 0}
+
+        # Fold new measurements into the rollup tables after every write
+        self.maintain_rollups = False
+
+        # Recent readings cache (disabled until enable_cache is called)
+        self.cache = None
+
+        # Spool for measurements that cannot be written (see enable_spool)
+        self.spool = None
+        self.connection_broken = False  # Last write failed, reconnect before the next
+        self.reconnect_delay = None
+        self.next_reconnect_time = 0.0
+
         # Open connection to database
         self.connect_to_database()
 
+    @classmethod
+    def from_configuration(cls, configuration=None):
+        """ Creates a database with the backend selected by a configuration
+
+        Args:
+            configuration: dict from load_database_configuration (default loads
+            the database configuration file)
+
+        Returns:
+            TemperatureDatabase: connected database
+        """
+        if configuration is None:
+            configuration = load_database_configuration()
+
+        return cls(backend=create_storage_backend(configuration))
+
     def connect_to_database(self):
         """ Function to connect to database
 
         Returns:
             bool: True if the database was connected, False if failed
         """
-        self.db_connection = pymysql.connect(
-            self.host, self.user, self.password, self.database_name
-        )
-        print("Opening Database")
+        self.db_connection = self.backend.connect()
+        print("Opening Database ({})".format(self.backend.name))
+
+        return True
+
+    def reconnect(self):
+        """ Reopens a broken connection, retried with exponential backoff
+
+        Returns:
+            bool: True if the connection works, False if it is still down or
+            the next attempt is not due yet
+        """
+        if self.check_connection():
+            self.connection_broken = False
+            self.reconnect_delay = None
+            return True
+
+        now = time.monotonic()
+        if now < self.next_reconnect_time:
+            return False
+
+        try:
+            self.db_connection.close()
+        except self.backend.Error:
+            pass
+
+        try:
+            self.connect_to_database()
+        except self.backend.Error as error:
+            if self.reconnect_delay is None:
+                self.reconnect_delay = RECONNECT_MIN_DELAY
+            else:
+                self.reconnect_delay = min(self.reconnect_delay * 2, RECONNECT_MAX_DELAY)
+            self.next_reconnect_time = now + self.reconnect_delay
+            print("Reconnect failed, next attempt in {:.0f}s: {}".format(
+                self.reconnect_delay, error))
+            return False
+
+        self.connection_broken = False
+        self.reconnect_delay = None
+        return True
+
+    def end_transaction(self):
+        """ Ends the current read transaction so later queries see new data
+
+        Used when a connection is reused, e.g. returned to a pool.
+        """
+        try:
+            self.db_connection.rollback()
+        except self.backend.Error:
+            pass
+
+    def check_connection(self):
+        """ Checks that the database connection is still alive
+
+        Returns:
+            bool: True if the database answered, False if the connection is broken
+        """
+        try:
+            self.db_connection.ping(reconnect=False)
+        except self.backend.Error:
+            return False
 
         return True
 
     def create_table(self):
-        """ Creates temperature table if it does not exist
+        """ Creates the sensor tables if they do not exist
+
+        Tables created by older versions are migrated in place, existing data
+        is never dropped.
+        """
+        with self.db_connection.cursor() as cursor:
+            cursor.execute(SCHEMA_VERSION_TABLE_SQL)
+
+        schema_version = self.get_schema_version()
+
+        if schema_version is None and self.table_exists("SensorData"):
+            self.migrate_legacy_table()
+            schema_version = 2
+
+        if schema_version is not None and schema_version < 4:
+            self.migrate_sensor_columns()
+
+        with self.db_connection.cursor() as cursor:
+            for sql in self.backend.sensor_data_table_sql("SensorData"):
+                cursor.execute(sql)
+            for table, _ in ROLLUP_RESOLUTIONS:
+                for sql in self.rollup_table_sql(table):
+                    cursor.execute(sql)
+            cursor.execute(ROLLUP_STATE_TABLE_SQL)
+            sql = "{} INTO RollupState (name, last_id) VALUES (%s, 0)".format(
+                self.backend.insert_ignore)
+            cursor.executemany(sql, [("rollups",), ("pruned",), ("prunes",)])
+
+            cursor.execute(SENSORS_TABLE_SQL.format(auto_id=self.backend.auto_id_sql))
+            sql = "{} INTO Sensors (sensor_id, hub_id, name, pin, created_at) VALUES (%s, %s, %s, %s, %s)".format(
+                self.backend.insert_ignore)
+            cursor.execute(sql, (DEFAULT_SENSOR_ID,) + DEFAULT_SENSOR + (DEFAULT_SENSOR_PIN, time.time()))
+
+            cursor.execute(IMPORT_CHECKPOINT_TABLE_SQL)
+
+        self.db_connection.commit()
+        self.invalidate_cache()
+
+        if schema_version is not None and schema_version < 3:
+            # Backfill the new rollup tables from the existing measurements
+            self.update_rollups()
+
+        if schema_version != SCHEMA_VERSION:
+            self.set_schema_version(SCHEMA_VERSION)
+
+        return True
+
+    def rollup_table_sql(self, table):
+        """ Gets the statements creating a rollup table """
+        return self.backend.create_table_sql(
+            table, ROLLUP_TABLE_DEFINITION, [("idx_{}_bucket".format(table), "bucket")])
+
+    def column_exists(self, table, column):
+        """ Checks if a table has a column
         """
         try:
-            cursor = self.db_connection.cursor()
-            sql = "CREATE TABLE SensorData(id INT NOT NULL AUTO_INCREMENT, temperature VARCHAR(5), humidity VARCHAR(5), timestamp VARCHAR(50), PRIMARY KEY (id))"
-            cursor.execute(sql)
-        except pymysql.InternalError:
-            # Delete table if already exists and retry
-            self.delete_table()
-            cursor = self.db_connection.cursor()
-            sql = "CREATE TABLE SensorData(id INT NOT NULL AUTO_INCREMENT, temperature VARCHAR(5), humidity VARCHAR(5), timestamp VARCHAR(50), PRIMARY KEY (id))"
-            cursor.execute(sql)
+            with self.db_connection.cursor() as cursor:
+                cursor.execute("SELECT {} FROM {} LIMIT 1".format(column, table))
+                cursor.fetchall()
+        except self.backend.Error:
+            self.db_connection.rollback()
+            return False
 
         return True
 
+    def migrate_sensor_columns(self):
+        """ Adds the sensor_id dimension to existing tables (schema version 4)
+
+        Existing measurements and rollup buckets are assigned to the default
+        sensor. The rollup tables change primary key, so each is copied into a
+        table with the new layout and swapped in; their history is kept even
+        where the raw measurements were already pruned.
+        """
+        print("Migrating sensor tables to schema version 4")
+
+        if not self.column_exists("SensorData", "sensor_id"):
+            with self.db_connection.cursor() as cursor:
+                cursor.execute(
+                    "ALTER TABLE SensorData ADD COLUMN sensor_id INT NOT NULL DEFAULT {}".format(
+                        DEFAULT_SENSOR_ID))
+                cursor.execute(
+                    "CREATE INDEX idx_SensorData_sensor_ts ON SensorData (sensor_id, ts)")
+
+            self.db_connection.commit()
+
+        for table, _ in ROLLUP_RESOLUTIONS:
+            if not self.table_exists(table) or self.column_exists(table, "sensor_id"):
+                continue
+
+            new_table = table + "_v4"
+            with self.db_connection.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS {}".format(new_table))
+                for sql in self.rollup_table_sql(new_table):
+                    cursor.execute(sql)
+                cursor.execute(
+                    "INSERT INTO {new_table} (sensor_id, {columns}) SELECT %s, {columns} FROM {table}".format(
+                        new_table=new_table, table=table, columns=ROLLUP_VALUE_COLUMNS),
+                    (DEFAULT_SENSOR_ID,))
+
+            self.db_connection.commit()
+
+            with self.db_connection.cursor() as cursor:
+                cursor.execute("DROP TABLE {}".format(table))
+                for sql in self.backend.rename_tables_sql(((new_table, table),)):
+                    cursor.execute(sql)
+
+            self.db_connection.commit()
+
+    def register_sensor(self, hub_id, name, pin=None):
+        """ Registers a sensor, or finds it if it was registered before
+
+        Args:
+            hub_id: hub (Raspberry Pi) the sensor is connected to
+            name: name of the sensor, unique per hub
+            pin: GPIO pin of the sensor
+
+        Returns:
+            int: sensor_id to store readings of the sensor with
+        """
+        with self.db_connection.cursor() as cursor:
+            sql = "{} INTO Sensors (hub_id, name, pin, created_at) VALUES (%s, %s, %s, %s)".format(
+                self.backend.insert_ignore)
+            cursor.execute(sql, (hub_id, name, pin, time.time()))
+            cursor.execute(
+                "SELECT sensor_id FROM Sensors WHERE hub_id = %s AND name = %s", (hub_id, name))
+            result = cursor.fetchone()
+
+        self.db_connection.commit()
+
+        return result[0]
+
+    def get_sensors(self, hub_id=None):
+        """ Gets the registered sensors
+
+        Args:
+            hub_id: only return the sensors of this hub
+
+        Returns:
+            list: (sensor_id, hub_id, name, pin) tuples ordered by sensor_id
+        """
+        sql = "SELECT sensor_id, hub_id, name, pin FROM Sensors"
+        parameters = []
+
+        if hub_id is not None:
+            sql += " WHERE hub_id = %s"
+            parameters.append(hub_id)
+
+        with self.db_connection.cursor() as cursor:
+            cursor.execute(sql + " ORDER BY sensor_id", parameters)
+            result = cursor.fetchall()
+
+        return list(result)
+
     def delete_table(self):
-        """ Deletes temperature table to reset or clear all values
+        """ Deletes the measurement, rollup and sensor tables to reset or clear all values
         """
         with self.db_connection.cursor() as cursor:
-            sql = "DROP TABLE SensorData"
-            cursor.execute(sql)
+            cursor.execute("DROP TABLE IF EXISTS SensorData")
+            for table, _ in ROLLUP_RESOLUTIONS:
+                cursor.execute("DROP TABLE IF EXISTS {}".format(table))
+            cursor.execute("DROP TABLE IF EXISTS RollupState")
+            cursor.execute("DROP TABLE IF EXISTS Sensors")
+            cursor.execute("DROP TABLE IF EXISTS ImportCheckpoint")
+
+        self.invalidate_cache()
+
+    def table_exists(self, table_name):
+        """ Checks if a table exists in the database
+        """
+        return self.backend.table_exists(self.db_connection, table_name)
 
-    def store_measurement(self, temperature, humidity, timestamp):
+    def get_schema_version(self):
+        """ Gets the schema version of the sensor tables
+
+        Returns:
+            int: latest applied schema version, None if never recorded
+        """
+        with self.db_connection.cursor() as cursor:
+            cursor.execute("SELECT MAX(version) FROM SchemaVersion")
+            result = cursor.fetchone()
+
+        return result[0]
+
+    def set_schema_version(self, version):
+        """ Records a schema version as applied
+        """
+        with self.db_connection.cursor() as cursor:
+            sql = "INSERT INTO SchemaVersion (version, applied_at) VALUES (%s, %s)"
+            cursor.execute(sql, (version, time.time()))
+
+        self.db_connection.commit()
+
+    def migrate_legacy_table(self, batch_size=MIGRATION_BATCH_SIZE):
+        """ Migrates the VARCHAR SensorData layout to the typed schema (version 2)
+
+        Rows are copied in id order into SensorData_v2, one transaction per
+        batch, so the legacy table stays readable and an interrupted migration
+        resumes from the last copied id. When the copy has caught up the tables
+        are swapped atomically and the legacy table is kept as SensorData_v1.
+        Rows with unparsable values are left out of the new table and counted.
+
+        Args:
+            batch_size: number of rows converted per transaction
+
+        Returns:
+            dict: number of rows 'migrated' and 'skipped'
+        """
+        print("Migrating SensorData to schema version 2")
+        migration_results = {"migrated": 0, "skipped": 0}
+
+        with self.db_connection.cursor() as cursor:
+            for sql in self.backend.sensor_data_table_sql("SensorData_v2"):
+                cursor.execute(sql)
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM SensorData_v2")
+            last_id = cursor.fetchone()[0]
+
+        while True:
+            with self.db_connection.cursor() as cursor:
+                sql = "SELECT id, temperature, humidity, timestamp FROM SensorData WHERE id > %s ORDER BY id LIMIT %s"
+                cursor.execute(sql, (last_id, batch_size))
+                legacy_rows = cursor.fetchall()
+
+            if not legacy_rows:
+                break
+
+            converted_rows = []
+            for id_number, temperature, humidity, timestamp in legacy_rows:
+                try:
+                    converted_rows.append(
+                        (id_number, float(temperature), float(humidity), to_epoch(timestamp))
+                    )
+                except (TypeError, ValueError):
+                    migration_results["skipped"] += 1
+
+            with self.db_connection.cursor() as cursor:
+                sql = "INSERT INTO SensorData_v2 (id, temperature, humidity, ts) VALUES (%s, %s, %s, %s)"
+                cursor.executemany(sql, converted_rows)
+
+            self.db_connection.commit()
+
+            migration_results["migrated"] += len(converted_rows)
+            last_id = legacy_rows[-1][0]
+
+        # Swap tables (a single atomic statement on MySQL)
+        with self.db_connection.cursor() as cursor:
+            renames = (("SensorData", "SensorData_v1"), ("SensorData_v2", "SensorData"))
+            for sql in self.backend.rename_tables_sql(renames):
+                cursor.execute(sql)
+
+        self.db_connection.commit()
+
+        self.set_schema_version(2)
+        print("Migration complete: {}".format(migration_results))
+
+        return migration_results
+
+    def enable_batched_writes(self, batch_size=20, max_age=60, max_buffered_rows=5000):
+        """ Enables the batched (group commit) writer mode
+
+        store_measurement then appends rows to an in-memory buffer which is
+        written with a single executemany and one commit when it holds
+        batch_size rows, when its oldest row is max_age seconds old (checked on
+        every store and by flush_if_due) or when flush is called.
+
+        Durability: buffered rows only live in memory, so a crash or power loss
+        loses at most batch_size rows or max_age seconds of readings. A flush is
+        all or nothing; if it fails the rows stay buffered for the next flush
+        and once max_buffered_rows are pending the oldest rows are dropped.
+        Use batch_size=1 for the original commit-per-row durability.
+
+        Args:
+            batch_size: number of buffered rows that triggers a flush
+            max_age: age in seconds of the oldest buffered row that triggers a flush
+            max_buffered_rows: maximum rows kept in memory while flushes fail
+        """
+        self.batch_size = batch_size
+        self.batch_max_age = max_age
+        self.max_buffered_rows = max_buffered_rows
+
+        if self.write_buffer is None:
+            self.write_buffer = collections.deque()
+
+    def enable_spool(self, spool):
+        """ Spools measurements that cannot be written instead of raising
+
+        When a write fails the measurements are appended to the spool and a
+        SpoolDrainer replays them once the database answers again. While
+        measurements are spooled new ones are spooled too, so they reach the
+        database in order.
+
+        Args:
+            spool: MeasurementSpool
+        """
+        self.spool = spool
+
+    def must_spool(self):
+        """ Checks if writes go to the spool: readings are waiting in it or the
+        connection is still broken
+        """
+        if self.spool is None:
+            return False
+
+        return self.spool.pending() or (self.connection_broken and not self.reconnect())
+
+    def spool_measurements(self, measurements):
+        """ Appends measurements to the spool instead of the database
+        """
+        self.spool.append(measurements)
+        self.writer_counters["spooled"] += len(measurements)
+
+        # Rows reach the database through another connection
+        if self.cache is not None:
+            self.cache.mark_stale()
+
+    def store_measurement(self, temperature, humidity, timestamp, sensor_id=DEFAULT_SENSOR_ID):
         """ Stores sensor reading into database
+
+        Args:
+            temperature: temperature reading in celsius
+            humidity: humidity percentage
+            timestamp: time of the reading (see to_epoch)
+            sensor_id: registered sensor of the reading (see register_sensor)
+        """
+        measurement = (float(temperature), float(humidity), to_epoch(timestamp), sensor_id)
+
+        # Batched writer mode
+        if self.write_buffer is not None:
+            if not self.write_buffer:
+                self.buffer_start_time = time.monotonic()
+
+            self.write_buffer.append(measurement)
+            self.writer_counters["buffered"] += 1
+            self.flush_if_due()
+            return
+
+        if self.must_spool():
+            self.spool_measurements([measurement])
+            return
+
+        try:
+            with self.db_connection.cursor() as cursor:
+                sql = "INSERT INTO SensorData (temperature, humidity, ts, sensor_id) VALUES (%s, %s, %s, %s)"
+                cursor.execute(sql, measurement)
+                id_number = cursor.lastrowid
+
+            self.db_connection.commit()
+        except self.backend.Error as error:
+            if self.spool is None:
+                raise
+
+            print("Database write failed, spooling reading: {}".format(error))
+            self.connection_broken = True
+            self.spool_measurements([measurement])
+            return
+
+        if self.cache is not None:
+            self.cache.append_written((id_number,) + measurement)
+
+        self.maintain_rollups_after_write()
+
+    def store_readings(self, batch):
+        """ Stores the successful readings of a batch into database
+
+        The rows are taken column by column from the batch array, so no dict or
+        tuple is built per reading before the write.
+
+        Args:
+            batch: ReadingBatch (see reading.py)
+
+        Returns:
+            int: number of readings stored (or buffered)
+        """
+        measurements = batch.successful().measurements()
+        if not measurements:
+            return 0
+
+        # Batched writer mode
+        if self.write_buffer is not None:
+            if not self.write_buffer:
+                self.buffer_start_time = time.monotonic()
+
+            self.write_buffer.extend(measurements)
+            self.writer_counters["buffered"] += len(measurements)
+            self.flush_if_due()
+            return len(measurements)
+
+        if self.must_spool():
+            self.spool_measurements(measurements)
+            return len(measurements)
+
+        try:
+            self.insert_measurements(measurements)
+        except self.backend.Error as error:
+            try:
+                self.db_connection.rollback()
+            except self.backend.Error:
+                pass
+
+            if self.spool is None:
+                raise
+
+            print("Database write failed, spooling {} readings: {}".format(
+                len(measurements), error))
+            self.connection_broken = True
+            self.spool_measurements(measurements)
+            return len(measurements)
+
+        # Ids of batched rows are not reported, the cache fetches them on use
+        if self.cache is not None:
+            self.cache.mark_stale()
+
+        self.maintain_rollups_after_write()
+
+        return len(measurements)
+
+    def flush_if_due(self):
+        """ Flushes the write buffer if its size or age limit is reached
+
+        Returns:
+            int: number of rows written
+        """
+        if not self.write_buffer:
+            return 0
+
+        buffer_age = time.monotonic() - self.buffer_start_time
+
+        if len(self.write_buffer) >= self.batch_size or buffer_age >= self.batch_max_age:
+            return self.flush()
+
+        return 0
+
+    def flush(self):
+        """ Writes all buffered measurements in a single transaction
+
+        Returns:
+            int: number of rows written
+        """
+        if not self.write_buffer:
+            return 0
+
+        measurements = list(self.write_buffer)
+
+        if self.must_spool():
+            self.spool_measurements(measurements)
+            self.write_buffer.clear()
+            return 0
+
+        try:
+            self.insert_measurements(measurements)
+        except self.backend.Error as error:
+            try:
+                self.db_connection.rollback()
+            except self.backend.Error:
+                pass
+
+            if self.spool is not None:
+                print("Database write failed, spooling {} readings: {}".format(
+                    len(measurements), error))
+                self.connection_broken = True
+                self.spool_measurements(measurements)
+                self.write_buffer.clear()
+                return 0
+
+            # Keep rows for the next flush, dropping the oldest past the limit
+            while len(self.write_buffer) > self.max_buffered_rows:
+                self.write_buffer.popleft()
+                self.writer_counters["dropped"] += 1
+            raise
+
+        self.write_buffer.clear()
+        self.writer_counters["flushed"] += len(measurements)
+        self.writer_counters["flushes"] += 1
+
+        # Ids of batched rows are not reported, the cache fetches them on use
+        if self.cache is not None:
+            self.cache.mark_stale()
+
+        self.maintain_rollups_after_write()
+
+        return len(measurements)
+
+    def insert_measurements(self, measurements):
+        """ Writes measurements in a single transaction
+
+        Args:
+            measurements: (temperature, humidity, ts, sensor_id) tuples
+        """
+        if not measurements:
+            return
+
+        with self.db_connection.cursor() as cursor:
+            sql = "INSERT INTO SensorData (temperature, humidity, ts, sensor_id) VALUES (%s, %s, %s, %s)"
+            cursor.executemany(sql, measurements)
+
+        self.db_connection.commit()
+
+    def import_measurements(self, measurements, source, byte_offset, rows_imported,
+                            data_file=None):
+        """ Writes imported measurements and the import checkpoint in one transaction
+
+        A restarted import resumes at the checkpoint without writing any row
+        twice or skipping one.
+
+        Args:
+            measurements: (temperature, humidity, ts, sensor_id) tuples
+            source: imported file the checkpoint belongs to
+            byte_offset: position in the file after the last imported row
+            rows_imported: rows imported from the file so far
+            data_file: CSV file holding the same measurements, loaded with
+                LOAD DATA LOCAL INFILE instead of a multi-row insert when the
+                backend allows it
+        """
+        with self.db_connection.cursor() as cursor:
+            if data_file is not None and self.backend.local_infile:
+                sql = (
+                    "LOAD DATA LOCAL INFILE %s INTO TABLE SensorData "
+                    "FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' "
+                    "(temperature, humidity, ts, sensor_id)"
+                )
+                cursor.execute(sql, (data_file,))
+            elif len(measurements):
+                sql = "INSERT INTO SensorData (temperature, humidity, ts, sensor_id) VALUES (%s, %s, %s, %s)"
+                cursor.executemany(sql, measurements)
+
+            sql = "INSERT INTO ImportCheckpoint (source, byte_offset, rows_imported, updated_at) VALUES (%s, %s, %s, %s) {}".format(
+                self.backend.upsert_sql(
+                    "source",
+                    (("byte_offset", "set"), ("rows_imported", "set"), ("updated_at", "set"))))
+            cursor.execute(sql, (source, byte_offset, rows_imported, time.time()))
+
+        self.db_connection.commit()
+
+        if self.cache is not None:
+            self.cache.mark_stale()
+
+    def get_import_checkpoint(self, source):
+        """ Gets the position an import of a file stopped at
+
+        Returns:
+            tuple: (byte_offset, rows_imported), None if the file was never imported
         """
         with self.db_connection.cursor() as cursor:
-            sql = "INSERT INTO SensorData (temperature, humidity, timestamp) VALUES (%s, %s, %s)"
-            cursor.execute(sql, (temperature, humidity, timestamp))
+            cursor.execute(
+                "SELECT byte_offset, rows_imported FROM ImportCheckpoint WHERE source = %s",
+                (source,))
+            result = cursor.fetchone()
+
+        self.db_connection.commit()
+
+        return tuple(result) if result is not None else None
+
+    def clear_import_checkpoint(self, source):
+        """ Forgets the import checkpoint of a file, it is imported from the start """
+        with self.db_connection.cursor() as cursor:
+            cursor.execute("DELETE FROM ImportCheckpoint WHERE source = %s", (source,))
 
         self.db_connection.commit()
 
+    def get_writer_counters(self):
+        """ Gets the batched writer counters
+
+        Returns:
+            dict: rows 'buffered', 'flushed', 'dropped' and 'spooled' since start
+            up, number of 'flushes' and rows currently 'pending' in the buffer
+        """
+        counters = dict(self.writer_counters)
+        counters["pending"] = len(self.write_buffer) if self.write_buffer else 0
+
+        return counters
+
+    def enable_cache(self, cache, warm=True):
+        """ Serves recent measurement queries from a recent readings cache
+
+        The cache is filled by store_measurement, refreshed with a single query
+        for the newer ids when rows were written it has not seen (batched
+        flushes, other writers once its max_staleness expires) and cleared by
+        create_table and delete_table. One cache can be shared by the
+        connections of a pool.
+
+        Args:
+            cache: RecentReadingsCache to attach
+            warm: load the most recent measurements into the cache now
+        """
+        self.cache = cache
+
+        if warm and cache.needs_refresh() and self.table_exists("SensorData"):
+            self.refresh_cache()
+
+    def refresh_cache(self):
+        """ Loads measurements newer than the cache content into the cache
+
+        The cache is reloaded when measurements were pruned since it was
+        loaded, by any process (see the 'prunes' count of prune_measurements).
+        """
+        prunes = self.get_rollup_high_water_mark("prunes")
+        since_id = self.cache.last_id() if prunes == self.cache.prunes else None
+        rows = self.query_newest_ids(self.cache.capacity, since_id)
+
+        if since_id is None or len(rows) == self.cache.capacity:
+            # Cold cache, pruned rows or too many new rows to append
+            complete = since_id is None and len(rows) < self.cache.capacity
+            older_max_ts = None
+            if not complete:
+                older_max_ts = self.get_max_ts_before(rows[0][0])
+                complete = older_max_ts is None
+            self.cache.load(rows, complete, older_max_ts, prunes)
+        else:
+            self.cache.extend(rows, refreshed=True)
+
+    def query_newest_ids(self, num_of_measurements, since_id=None):
+        """ Gets the measurements with the highest ids (the rows written last)
+
+        Args:
+            num_of_measurements: maximum number of measurements to get
+            since_id: only return measurements with an id greater than this
+
+        Returns:
+            list: MEASUREMENT_COLUMNS tuples ordered by ascending id
+        """
+        sql = "SELECT {} FROM SensorData".format(", ".join(MEASUREMENT_COLUMNS))
+        parameters = []
+
+        if since_id is not None:
+            sql += " WHERE id > %s"
+            parameters.append(since_id)
+
+        parameters.append(num_of_measurements)
+
+        with self.db_connection.cursor() as cursor:
+            cursor.execute(sql + " ORDER BY id DESC LIMIT %s", parameters)
+            result = cursor.fetchall()
+
+        return list(reversed(result))
+
+    def get_max_ts_before(self, id_number):
+        """ Gets the newest ts of the measurements with an id below id_number
+
+        Returns:
+            float: newest ts, None if there are no such measurements
+        """
+        with self.db_connection.cursor() as cursor:
+            # Walks the ts index from the newest reading, which are the high ids
+            sql = "SELECT ts FROM SensorData WHERE id < %s ORDER BY ts DESC LIMIT 1"
+            cursor.execute(sql, (id_number,))
+            result = cursor.fetchone()
+
+        return result[0] if result else None
+
+    def invalidate_cache(self):
+        """ Clears the recent readings cache after the tables changed
+        """
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def get_cache_counters(self):
+        """ Gets the recent readings cache counters
+
+        Returns:
+            dict: RecentReadingsCache counters, None if no cache is attached
+        """
+        if self.cache is None:
+            return None
+
+        return self.cache.get_counters()
+
     def get_measurement(self, id_number):
         """ Gets measurement from database
         """
@@ -99,40 +969,451 @@ class TemperatureDatabase:
         
         return result[0]
 
-    def get_last_measurements(self, num_of_measurements):
+    def get_time_bounds(self):
+        """ Gets the time of the first and last stored measurement
+
+        Returns:
+            tuple: (first ts, last ts), (None, None) if there are no measurements
+        """
+        self.flush()
+
+        with self.db_connection.cursor() as cursor:
+            cursor.execute("SELECT MIN(ts), MAX(ts) FROM SensorData")
+            result = cursor.fetchone()
+
+        return result[0], result[1]
+
+    def get_recent(self, num_of_measurements, since_id=None, columns=MEASUREMENT_COLUMNS,
+                   sensor_id=None):
+        """ Gets the most recent measurements, from the cache when attached
+
+        On a cache miss the rows are read in a single query (see query_recent).
+
+        Args:
+            num_of_measurements: maximum number of recent measurements to get
+            since_id: only return measurements with an id greater than this
+            columns: measurement columns to return (subset of MEASUREMENT_COLUMNS)
+            sensor_id: only return measurements of this sensor (default all)
+
+        Returns:
+            list: measurement tuples ordered by time (ts, then id)
+        """
+        for column in columns:
+            if column not in MEASUREMENT_COLUMNS:
+                raise ValueError("Unknown measurement column: {}".format(column))
+
+        # Make buffered measurements visible to the query
+        self.flush()
+
+        if self.cache is not None:
+            if self.cache.needs_refresh():
+                self.refresh_cache()
+
+            result = self.cache.get_recent(num_of_measurements, since_id, columns, sensor_id)
+            if result is not None:
+                return result
+
+        return self.query_recent(num_of_measurements, since_id, columns, sensor_id)
+
+    def query_recent(self, num_of_measurements, since_id=None, columns=MEASUREMENT_COLUMNS,
+                     sensor_id=None):
+        """ Gets the most recent measurements from the database in a single query
+
+        The rows are selected newest first by time using the ts index (the
+        (sensor_id, ts) index for one sensor), ids only break ties, and are
+        returned oldest first. Imported history gets higher ids than the live
+        readings, so the ids alone do not give the latest readings.
+
+        Args:
+            num_of_measurements: maximum number of recent measurements to get
+            since_id: only return measurements with an id greater than this
+            columns: measurement columns to return (subset of MEASUREMENT_COLUMNS)
+            sensor_id: only return measurements of this sensor (default all)
+
+        Returns:
+            list: measurement tuples ordered by time (ts, then id)
+        """
+        sql = "SELECT {} FROM SensorData".format(", ".join(columns))
+        conditions = []
+        parameters = []
+
+        if since_id is not None:
+            conditions.append("id > %s")
+            parameters.append(since_id)
+        if sensor_id is not None:
+            conditions.append("sensor_id = %s")
+            parameters.append(sensor_id)
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        sql += " ORDER BY ts DESC, id DESC LIMIT %s"
+        parameters.append(num_of_measurements)
+
+        with self.db_connection.cursor() as cursor:
+            cursor.execute(sql, parameters)
+            result = cursor.fetchall()
+
+        # Reverse newest first results into chronological order
+        return list(reversed(result))
+
+    def get_last_measurements(self, num_of_measurements, sensor_id=None):
         """ Gets the last X number of measurements
 
         Args:
             num_of_measurements: number of recent measurements to get
+            sensor_id: only return measurements of this sensor (default all)
 
         Returns:
-            list: last number of measurements asked for unless there is not
-            enough; which then just returns all measurements
+            list: last number of measurements asked for (oldest first) unless
+            there is not enough; which then just returns all measurements
         """
+        return self.get_recent(num_of_measurements, sensor_id=sensor_id)
 
-        # Get last measurement id
-        last_measurement_id = self.get_last_measurement_id()
+    def sensor_condition(self, sensor_id, parameters):
+        """ Gets the SQL condition filtering a query by sensor
 
-        # Empty measurement list
-        measurements = []
+        Args:
+            sensor_id: sensor to filter by, None for all sensors
+            parameters: query parameters, the sensor_id is appended
 
-        # Return all ids if not enough measurements
-        if last_measurement_id is None:
-            pass
-        elif last_measurement_id < num_of_measurements:
-            return list(self.get_all_measurements())
-        else:
-            # Count down number of measurements
-            for meas in range(
-                last_measurement_id, (last_measurement_id - num_of_measurements), -1
-            ):
-                measurements.append(self.get_measurement(meas))
+        Returns:
+            str: ' AND sensor_id = %s', empty for all sensors
+        """
+        if sensor_id is None:
+            return ""
+
+        parameters.append(sensor_id)
+        return " AND sensor_id = %s"
+
+    def get_range(self, start, end, columns=MEASUREMENT_COLUMNS, sensor_id=None):
+        """ Gets the measurements taken in a time range using the ts index
+
+        Args:
+            start: start of the range, inclusive (see to_epoch)
+            end: end of the range, exclusive (see to_epoch)
+            columns: measurement columns to return (subset of MEASUREMENT_COLUMNS)
+            sensor_id: only return measurements of this sensor (default all)
+
+        Returns:
+            list: measurement tuples ordered by time
+        """
+        for column in columns:
+            if column not in MEASUREMENT_COLUMNS:
+                raise ValueError("Unknown measurement column: {}".format(column))
+
+        # Make buffered measurements visible to the query
+        self.flush()
+
+        parameters = [to_epoch(start), to_epoch(end)]
+        sensor_sql = self.sensor_condition(sensor_id, parameters)
+
+        with self.db_connection.cursor() as cursor:
+            sql = "SELECT {} FROM SensorData WHERE ts >= %s AND ts < %s{} ORDER BY ts, id".format(
+                ", ".join(columns), sensor_sql)
+            cursor.execute(sql, parameters)
+            result = cursor.fetchall()
+
+        return list(result)
+
+    def get_aggregates(self, start, end, bucket, sensor_id=None):
+        """ Gets min, max, mean and count of the measurements per time bucket
+
+        The aggregation runs in the database over the ts index, so only one row
+        per non-empty bucket is returned.
+
+        Args:
+            start: start of the range, inclusive (see to_epoch)
+            end: end of the range, exclusive (see to_epoch)
+            bucket: bucket width in seconds, buckets are aligned to the epoch
+            sensor_id: only aggregate measurements of this sensor (default all)
+
+        Returns:
+            list: tuples of AGGREGATE_COLUMNS ordered by bucket start time
+        """
+        if bucket <= 0:
+            raise ValueError("Bucket width must be positive: {}".format(bucket))
+
+        self.flush()
+
+        parameters = [bucket, bucket, to_epoch(start), to_epoch(end)]
+        sensor_sql = self.sensor_condition(sensor_id, parameters)
+
+        with self.db_connection.cursor() as cursor:
+            sql = (
+                "SELECT {} AS bucket, COUNT(*), "
+                "MIN(temperature), MAX(temperature), AVG(temperature), "
+                "MIN(humidity), MAX(humidity), AVG(humidity) "
+                "FROM SensorData WHERE ts >= %s AND ts < %s{} "
+                "GROUP BY bucket ORDER BY bucket"
+            ).format(self.backend.bucket_sql("ts"), sensor_sql)
+            cursor.execute(sql, parameters)
+            result = cursor.fetchall()
+
+        return list(result)
+
+    def maintain_rollups_after_write(self):
+        """ Folds newly written measurements into the rollups if enabled
+
+        A failed update is rolled back and caught up after the next write, the
+        measurements themselves are already committed.
+        """
+        if not self.maintain_rollups:
+            return
+
+        try:
+            self.update_rollups()
+        except self.backend.Error as error:
+            self.db_connection.rollback()
+            print("Rollup update failed, retrying after next write: {}".format(error))
+
+    def get_rollup_high_water_mark(self, name="rollups"):
+        """ Gets the id of the last measurement folded into the rollups
 
-            return measurements
+        Args:
+            name: 'rollups', 'pruned' for the last measurement deleted by
+                prune_measurements or 'prunes' for the number of prune batches
+        """
+        with self.db_connection.cursor() as cursor:
+            cursor.execute("SELECT last_id FROM RollupState WHERE name = %s", (name,))
+            result = cursor.fetchone()
+
+        return result[0] if result else 0
+
+    def update_rollups(self, batch_size=ROLLUP_BATCH_SIZE):
+        """ Folds measurements past the high-water mark into the rollup tables
+
+        Each batch of raw rows is grouped per bucket in SQL and merged into the
+        minute, hour and day tables together with the new high-water mark in
+        one transaction, so the job can stop at any point and resume. Ids are
+        expected to become visible in order (one writer process).
+
+        Args:
+            batch_size: raw rows folded per transaction
+
+        Returns:
+            int: id of the last measurement folded into the rollups
+        """
+        self.flush()
+
+        while True:
+            with self.db_connection.cursor() as cursor:
+                sql = "SELECT last_id FROM RollupState WHERE name = %s"
+                cursor.execute(sql, ("rollups",))
+                last_id = cursor.fetchone()[0]
+
+                sql = "SELECT MAX(id) FROM (SELECT id FROM SensorData WHERE id > %s ORDER BY id LIMIT %s) AS batch"
+                cursor.execute(sql, (last_id, batch_size))
+                batch_last_id = cursor.fetchone()[0]
+
+                if batch_last_id is None:
+                    # Caught up, end the read transaction
+                    self.db_connection.commit()
+                    break
+
+                # Advance the high-water mark first, only if no concurrent
+                # catch-up moved it, which also locks it until commit
+                sql = "UPDATE RollupState SET last_id = %s WHERE name = %s AND last_id = %s"
+                cursor.execute(sql, (batch_last_id, "rollups", last_id))
+
+                if cursor.rowcount != 1:
+                    self.db_connection.rollback()
+                    continue
+
+                for table, width in ROLLUP_RESOLUTIONS:
+                    sql = (
+                        "INSERT INTO {} (sensor_id, {}) "
+                        "SELECT sensor_id, {} AS rollup_bucket, COUNT(*), "
+                        "SUM(temperature), MIN(temperature), MAX(temperature), "
+                        "SUM(humidity), MIN(humidity), MAX(humidity) "
+                        "FROM SensorData WHERE id > %s AND id <= %s "
+                        "GROUP BY sensor_id, rollup_bucket {}"
+                    ).format(table, ROLLUP_VALUE_COLUMNS, self.backend.bucket_sql("ts"),
+                             self.backend.upsert_sql("sensor_id, bucket", ROLLUP_MERGES))
+                    cursor.execute(sql, (width, width, last_id, batch_last_id))
+
+            self.db_connection.commit()
+
+        return last_id
+
+    def rebuild_rollups(self, batch_size=ROLLUP_BATCH_SIZE):
+        """ Clears the rollup tables and rebuilds them from all measurements
+
+        The history of measurements already deleted by prune_measurements is
+        lost from the rebuilt rollups.
+
+        Returns:
+            int: id of the last measurement folded into the rollups
+        """
+        with self.db_connection.cursor() as cursor:
+            for table, _ in ROLLUP_RESOLUTIONS:
+                cursor.execute("DELETE FROM {}".format(table))
+            cursor.execute("UPDATE RollupState SET last_id = 0 WHERE name = %s", ("rollups",))
+
+        self.db_connection.commit()
+
+        return self.update_rollups(batch_size)
+
+    def prune_measurements(self, older_than, batch_size=PRUNE_BATCH_SIZE, pause=0.0,
+                           stop_event=None):
+        """ Deletes raw measurements older than a time in small transactions
+
+        Only measurements already folded into the rollups (up to the rollup
+        high-water mark) are deleted, so the rollups keep their history. Each
+        batch deletes a short primary key range and commits, so locks are held
+        briefly; pause spreads the I/O of large prunes over time.
+
+        Args:
+            older_than: measurements taken before this time are deleted (see to_epoch)
+            batch_size: rows deleted per transaction
+            pause: seconds to sleep between batches
+            stop_event: threading.Event that ends the prune between batches
+
+        Returns:
+            dict: rows 'pruned', number of 'batches' and 'seconds' taken
+        """
+        start_time = time.monotonic()
+        prune_results = {"pruned": 0, "batches": 0, "seconds": 0.0}
+        cutoff = to_epoch(older_than)
+        high_water_mark = self.get_rollup_high_water_mark()
+        last_id = 0
+
+        while True:
+            with self.db_connection.cursor() as cursor:
+                sql = "SELECT MIN(id), MAX(id) FROM (SELECT id FROM SensorData WHERE id > %s AND id <= %s AND ts < %s ORDER BY id LIMIT %s) AS batch"
+                cursor.execute(sql, (last_id, high_water_mark, cutoff, batch_size))
+                first_id, batch_last_id = cursor.fetchone()
+
+                if first_id is None:
+                    self.db_connection.commit()
+                    break
+
+                sql = "DELETE FROM SensorData WHERE id >= %s AND id <= %s AND ts < %s"
+                cursor.execute(sql, (first_id, batch_last_id, cutoff))
+                prune_results["pruned"] += cursor.rowcount
+
+                sql = "UPDATE RollupState SET last_id = %s WHERE name = %s AND last_id < %s"
+                cursor.execute(sql, (batch_last_id, "pruned", batch_last_id))
+                cursor.execute(
+                    "UPDATE RollupState SET last_id = last_id + 1 WHERE name = %s", ("prunes",))
+
+            self.db_connection.commit()
+            prune_results["batches"] += 1
+            last_id = batch_last_id
+
+            if stop_event is not None:
+                if stop_event.wait(pause):
+                    break
+            elif pause:
+                time.sleep(pause)
+
+        if prune_results["pruned"]:
+            self.invalidate_cache()
+
+        prune_results["seconds"] = time.monotonic() - start_time
+
+        return prune_results
+
+    def get_rollup(self, start, end, resolution, sensor_id=None):
+        """ Gets aggregates for a time range from one rollup table
+
+        Without a sensor filter the buckets of all sensors are merged.
+
+        Args:
+            start: start of the range (see to_epoch), the bucket holding it is included
+            end: end of the range, exclusive (see to_epoch)
+            resolution: bucket width in seconds of one of ROLLUP_RESOLUTIONS
+            sensor_id: only return the buckets of this sensor (default all)
+
+        Returns:
+            list: tuples of AGGREGATE_COLUMNS ordered by bucket start time
+        """
+        tables = dict((width, table) for table, width in ROLLUP_RESOLUTIONS)
+        if resolution not in tables:
+            raise ValueError("No rollup with resolution: {}".format(resolution))
+
+        start_bucket = (to_epoch(start) // resolution) * resolution
+        parameters = [start_bucket, to_epoch(end)]
+        sensor_sql = self.sensor_condition(sensor_id, parameters)
+
+        with self.db_connection.cursor() as cursor:
+            sql = (
+                "SELECT bucket, SUM(sample_count), MIN(temperature_min), MAX(temperature_max), "
+                "SUM(temperature_sum) / SUM(sample_count), MIN(humidity_min), MAX(humidity_max), "
+                "SUM(humidity_sum) / SUM(sample_count) FROM {} "
+                "WHERE bucket >= %s AND bucket < %s{} GROUP BY bucket ORDER BY bucket"
+            ).format(tables[resolution], sensor_sql)
+            cursor.execute(sql, parameters)
+            result = cursor.fetchall()
+
+        return list(result)
+
+    def get_history(self, start, end, max_points=500, sensor_id=None):
+        """ Gets the history of a time range within a point budget
+
+        Query router: raw measurements are returned when they fit in the
+        budget, otherwise the finest rollup whose bucket count fits (falling
+        back to the day rollup), so long ranges never scan raw rows. Rollups
+        only cover measurements up to the high-water mark of update_rollups.
+        Ranges reaching back past pruned measurements are always read from
+        the rollups, which keep that history.
+
+        Args:
+            start: start of the range (see to_epoch)
+            end: end of the range, exclusive (see to_epoch)
+            max_points: maximum number of points wanted
+            sensor_id: only return the history of this sensor (default all)
+
+        Returns:
+            tuple: (resolution in seconds, 0 for raw, list of AGGREGATE_COLUMNS
+            tuples; raw rows have a count of 1 and min = max = mean)
+        """
+        start = to_epoch(start)
+        end = to_epoch(end)
+
+        self.flush()
+
+        parameters = [start, end]
+        sensor_sql = self.sensor_condition(sensor_id, parameters)
+
+        with self.db_connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM SensorData WHERE ts >= %s AND ts < %s" + sensor_sql,
+                parameters)
+            raw_count = cursor.fetchone()[0]
+
+            if sensor_id is None:
+                cursor.execute("SELECT MIN(ts) FROM SensorData")
+            else:
+                cursor.execute("SELECT MIN(ts) FROM SensorData WHERE sensor_id = %s", (sensor_id,))
+            first_raw_ts = cursor.fetchone()[0]
+
+        raw_complete = (
+            self.get_rollup_high_water_mark("pruned") == 0 or
+            (first_raw_ts is not None and start >= first_raw_ts)
+        )
+
+        if raw_count <= max_points and raw_complete:
+            rows = self.get_range(
+                start, end, columns=("temperature", "humidity", "ts"), sensor_id=sensor_id)
+            return 0, [
+                (ts, 1, temperature, temperature, temperature, humidity, humidity, humidity)
+                for temperature, humidity, ts in rows
+            ]
+
+        for _, width in ROLLUP_RESOLUTIONS:
+            if (end - start) / width <= max_points:
+                break
+
+        return width, self.get_rollup(start, end, width, sensor_id)
 
     def get_all_measurements(self):
         """ Gets measurement from database
+
+        The whole table is loaded into memory, use iter_measurements for exports.
         """
+        self.flush()
+
         with self.db_connection.cursor() as cursor:
             sql = "SELECT * FROM SensorData"
             cursor.execute(sql)
@@ -140,42 +1421,241 @@ class TemperatureDatabase:
 
         return result
 
+    def iter_measurements(self, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE,
+                          columns=MEASUREMENT_COLUMNS, sensor_id=None):
+        """ Streams measurements in chunks with constant memory
+
+        Rows are read through the streaming cursor of the backend (unbuffered
+        server side cursor on MySQL), so only one chunk is in memory at a time.
+        The connection cannot run other queries until the generator is
+        exhausted or closed.
+
+        Args:
+            start: start of the range, inclusive (see to_epoch), None for the first
+            end: end of the range, exclusive (see to_epoch), None for the last
+            chunk_size: number of rows per yielded chunk
+            columns: measurement columns to return (subset of MEASUREMENT_COLUMNS)
+            sensor_id: only return measurements of this sensor (default all)
+
+        Yields:
+            list: measurement tuples, ordered by time for a range else by id
+        """
+        for column in columns:
+            if column not in MEASUREMENT_COLUMNS:
+                raise ValueError("Unknown measurement column: {}".format(column))
+
+        self.flush()
+
+        sql = "SELECT {} FROM SensorData".format(", ".join(columns))
+        conditions = []
+        parameters = []
+
+        if start is not None:
+            conditions.append("ts >= %s")
+            parameters.append(to_epoch(start))
+        if end is not None:
+            conditions.append("ts < %s")
+            parameters.append(to_epoch(end))
+
+        if conditions:
+            order_sql = " ORDER BY ts, id"
+        else:
+            order_sql = " ORDER BY id"
+
+        if sensor_id is not None:
+            conditions.append("sensor_id = %s")
+            parameters.append(sensor_id)
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += order_sql
+
+        with self.backend.streaming_cursor(self.db_connection) as cursor:
+            cursor.execute(sql, parameters)
+
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+
+                yield list(chunk)
+
     def close_connection(self):
         """ Closes connection to database
         """
         print("Closing Database")
-        self.db_connection.close()
+        try:
+            self.flush()
+        finally:
+            self.db_connection.close()
 
 
-def test_code():
-    """Test code for database module
+def test_code(configuration):
+    """Test code for database module, run against every storage backend
+
+    Args:
+        configuration: database configuration, its tables are reset
     """
     # Create database object
-    new_db = TemperatureDatabase("TEST_DATABASE", "TEMP_MONITOR", "PASSWORD")
+    new_db = TemperatureDatabase.from_configuration(configuration)
+
+    # Start from empty tables
+    new_db.create_table()
+    new_db.delete_table()
+    new_db.create_table()
 
     # Store test measurement
-    new_db.store_measurement(55.1, 22.3, "09/15/2019 11:11:52")
+    new_db.store_measurement(22.3, 55.1, "09/15/2019 11:11:52")
 
     # Get measurement
     result = new_db.get_measurement(1)
     print(result)
+    assert result[0] == 1 and abs(result[1] - 22.3) < 0.01 and abs(result[2] - 55.1) < 0.01
     result = new_db.get_all_measurements()
     print(result)
+    assert len(result) == 1
 
-    # Get last measurement id
+    # Store a day of readings every 15 minutes through the batched writer
+    start_time = 1568592000.0  # 09/16/2019 00:00:00 UTC
+    new_db.enable_batched_writes(batch_size=10, max_age=60)
+    for idx in range(96):
+        new_db.store_measurement(20 + idx % 4, 50 - idx % 4, start_time + idx * 900)
+    result = new_db.get_writer_counters()
+    print(result)
+    assert result["buffered"] == 96 and result["pending"] == 6
+
+    # Get last measurement id (flushes the remaining buffered rows)
+    result = new_db.get_last_measurements(10)
+    print(result)
+    assert [row[0] for row in result] == list(range(88, 98))
     result = new_db.get_last_measurement_id()
     print(result)
+    assert result == 97
 
-    # Get last 10 measurements
+    # Get humidity of measurements stored after id 95
+    result = new_db.get_recent(10, since_id=95, columns=("id", "humidity"))
+    print(result)
+    assert [row[0] for row in result] == [96, 97]
+
+    # Get readings of the first hour
+    result = new_db.get_range(start_time, start_time + 3600)
+    print(result)
+    assert [row[3] for row in result] == [start_time + idx * 900 for idx in range(4)]
+
+    # Get hourly aggregates of the day
+    result = new_db.get_aggregates(start_time, start_time + 86400, 3600)
+    print(result[0])
+    assert len(result) == 24 and result[0][1:5] == (4, 20, 23, 21.5)
+
+    # Rollups match the aggregates of the raw readings
+    new_db.update_rollups()
+    resolution, result = new_db.get_history(start_time, start_time + 86400, max_points=50)
+    print(resolution, result[0])
+    assert resolution == 3600 and len(result) == 24 and result[0][1:5] == (4, 20, 23, 21.5)
+    resolution, result = new_db.get_history(start_time, start_time + 86400, max_points=100)
+    assert resolution == 0 and len(result) == 96
+
+    # Recent readings are served from the warmed cache
+    new_db.enable_cache(RecentReadingsCache(capacity=50))
     result = new_db.get_last_measurements(10)
+    assert [row[0] for row in result] == list(range(88, 98))
+    new_db.store_measurement(25.0, 40.0, start_time + 86400)
+    result = new_db.get_recent(3, columns=("id", "temperature"))
+    print(result)
+    assert result == [(96, 22.0), (97, 23.0), (98, 25.0)]
+    result = new_db.get_recent(100)
+    assert len(result) == 98
+    result = new_db.get_cache_counters()
     print(result)
+    assert result["hits"] == 2 and result["misses"] == 1 and result["cached"] == 50
+
+    # Stream the day in chunks
+    result = [len(chunk) for chunk in new_db.iter_measurements(start_time, start_time + 86400, 40)]
+    print(result)
+    assert result == [40, 40, 16]
+
+    # Prune the first reading and the first half of the day, rollups are kept
+    result = new_db.prune_measurements(start_time + 43200, batch_size=20)
+    print(result)
+    assert result["pruned"] == 49 and result["batches"] == 3
+    resolution, result = new_db.get_history(start_time, start_time + 86400, max_points=50)
+    assert resolution == 3600 and len(result) == 24
+
+    # Readings of a second sensor are kept apart from the default sensor
+    sensor_id = new_db.register_sensor("local", "DHT22-2", 17)
+    assert new_db.register_sensor("local", "DHT22-2", 17) == sensor_id != DEFAULT_SENSOR_ID
+    new_db.store_measurement(30.0, 50.0, start_time + 86400, sensor_id)
+    new_db.store_measurement(31.0, 51.0, start_time + 86415, sensor_id)
+    result = new_db.get_recent(5, columns=("temperature", "sensor_id"), sensor_id=sensor_id)
+    print(result)
+    assert result == [(30.0, sensor_id), (31.0, sensor_id)]
+
+    # Readings of one sensor are ordered by time, from the cache as from the table
+    new_db.store_measurement(29.0, 49.0, start_time + 86405, sensor_id)
+    hits = new_db.get_cache_counters()["hits"]
+    result = new_db.get_recent(2, columns=("temperature",), sensor_id=sensor_id)
+    print(result)
+    assert result == [(29.0,), (31.0,)] == new_db.query_recent(2, None, ("temperature",), sensor_id)
+    assert new_db.get_cache_counters()["hits"] == hits + 1
+
+    # A cache not attached to the pruning connection (e.g. of another process)
+    # drops the pruned measurements on its next refresh
+    cache = new_db.cache
+    reader_cache = RecentReadingsCache(capacity=50, max_staleness=0.0)
+    new_db.enable_cache(reader_cache)
+    num_of_measurements = len(new_db.get_recent(100))
+    new_db.enable_cache(cache, warm=False)
+    new_db.update_rollups()
+    new_db.prune_measurements(start_time + 50000)
+    new_db.enable_cache(reader_cache, warm=False)
+    result = new_db.get_recent(100)
+    print(len(result), num_of_measurements)
+    assert len(result) < num_of_measurements and result == new_db.query_recent(100)
+    new_db.enable_cache(cache, warm=False)
+    result = new_db.get_last_measurements(1, DEFAULT_SENSOR_ID)
+    assert result[0][1:4] == (25.0, 40.0, start_time + 86400)
+    result = new_db.get_range(start_time + 86400, start_time + 86400 + 1, sensor_id=sensor_id)
+    assert len(result) == 1 and result[0][1] == 30.0
+    assert len(new_db.get_sensors("local")) == 2
+
+    # Imported rows and their checkpoint are committed together
+    new_db.import_measurements([(20.0, 40.0, start_time, sensor_id)], "test.csv", 120, 1)
+    new_db.import_measurements([(21.0, 41.0, start_time + 15, sensor_id)], "test.csv", 240, 2)
+    assert new_db.get_import_checkpoint("test.csv") == (240, 2)
+
+    # Imported history gets the highest ids but not the latest readings
+    result = new_db.get_recent(1, columns=("temperature", "ts"))
+    print(result)
+    assert result == [(31.0, start_time + 86415)]
+    assert result == new_db.query_recent(1, None, ("temperature", "ts"))
+    assert len(new_db.get_range(start_time, start_time + 30, sensor_id=sensor_id)) == 2
+    new_db.clear_import_checkpoint("test.csv")
+    assert new_db.get_import_checkpoint("test.csv") is None
+
+    # Cache is cleared with the tables
+    new_db.delete_table()
+    new_db.create_table()
+    assert new_db.get_last_measurements(10) == []
 
     # Close connection
     new_db.close_connection()
+    print("Database Test Passed ({})".format(configuration["Backend"]))
 
 
 if __name__ == "__main__":
     print("Database Test")
 
+    parser = argparse.ArgumentParser(description="Database module test code")
+    parser.add_argument(
+        "--configuration",
+        help="database configuration file to test (its tables are reset, "
+             "default is an in-memory SQLite database)")
+    args = parser.parse_args()
+
+    if args.configuration:
+        test_configuration = load_database_configuration(args.configuration)
+    else:
+        test_configuration = {"Backend": "sqlite", "Path": ":memory:"}
+
     # Run Test Code
-    test_code()
+    test_code(test_configuration)
@@ -0,0 +1,237 @@
+"""database_pool.py: This is the python module for the shared database connection pool
+
+This python module is used to share a bounded set of database connections
+between the request handlers of the web server instead of opening a new
+connection per websocket client or per request. Connections are health
+checked before being handed out and closed once they sit idle for too long.
+
+"""
+import collections
+import contextlib
+import threading
+import time
+
+
+class PoolTimeoutError(Exception):
+    """ Raised when no pooled connection becomes available in time """
+
+
+class DatabasePool:
+    """ Bounded pool of TemperatureDatabase connections
+    """
+
+    def __init__(self, factory, max_size=5, acquire_timeout=5.0,
+                 health_check_interval=30.0, max_idle_time=300.0):
+        """Initializes the connection pool (connections are opened on demand)
+
+        Args:
+            factory: callable returning a new connected TemperatureDatabase
+            max_size: maximum number of open connections
+            acquire_timeout: default seconds to wait for a free connection
+            health_check_interval: connections idle longer than this are pinged
+                before being handed out
+            max_idle_time: connections idle longer than this are closed by
+                recycle_idle
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.max_idle_time = max_idle_time
+
+        # Idle connections as (database, time released), most recent on the right
+        self.idle_connections = collections.deque()
+        self.open_connections = 0
+        self.condition = threading.Condition()
+
+        # Pool metrics
+        self.metrics = {
+            "created": 0,
+            "closed": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+            "acquired": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    def acquire(self, timeout=None):
+        """ Borrows a connection from the pool, waiting if all are in use
+
+        Args:
+            timeout: seconds to wait for a connection (default acquire_timeout)
+
+        Returns:
+            TemperatureDatabase: connection that must be given back with release
+
+        Raises:
+            PoolTimeoutError: no connection became available in time
+        """
+        if timeout is None:
+            timeout = self.acquire_timeout
+
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        waited = False
+        database = None
+        idle_time = 0.0
+
+        with self.condition:
+            while True:
+                if self.idle_connections:
+                    database, released_time = self.idle_connections.pop()
+                    idle_time = time.monotonic() - released_time
+                    break
+
+                if self.open_connections < self.max_size:
+                    # Reserve a slot, connection is opened outside the lock
+                    self.open_connections += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        "No database connection available after {:.2f}s".format(timeout)
+                    )
+
+                waited = True
+                self.condition.wait(remaining)
+
+            wait_time = time.monotonic() - start_time
+            self.metrics["acquired"] += 1
+            self.metrics["wait_time_total"] += wait_time
+            self.metrics["wait_time_max"] = max(self.metrics["wait_time_max"], wait_time)
+            if waited:
+                self.metrics["waits"] += 1
+
+        # Replace connections that went stale while idle
+        if database is not None and idle_time > self.health_check_interval:
+            if not database.check_connection():
+                with self.condition:
+                    self.metrics["health_check_failures"] += 1
+                self._close(database)
+                database = None
+
+        if database is None:
+            database = self._open()
+
+        return database
+
+    def release(self, database):
+        """ Returns a borrowed connection to the pool
+        """
+        # Do not keep a stale read snapshot open on an idle connection
+        database.end_transaction()
+
+        with self.condition:
+            self.idle_connections.append((database, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, database):
+        """ Closes a borrowed connection instead of returning it to the pool
+        """
+        self._close(database)
+
+        with self.condition:
+            self.open_connections -= 1
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """ Context manager that borrows a connection and always gives it back
+
+        Connections that fail their health check after an error are discarded.
+        """
+        database = self.acquire(timeout)
+
+        try:
+            yield database
+        except Exception:
+            if database.check_connection():
+                self.release(database)
+            else:
+                self.discard(database)
+            raise
+        else:
+            self.release(database)
+
+    def recycle_idle(self):
+        """ Closes connections that have been idle longer than max_idle_time
+
+        Returns:
+            int: number of connections closed
+        """
+        expired = []
+        now = time.monotonic()
+
+        with self.condition:
+            # Oldest idle connections are on the left
+            while self.idle_connections and now - self.idle_connections[0][1] > self.max_idle_time:
+                expired.append(self.idle_connections.popleft()[0])
+
+            self.open_connections -= len(expired)
+            self.metrics["recycled"] += len(expired)
+            self.condition.notify(len(expired))
+
+        for database in expired:
+            self._close(database)
+
+        return len(expired)
+
+    def close_all(self):
+        """ Closes every idle connection in the pool
+        """
+        with self.condition:
+            idle = [database for database, _ in self.idle_connections]
+            self.idle_connections.clear()
+            self.open_connections -= len(idle)
+
+        for database in idle:
+            self._close(database)
+
+    def get_metrics(self):
+        """ Gets the pool metrics
+
+        Returns:
+            dict: connection counters, pool wait counters/times (seconds) and
+            the current 'open' and 'idle' connection counts
+        """
+        with self.condition:
+            metrics = dict(self.metrics)
+            metrics["open"] = self.open_connections
+            metrics["idle"] = len(self.idle_connections)
+
+        if metrics["acquired"]:
+            metrics["wait_time_mean"] = metrics["wait_time_total"] / metrics["acquired"]
+        else:
+            metrics["wait_time_mean"] = 0.0
+
+        return metrics
+
+    def _open(self):
+        """ Opens a new connection for a reserved slot """
+        try:
+            database = self.factory()
+        except Exception:
+            with self.condition:
+                self.open_connections -= 1
+                self.condition.notify()
+            raise
+
+        with self.condition:
+            self.metrics["created"] += 1
+
+        return database
+
+    def _close(self, database):
+        """ Closes a connection, ignoring errors from broken connections """
+        try:
+            database.close_connection()
+        except Exception:
+            pass
+
+        with self.condition:
+            self.metrics["closed"] += 1
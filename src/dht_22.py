@@ -4,11 +4,26 @@ This python module is used to interface with the DHT22 sensor from Adafruit. It
 the necessary functions to read the temperature, intialize the sensor, check the status of
 the sensor, and temperature conversion functions
 
+The sensor needs 2 seconds (the minimum interval of its driver) after power up before its
+first read. Readiness is signalled by an event set by a timer at that deadline, so callers
+wait (wait_ready, wait_ready_async) or register a callback (when_ready) instead of polling.
+
+The hardware is read through a sensor driver (see sensor_drivers.py): the DHT22 driver by
+default, or a simulated or replay driver to run the application without a sensor. Failed
+reads are retried after the jittered backoff of a retry policy and every attempt is
+recorded in the read telemetry (see sensor_retry.py).
+
 '''
 
+import asyncio
 import datetime
+import threading
+import time
 
-import Adafruit_DHT
+from src.reading import Reading
+from src.sensor_drivers import DHT22Driver, create_driver, load_sensor_configuration
+from src.sensor_retry import ReadTelemetry, RetryPolicy
+from src.timestamps import acquisition_time
 
 # Temperature/Humidity Min/Max (in celsius) from https://www.sparkfun.com/datasheets/Sensors/Temperature/DHT22.pdf
 DHT22_MAXIMUM_TEMPERATURE = 80
@@ -21,117 +36,211 @@ class DHT22Sensor:
     ''' DHT22_Sensor: a class built for the DHT22 Temperature Sensor
     '''
 
-    def __init__(self, pin, sensor=Adafruit_DHT.DHT22):
+    def __init__(self, pin, driver=None, retry_policy=None):
         '''Returns a the main window of the temp-o-matic application.
 
         Args:
             pin (int): GPIO Pin on the Raspberry Pi
-            sensor(str): DHT22 Sensor Type
+            driver (SensorDriver): driver reading the sensor, default the DHT22 on the pin
+            retry_policy (RetryPolicy): backoff after failed reads, default RetryPolicy()
         '''
         self.pin_number = pin
-        self.sensor = sensor
+        self.driver = DHT22Driver(pin) if driver is None else driver
+        self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+
+        # Rolling read statistics (success rate, attempts per reading, latency)
+        self.telemetry = ReadTelemetry()
+
+        # Seconds needed between reads and after creation
+        self.minimum_interval = self.driver.minimum_interval
         self.last_reading_time = datetime.datetime.now()
         self.sensor_initialized = False
 
         # Sensor Status (Warming up, Offline, Ready, Busy)
         self.sensor_status = 'Warming Up'
 
-        # Offline count - sensor deemed offline when 3 consecutive failed reads occur
+        # Successful reads since creation (sequence number of the readings)
+        self.sequence = 0
+
+        # Offline count - sensor deemed offline when more consecutive reads failed than the
+        # retry policy allows (3 by default)
         self.offline_count = 0
 
-    def initialize_sensor(self):
-        '''Initializes sensor by checking 2 seconds has passed before creation of class
+        # Readiness - set by a timer once the warm up deadline has passed
+        self.ready_time = time.monotonic() + self.minimum_interval
+        self.ready_event = threading.Event()
+        self.ready_lock = threading.Lock()
+        self.ready_callbacks = []
+        self.ready_timer = threading.Timer(self.minimum_interval, self.set_ready)
+        self.ready_timer.daemon = True
+        self.ready_timer.start()
+
+        # Monotonic time the next read may start (minimum interval or retry backoff)
+        self.next_read_time = self.ready_time
+
+    @classmethod
+    def from_configuration(cls, configuration=None):
+        '''Creates the sensor of a sensor configuration (see sensor_drivers.py)
+
+        Args:
+            configuration (dict): sensor configuration, default loads the configuration file
         '''
-        # Get elapsed time
-        current_time = datetime.datetime.now()
-        elapsed_time = (current_time - self.last_reading_time).total_seconds()
+        if configuration is None:
+            configuration = load_sensor_configuration()
+
+        return cls(configuration['Pin'], create_driver(configuration),
+                   RetryPolicy.from_configuration(configuration))
 
-        # Sensor is initialized after 2 seconds of class creation
-        if elapsed_time > 2:
+    def set_ready(self):
+        '''Marks the sensor initialized and runs the readiness callbacks (timer thread)
+        '''
+        with self.ready_lock:
             self.sensor_initialized = True
+            self.ready_event.set()
+            callbacks, self.ready_callbacks = self.ready_callbacks, []
+
+        for callback in callbacks:
+            callback()
+
+    def initialize_sensor(self):
+        '''Checks if the sensor has finished warming up, never waits
+
+        Returns:
+            bool: True if the sensor can be read
+        '''
+        return self.ready_event.is_set()
+
+    def time_until_ready(self):
+        '''Gets the seconds left until the sensor can be read (0 once ready)
+        '''
+        return max(self.ready_time - time.monotonic(), 0.0)
+
+    def time_until_next_read(self):
+        '''Gets the seconds left until the sensor may be read again (0 if it can be read now)
+        '''
+        return max(self.next_read_time - time.monotonic(), 0.0)
+
+    def get_read_metrics(self):
+        '''Gets the read telemetry of the sensor (see ReadTelemetry.get_metrics)
+        '''
+        metrics = self.telemetry.get_metrics()
+        metrics['consecutive_failures'] = self.offline_count
+
+        return metrics
+
+    def wait_ready(self, timeout=None):
+        '''Blocks until the sensor has warmed up or the timeout expires
+
+        Args:
+            timeout (float): maximum seconds to wait, None waits until ready
+
+        Returns:
+            bool: True if the sensor is ready
+        '''
+        return self.ready_event.wait(timeout)
+
+    async def wait_ready_async(self, timeout=None):
+        '''Awaits the end of the warm up without blocking the event loop
+
+        Args:
+            timeout (float): maximum seconds to wait, None waits until ready
+
+        Returns:
+            bool: True if the sensor is ready
+        '''
+        delay = self.time_until_ready()
+
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            return False
+
+        await asyncio.sleep(delay)
+        return True
+
+    def when_ready(self, callback):
+        '''Calls callback once the sensor has warmed up
+
+        The callback runs on the readiness timer thread, or right away if the sensor is
+        already ready.
+
+        Args:
+            callback: function without arguments
+        '''
+        with self.ready_lock:
+            if not self.ready_event.is_set():
+                self.ready_callbacks.append(callback)
+                return
+
+        callback()
 
     def get_current_reading(self):
         ''' Function to get the current reading of the dht22 sensor
 
         Returns:
-            dict: dictionary with keys ('status', 'timestamp', 'temperature', 'humidity') that
-            are the results of the current read
+            Reading: results of the current read (see reading.py)
 
-            status - status of the sensor device
-            timestamp - timestamp of the measurement
+            status - status of the sensor device ('New' for a new measurement)
+            ts - epoch time of the measurement in seconds
+            monotonic - time.monotonic() of the measurement
             temperature - temperature reading in celsius
             humidity - humidity percentage
+            sequence - number of the measurement since the sensor was created
         '''
 
-        # Results dictionary (status, humidity, temperature)
-        results = {
-            'status': None,
-            'timestamp': None,
-            'temperature': None,
-            'humidity': None,
-        }
-
-        # Get elapsed time
-        current_time = datetime.datetime.now()
-        elapsed_time = (current_time - self.last_reading_time).total_seconds()
-
-        # Only get new data if 2 seconds has passed
-        if elapsed_time > 2:
-            # Get reading from sensor
-            humidity, temperature = Adafruit_DHT.read(self.sensor, self.pin_number)
-
-            # Return results if available (occurs somewhat randomly when data not available)
-            if (humidity is not None) and (temperature is not None):
-                # Set last reading time
-                self.last_reading_time = datetime.datetime.now()
-
-                # Store results
-                results['status'] = 'New'
-                results['timestamp'] = self.last_reading_time.strftime('%m/%d/%y %X')
-                results['temperature'] = temperature
-                results['humidity'] = humidity
-
-                # Set device status
-                self.sensor_status = 'Ready'
-
-                # Clear offline count
-                self.offline_count = 0
-            else:
-                # Try once more for a successful read
-                humidity, temperature = Adafruit_DHT.read(self.sensor, self.pin_number)
-
-                # Return results if available (occurs somewhat randomly when data not available)
-                if (humidity is not None) and (temperature is not None):
-                    # Set last reading time
-                    self.last_reading_time = datetime.datetime.now()
-
-                    # Store results
-                    results['status'] = 'New'
-                    results['timestamp'] = self.last_reading_time.strftime('%m/%d/%y %X')
-                    results['temperature'] = temperature
-                    results['humidity'] = humidity
-
-                    # Set device status
-                    self.sensor_status = 'Ready'
-
-                    # Clear offline count
-                    self.offline_count = 0
-                else:
-                    # Offline count reaches 3, sensor is offline
-                    if self.offline_count >= 3:
-                        self.sensor_status = 'Offline'
-                        results['status'] = 'Offline'
-                    else:
-                        self.offline_count += 1
-                        results['status'] = 'Unavailable'
-        else:
-            if self.sensor_status == 'Warming Up':
-                results['status'] = 'Warming Up'
-            else:
+        # Only read once the minimum interval (2 seconds for the DHT22) or the retry
+        # backoff after a failed read has passed
+        if self.time_until_next_read() > 0:
+            if self.sensor_status != 'Warming Up':
                 self.sensor_status = 'Busy'
-                results['status'] = 'Busy'
 
-        return results
+            return Reading(self.sensor_status)
+
+        # Get reading from sensor
+        start_time = time.monotonic()
+        failure_reason = None
+        try:
+            humidity, temperature = self.driver.read()
+        except (RuntimeError, OSError) as error:
+            humidity, temperature = None, None
+            failure_reason = type(error).__name__
+        latency = time.monotonic() - start_time
+
+        # No data is returned somewhat randomly, the values are checked against the sensor range
+        if failure_reason is None:
+            if (humidity is None) or (temperature is None):
+                failure_reason = 'no_data'
+            elif not (DHT22_MINIMUM_TEMPERATURE <= temperature <= DHT22_MAXIMUM_TEMPERATURE
+                      and DHT22_MINIMUM_HUMIDITY <= humidity <= DHT22_MAXIMUM_HUMIDITY):
+                failure_reason = 'out_of_range'
+
+        self.telemetry.record(failure_reason is None, latency, failure_reason)
+
+        if failure_reason is None:
+            # Set last reading time (formatted only for display, see timestamps.py)
+            ts, monotonic_time = acquisition_time()
+            self.last_reading_time = datetime.datetime.fromtimestamp(ts)
+            self.next_read_time = monotonic_time + self.minimum_interval
+            self.sequence += 1
+
+            # Set device status
+            self.sensor_status = 'Ready'
+
+            # Clear offline count
+            self.offline_count = 0
+
+            return Reading('New', ts, monotonic_time, temperature, humidity, sequence=self.sequence)
+
+        # Back off before the next attempt, an immediate retry fails for the same reason
+        self.offline_count += 1
+        self.next_read_time = time.monotonic() + self.retry_policy.retry_delay(
+            self.offline_count, self.minimum_interval)
+
+        # Offline once more consecutive reads failed than the policy allows
+        if self.offline_count > self.retry_policy.offline_after:
+            self.sensor_status = 'Offline'
+            return Reading('Offline')
+
+        return Reading('Unavailable')
 
 
 def celsius_to_fahrenheit(temperature):
@@ -0,0 +1,162 @@
+"""export.py: This is the python module to export the stored sensor readings
+
+This python module is used to write the SensorData measurements to CSV or
+NDJSON (one JSON object per line), optionally gzip compressed. Rows are
+streamed from the database in chunks (TemperatureDatabase.iter_measurements),
+so memory use stays constant whatever the size of the table. The formatting
+functions are shared with the /export download of the web server.
+
+Run from the repository root:
+    python3 -m src.export --format csv --output readings.csv.gz --gzip
+    python3 -m src.export --format ndjson --start 1571600000 --end 1571700000
+
+"""
+import argparse
+import contextlib
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+
+from src.database import EXPORT_CHUNK_SIZE, MEASUREMENT_COLUMNS, TemperatureDatabase
+from src.storage import DATABASE_CONFIGURATION_FILE, load_database_configuration
+
+# Supported export formats and their MIME types
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def format_header(export_format, columns=MEASUREMENT_COLUMNS):
+    """ Gets the text written before the first chunk of an export
+
+    Args:
+        export_format: 'csv' or 'ndjson'
+        columns: exported measurement columns
+
+    Returns:
+        str: CSV header line, empty for NDJSON
+    """
+    if export_format == "csv":
+        return ",".join(columns) + "\r\n"
+
+    return ""
+
+
+def format_chunk(rows, export_format, columns=MEASUREMENT_COLUMNS):
+    """ Formats a chunk of measurements
+
+    Args:
+        rows: measurement tuples of the given columns
+        export_format: 'csv' or 'ndjson'
+        columns: exported measurement columns
+
+    Returns:
+        str: formatted rows, each ending with a newline
+    """
+    if export_format == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    if export_format == "ndjson":
+        return "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+    raise ValueError("Unknown export format: {}".format(export_format))
+
+
+def export_measurements(database, output, export_format, start=None, end=None,
+                        chunk_size=EXPORT_CHUNK_SIZE, progress_interval=5.0, sensor_id=None):
+    """ Streams measurements to a text file object
+
+    Args:
+        database: TemperatureDatabase to export from
+        output: writable text file object
+        export_format: 'csv' or 'ndjson'
+        start: start of the time range, inclusive (see to_epoch), None for all
+        end: end of the time range, exclusive (see to_epoch), None for all
+        chunk_size: rows read from the database at a time
+        progress_interval: seconds between progress reports (on stderr)
+        sensor_id: only export measurements of this sensor (default all)
+
+    Returns:
+        dict: number of 'rows' exported, 'seconds' taken and 'rows_per_second'
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format: {}".format(export_format))
+
+    start_time = time.monotonic()
+    last_report = start_time
+    num_of_rows = 0
+
+    output.write(format_header(export_format))
+
+    for chunk in database.iter_measurements(start, end, chunk_size, sensor_id=sensor_id):
+        output.write(format_chunk(chunk, export_format))
+        num_of_rows += len(chunk)
+
+        now = time.monotonic()
+        if now - last_report >= progress_interval:
+            print("Exported {} rows ({:.0f} rows/s)".format(
+                num_of_rows, num_of_rows / (now - start_time)), file=sys.stderr)
+            last_report = now
+
+    elapsed = time.monotonic() - start_time
+
+    return {
+        "rows": num_of_rows,
+        "seconds": elapsed,
+        "rows_per_second": num_of_rows / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def open_output(path, compress):
+    """ Opens the export destination as a text file object
+
+    Args:
+        path: output file, '-' for stdout
+        compress: gzip the output
+    """
+    if path == "-":
+        if compress:
+            return gzip.open(sys.stdout.buffer, "wt", newline="")
+        return io.TextIOWrapper(sys.stdout.buffer, newline="")
+
+    if compress:
+        return gzip.open(path, "wt", newline="")
+
+    return open(path, "w", newline="")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export SensorData measurements")
+    parser.add_argument("--configuration", default=DATABASE_CONFIGURATION_FILE)
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", default="-", help="output file, '-' for stdout")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output")
+    parser.add_argument("--start", type=float, help="first epoch time exported")
+    parser.add_argument("--end", type=float, help="epoch time the export stops at")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    parser.add_argument("--sensor", type=int, help="only export this sensor id")
+    args = parser.parse_args()
+
+    export_file = open_output(args.output, args.gzip)
+
+    # Database messages go to stderr so they never mix with exported rows
+    with contextlib.redirect_stdout(sys.stderr):
+        sys_db = TemperatureDatabase.from_configuration(
+            load_database_configuration(args.configuration))
+
+        try:
+            with export_file:
+                export_results = export_measurements(
+                    sys_db, export_file, args.format, args.start, args.end, args.chunk_size,
+                    sensor_id=args.sensor)
+        finally:
+            sys_db.close_connection()
+
+    print("Exported {rows} rows in {seconds:.1f}s ({rows_per_second:.0f} rows/s)".format(
+        **export_results), file=sys.stderr)
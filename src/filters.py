@@ -0,0 +1,356 @@
+"""filters.py: This is the python module for conditioning the raw sensor readings
+
+This python module is used to smooth the raw DHT22 readings, which have
+spikes and 0.1 degree quantization noise, before alarms act on them. Filters
+are composed into a FilterChain per channel (temperature, humidity) and a
+SignalConditioner runs the chains on every reading of the acquisition worker,
+which publishes the filtered values next to the raw ones:
+
+ - RateOfChangeFilter rejects samples that change faster than physically
+   plausible (a spike) and accepts a new level once it persists
+ - MedianFilter takes the rolling median of the last samples
+ - EWMAFilter smooths with an exponentially weighted moving average
+
+update() costs O(1) per sample (the median window is fixed and small) and
+apply() runs the same filter over NumPy arrays, e.g. to replay history; both
+give the same values. The filters are set in the sensor configuration file, e.g.
+    {"Filters": {"MaxTemperatureRate": 0.5, "MaxHumidityRate": 2.0, "MedianWindow": 5, "EwmaAlpha": 0.3}}
+
+"""
+import bisect
+import collections
+import math
+
+import numpy as np
+
+# Default filter settings, rates are per second
+DEFAULT_FILTER_CONFIGURATION = {
+    "MaxTemperatureRate": 0.5,
+    "MaxHumidityRate": 2.0,
+    "MaxRejections": 3,
+    "MedianWindow": 5,
+    "EwmaAlpha": 0.3,
+}
+
+
+class MedianFilter:
+    """ Rolling median of the last window samples
+    """
+
+    def __init__(self, window=5):
+        """Initializes the filter
+
+        Args:
+            window: number of samples the median is taken over (the first
+                outputs use the samples seen so far)
+        """
+        self.window = window
+        self.samples = collections.deque()
+        self.sorted_samples = []
+
+    def reset(self):
+        """ Forgets the samples seen so far """
+        self.samples.clear()
+        self.sorted_samples = []
+
+    def update(self, value, timestamp=None):
+        """ Adds a sample and returns the median of the window """
+        if len(self.samples) == self.window:
+            del self.sorted_samples[bisect.bisect_left(self.sorted_samples, self.samples.popleft())]
+
+        self.samples.append(value)
+        bisect.insort(self.sorted_samples, value)
+
+        count = len(self.sorted_samples)
+        if count % 2:
+            return self.sorted_samples[count // 2]
+
+        return (self.sorted_samples[count // 2 - 1] + self.sorted_samples[count // 2]) / 2
+
+    def apply(self, values, timestamps=None):
+        """ Rolling median of an array (continues from the samples seen so far)
+
+        Returns:
+            numpy.ndarray: median of each sample's window
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return values
+
+        # Pad the front with the previous samples, or NaN for partial windows
+        history = list(self.samples)[-(self.window - 1):] if self.window > 1 else []
+        padding = np.full(self.window - 1 - len(history), np.nan)
+        padded = np.concatenate([padding, np.asarray(history, dtype=np.float64), values])
+
+        windows = np.lib.stride_tricks.as_strided(
+            padded, shape=(len(values), self.window),
+            strides=(padded.strides[0], padded.strides[0]))
+        medians = np.nanmedian(windows, axis=1)
+
+        # Leave the filter state as update() would
+        for value in values[-self.window:]:
+            if len(self.samples) == self.window:
+                del self.sorted_samples[bisect.bisect_left(self.sorted_samples, self.samples.popleft())]
+            self.samples.append(float(value))
+            bisect.insort(self.sorted_samples, float(value))
+
+        return medians
+
+
+class EWMAFilter:
+    """ Exponentially weighted moving average
+    """
+
+    def __init__(self, alpha=0.3):
+        """Initializes the filter
+
+        Args:
+            alpha: weight of the newest sample (0 to 1, 1 passes samples through)
+        """
+        self.alpha = alpha
+        self.average = None
+
+    def reset(self):
+        """ Forgets the samples seen so far """
+        self.average = None
+
+    def update(self, value, timestamp=None):
+        """ Adds a sample and returns the moving average """
+        if self.average is None:
+            self.average = value
+        else:
+            self.average += self.alpha * (value - self.average)
+
+        return self.average
+
+    def apply(self, values, timestamps=None):
+        """ Moving average of an array (continues from the samples seen so far)
+
+        Computed in blocks with the closed form
+            y[k] = d^k * y[-1] + alpha * sum(d^(k-j) * x[j]),  d = 1 - alpha
+        where the blocks are short enough for d^-k to stay finite.
+
+        Returns:
+            numpy.ndarray: moving average after each sample
+        """
+        values = np.asarray(values, dtype=np.float64)
+        averages = np.empty_like(values)
+        if not len(values):
+            return averages
+
+        start = 0
+        if self.average is None:
+            self.average = averages[0] = values[0]
+            start = 1
+
+        decay = 1.0 - self.alpha
+        if decay <= 0.0:
+            averages[start:] = values[start:]
+        else:
+            block = max(int(-27.0 / math.log(decay)) if decay < 1.0 else len(values), 1)
+            for block_start in range(start, len(values), block):
+                chunk = values[block_start:block_start + block]
+                powers = decay ** np.arange(1, len(chunk) + 1)
+                averages[block_start:block_start + len(chunk)] = powers * (
+                    self.average + self.alpha * np.cumsum(chunk / powers))
+                self.average = averages[block_start + len(chunk) - 1]
+
+        self.average = float(averages[-1])
+
+        return averages
+
+
+class RateOfChangeFilter:
+    """ Rejects samples that change faster than max_rate from the last accepted one
+    """
+
+    def __init__(self, max_rate, max_rejections=3, default_interval=2.0):
+        """Initializes the filter
+
+        Args:
+            max_rate: largest plausible change per second
+            max_rejections: consecutive rejected samples after which the new
+                level is accepted (a real step change)
+            default_interval: seconds assumed between samples without timestamps
+        """
+        self.max_rate = max_rate
+        self.max_rejections = max_rejections
+        self.default_interval = default_interval
+        self.last_value = None
+        self.last_timestamp = None
+        self.rejections = 0
+        self.rejected = 0  # Rejected samples since creation
+
+    def reset(self):
+        """ Forgets the samples seen so far """
+        self.last_value = None
+        self.last_timestamp = None
+        self.rejections = 0
+
+    def update(self, value, timestamp=None):
+        """ Adds a sample
+
+        Args:
+            value: new sample
+            timestamp: time of the sample in seconds (None assumes default_interval)
+
+        Returns:
+            float: the sample, or None if it was rejected as a spike
+        """
+        if self.last_value is not None:
+            if timestamp is None or self.last_timestamp is None:
+                elapsed = self.default_interval
+            else:
+                elapsed = max(timestamp - self.last_timestamp, 0.0)
+
+            if abs(value - self.last_value) > self.max_rate * elapsed and \
+                    self.rejections < self.max_rejections:
+                self.rejections += 1
+                self.rejected += 1
+                return None
+
+        self.last_value = value
+        self.last_timestamp = timestamp
+        self.rejections = 0
+
+        return value
+
+    def apply(self, values, timestamps=None):
+        """ Rejects the spikes of an array (continues from the samples seen so far)
+
+        Whether a sample is accepted depends on the last accepted one, so the
+        samples are checked in order.
+
+        Returns:
+            numpy.ndarray: samples with the rejected ones set to NaN
+        """
+        values = np.asarray(values, dtype=np.float64)
+        results = values.copy()
+        timestamp_list = [None] * len(values) if timestamps is None else np.asarray(timestamps).tolist()
+
+        for index, (value, timestamp) in enumerate(zip(values.tolist(), timestamp_list)):
+            if self.update(value, timestamp) is None:
+                results[index] = np.nan
+
+        return results
+
+
+class FilterChain:
+    """ Filters applied one after the other, a rejected sample stops the chain
+    """
+
+    def __init__(self, filters):
+        """Initializes the chain
+
+        Args:
+            filters: filters in the order they are applied
+        """
+        self.filters = list(filters)
+
+    def reset(self):
+        """ Resets every filter of the chain """
+        for stage in self.filters:
+            stage.reset()
+
+    def update(self, value, timestamp=None):
+        """ Passes a sample through the chain
+
+        Returns:
+            float: filtered sample, None if a filter rejected it
+        """
+        for stage in self.filters:
+            value = stage.update(value, timestamp)
+            if value is None:
+                return None
+
+        return value
+
+    def apply(self, values, timestamps=None):
+        """ Filters an array, rejected samples are NaN and skipped by later filters
+
+        Returns:
+            numpy.ndarray: filtered samples
+        """
+        results = np.asarray(values, dtype=np.float64).copy()
+        accepted = np.ones(len(results), dtype=bool)
+        timestamps = None if timestamps is None else np.asarray(timestamps, dtype=np.float64)
+
+        for stage in self.filters:
+            stage_values = stage.apply(
+                results[accepted], None if timestamps is None else timestamps[accepted])
+            results[accepted] = stage_values
+            accepted &= ~np.isnan(results)
+
+        return results
+
+
+class SignalConditioner:
+    """ Temperature and humidity filter chains of one sensor
+    """
+
+    def __init__(self, temperature_chain, humidity_chain):
+        """Initializes the conditioner
+
+        Args:
+            temperature_chain: FilterChain of the temperature (celsius)
+            humidity_chain: FilterChain of the humidity
+        """
+        self.temperature_chain = temperature_chain
+        self.humidity_chain = humidity_chain
+
+        # Last filtered values, kept while samples are rejected
+        self.temperature = None
+        self.humidity = None
+
+    @classmethod
+    def from_configuration(cls, configuration=None):
+        """ Creates the rate of change, median and EWMA chains of a sensor configuration
+
+        Args:
+            configuration: dict with the optional 'Filters' settings
+                ('MaxTemperatureRate', 'MaxHumidityRate', 'MaxRejections',
+                'MedianWindow', 'EwmaAlpha')
+        """
+        settings = dict(DEFAULT_FILTER_CONFIGURATION)
+        settings.update((configuration or {}).get("Filters", {}))
+
+        def create_chain(max_rate):
+            return FilterChain([
+                RateOfChangeFilter(max_rate, settings["MaxRejections"]),
+                MedianFilter(settings["MedianWindow"]),
+                EWMAFilter(settings["EwmaAlpha"]),
+            ])
+
+        return cls(create_chain(settings["MaxTemperatureRate"]),
+                   create_chain(settings["MaxHumidityRate"]))
+
+    def update(self, temperature, humidity, timestamp=None):
+        """ Filters a reading
+
+        Args:
+            temperature: raw temperature (celsius)
+            humidity: raw humidity
+            timestamp: time of the reading in seconds
+
+        Returns:
+            tuple: (filtered temperature, filtered humidity), the last
+            filtered value of a channel whose sample was rejected
+        """
+        filtered_temperature = self.temperature_chain.update(temperature, timestamp)
+        if filtered_temperature is not None:
+            self.temperature = filtered_temperature
+
+        filtered_humidity = self.humidity_chain.update(humidity, timestamp)
+        if filtered_humidity is not None:
+            self.humidity = filtered_humidity
+
+        return self.temperature, self.humidity
+
+    def apply(self, temperatures, humidities, timestamps=None):
+        """ Filters arrays of readings, rejected samples are NaN
+
+        Returns:
+            tuple: (filtered temperatures, filtered humidities)
+        """
+        return (self.temperature_chain.apply(temperatures, timestamps),
+                self.humidity_chain.apply(humidities, timestamps))
@@ -0,0 +1,343 @@
+"""importer.py: This is the python module to import historical sensor readings
+
+This python module is used to load CSV or NDJSON logs (e.g. written by
+export.py or restored from a backup, optionally gzip compressed) into the
+SensorData table. Files are streamed in chunks, each chunk is converted and
+validated with NumPy in one vectorized step and written with a multi-row
+executemany, or LOAD DATA LOCAL INFILE on MySQL servers that allow it, in a
+single transaction.
+
+The byte offset reached in the file is stored in the ImportCheckpoint table in
+the same transaction as the rows, so an interrupted import started again with
+the same file resumes where it stopped without duplicating rows. The rollups
+are brought up to date once the file is imported. Imported rows get new ids
+and the rollups expect ids to be committed in order, so run imports while the
+hub application is stopped.
+
+Run from the repository root:
+    python3 -m src.importer readings.csv.gz [--sensor 2] [--chunk-size 10000]
+    python3 -m src.importer readings.ndjson --restart
+
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.database import DEFAULT_SENSOR_ID, TemperatureDatabase, to_epoch
+from src.storage import DATABASE_CONFIGURATION_FILE, load_database_configuration
+
+# Rows read, validated and committed at a time
+IMPORT_CHUNK_SIZE = 10000
+
+# Supported file formats by file extension (before an optional .gz)
+IMPORT_FORMATS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+}
+
+# Columns every imported row must have, sensor_id is optional
+REQUIRED_COLUMNS = ("temperature", "humidity", "ts")
+
+# Accepted value ranges (DHT22 measurement range, see dht_22.py)
+VALID_RANGES = {
+    "temperature": (-40, 80),
+    "humidity": (0, 100),
+}
+
+# Accepted timestamps: from 2000-01-01 to a day ahead of the clock (rejects
+# millisecond epochs and mistyped years)
+MINIMUM_TIMESTAMP = 946684800.0
+MAXIMUM_TIMESTAMP_AHEAD = 86400.0
+
+
+def guess_format(path):
+    """ Gets the import format from the file extension ('csv' or 'ndjson') """
+    name = path[:-3] if path.endswith(".gz") else path
+    extension = os.path.splitext(name)[1].lower()
+
+    if extension not in IMPORT_FORMATS:
+        raise ValueError("Unknown import file type: {}".format(path))
+
+    return IMPORT_FORMATS[extension]
+
+
+def open_source(path):
+    """ Opens an import file as a binary file object, gzip files are decompressed """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+
+    return open(path, "rb")
+
+
+def read_chunks(source_file, import_format, chunk_size=IMPORT_CHUNK_SIZE, offset=0):
+    """ Reads the rows of an import file in chunks
+
+    Args:
+        source_file: binary file object from open_source
+        import_format: 'csv' (header line with the column names) or 'ndjson'
+            (one JSON object per line)
+        chunk_size: maximum number of lines per chunk
+        offset: byte offset to start reading at (from a checkpoint)
+
+    Yields:
+        tuple: (dict of column name to list of raw values, byte offset after
+        the chunk)
+    """
+    column_indexes = None
+
+    if import_format == "csv":
+        header_line = source_file.readline()
+        header = [column.strip() for column in next(csv.reader([header_line.decode()]), [])]
+
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if missing:
+            raise ValueError("CSV header has no {} column".format(", ".join(missing)))
+
+        column_indexes = dict((column, header.index(column)) for column in header)
+
+        offset = max(offset, len(header_line))
+
+    source_file.seek(offset)
+    position = offset
+
+    while True:
+        lines = list(itertools.islice(iter(source_file.readline, b""), chunk_size))
+        if not lines:
+            return
+
+        position += sum(len(line) for line in lines)
+        lines = [line for line in lines if line.strip()]
+
+        if import_format == "csv":
+            rows = list(csv.reader(line.decode() for line in lines))
+            columns = dict(
+                (column, [row[index] if index < len(row) else None for row in rows])
+                for column, index in column_indexes.items()
+            )
+        else:
+            records = []
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                records.append(record if isinstance(record, dict) else {})
+
+            columns = dict(
+                (column, [record.get(column) for record in records])
+                for column in REQUIRED_COLUMNS + ("sensor_id",)
+            )
+
+        yield columns, position
+
+
+def to_float_array(values, converter=float):
+    """ Converts raw values to a float array, invalid values become NaN
+
+    The conversion is vectorized, values are only converted one at a time
+    when the chunk holds one that NumPy cannot parse.
+    """
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+
+    converted = np.empty(len(values), dtype=np.float64)
+    for index, value in enumerate(values):
+        try:
+            converted[index] = converter(value)
+        except (TypeError, ValueError):
+            converted[index] = np.nan
+
+    return converted
+
+
+def parse_timestamp(value):
+    """ Converts an imported timestamp (epoch seconds or a legacy string) to epoch seconds """
+    try:
+        return float(value)
+    except ValueError:
+        return to_epoch(value)
+
+
+def convert_chunk(columns, sensor_id=None, known_sensor_ids=None):
+    """ Converts and validates a chunk of raw rows
+
+    Rows with a missing, unparsable or out of range value, a timestamp outside
+    MINIMUM_TIMESTAMP to a day from now or an unknown sensor are rejected.
+
+    Args:
+        columns: dict of column name to list of raw values (see read_chunks)
+        sensor_id: sensor of every row, default the sensor_id column of the
+            file or DEFAULT_SENSOR_ID
+        known_sensor_ids: registered sensor ids (see get_sensors), None
+            accepts any positive integer
+
+    Returns:
+        tuple: (dict of column name to array of the valid rows, number of
+        rejected rows)
+    """
+    num_of_rows = len(columns["ts"])
+    arrays = {
+        "temperature": to_float_array(columns["temperature"]),
+        "humidity": to_float_array(columns["humidity"]),
+        "ts": to_float_array(columns["ts"], parse_timestamp),
+    }
+
+    if sensor_id is not None:
+        arrays["sensor_id"] = np.full(num_of_rows, sensor_id, dtype=np.float64)
+    elif "sensor_id" in columns:
+        raw_sensor_ids = [DEFAULT_SENSOR_ID if value in (None, "") else value
+                          for value in columns["sensor_id"]]
+        arrays["sensor_id"] = to_float_array(raw_sensor_ids)
+    else:
+        arrays["sensor_id"] = np.full(num_of_rows, DEFAULT_SENSOR_ID, dtype=np.float64)
+
+    # NaN compares False, so missing values are rejected as well
+    valid = (arrays["ts"] >= MINIMUM_TIMESTAMP) & \
+            (arrays["ts"] <= time.time() + MAXIMUM_TIMESTAMP_AHEAD)
+    for column, (minimum, maximum) in VALID_RANGES.items():
+        valid &= (arrays[column] >= minimum) & (arrays[column] <= maximum)
+    valid &= (arrays["sensor_id"] >= 1) & (arrays["sensor_id"] == np.floor(arrays["sensor_id"]))
+    if known_sensor_ids is not None:
+        valid &= np.isin(arrays["sensor_id"], list(known_sensor_ids))
+
+    valid_arrays = dict((column, values[valid]) for column, values in arrays.items())
+    valid_arrays["sensor_id"] = valid_arrays["sensor_id"].astype(np.int64)
+
+    return valid_arrays, num_of_rows - int(valid.sum())
+
+
+def write_load_data_file(arrays, directory=None):
+    """ Writes converted rows to a temporary CSV file for LOAD DATA
+
+    Returns:
+        str: path of the file, removed by the caller
+    """
+    data_file, path = tempfile.mkstemp(suffix=".csv", dir=directory)
+
+    with os.fdopen(data_file, "wb") as output:
+        np.savetxt(
+            output,
+            np.column_stack((arrays["temperature"], arrays["humidity"], arrays["ts"],
+                             arrays["sensor_id"])),
+            fmt=("%.10g", "%.10g", "%.6f", "%d"), delimiter=",")
+
+    return path
+
+
+def import_file(database, path, import_format=None, chunk_size=IMPORT_CHUNK_SIZE,
+                sensor_id=None, restart=False, load_data=False, progress_interval=5.0):
+    """ Imports a CSV or NDJSON file, resuming at its checkpoint
+
+    Args:
+        database: TemperatureDatabase to import into
+        path: file to import (.csv, .ndjson or .jsonl, optionally .gz)
+        import_format: 'csv' or 'ndjson' (default from the file extension)
+        chunk_size: rows validated and committed at a time
+        sensor_id: sensor of every imported row (default from the file),
+            rows of sensors that are not registered are rejected
+        restart: ignore the checkpoint of an earlier import of the file
+        load_data: write chunks with LOAD DATA LOCAL INFILE when the backend
+            allows it (MySQL with LocalInfile), otherwise executemany is used
+        progress_interval: seconds between progress reports
+
+    Returns:
+        dict: 'rows' imported and 'rejected' by this run, 'resumed_rows'
+        imported before the checkpoint, 'chunks', 'seconds' and 'rows_per_second'
+    """
+    if import_format is None:
+        import_format = guess_format(path)
+
+    known_sensor_ids = set(sensor[0] for sensor in database.get_sensors())
+    if sensor_id is not None and sensor_id not in known_sensor_ids:
+        raise ValueError("Unknown sensor id: {}".format(sensor_id))
+
+    source = os.path.abspath(path)
+    if restart:
+        database.clear_import_checkpoint(source)
+
+    offset, rows_imported = database.get_import_checkpoint(source) or (0, 0)
+    if offset:
+        print("Resuming import of {} after {} rows".format(path, rows_imported))
+
+    use_load_data = load_data and database.backend.local_infile
+    import_results = {"rows": 0, "rejected": 0, "resumed_rows": rows_imported, "chunks": 0}
+
+    start_time = time.monotonic()
+    last_report = start_time
+
+    with open_source(path) as source_file:
+        for columns, end_offset in read_chunks(source_file, import_format, chunk_size, offset):
+            arrays, rejected = convert_chunk(columns, sensor_id, known_sensor_ids)
+            num_of_rows = len(arrays["ts"])
+            rows_imported += num_of_rows
+
+            if use_load_data:
+                data_file = write_load_data_file(arrays)
+                try:
+                    database.import_measurements(
+                        (), source, end_offset, rows_imported, data_file=data_file)
+                finally:
+                    os.remove(data_file)
+            else:
+                measurements = list(zip(
+                    arrays["temperature"].tolist(), arrays["humidity"].tolist(),
+                    arrays["ts"].tolist(), arrays["sensor_id"].tolist()))
+                database.import_measurements(measurements, source, end_offset, rows_imported)
+
+            import_results["rows"] += num_of_rows
+            import_results["rejected"] += rejected
+            import_results["chunks"] += 1
+
+            now = time.monotonic()
+            if now - last_report >= progress_interval:
+                print("Imported {} rows ({:.0f} rows/s)".format(
+                    import_results["rows"], import_results["rows"] / (now - start_time)))
+                last_report = now
+
+    elapsed = time.monotonic() - start_time
+    import_results["seconds"] = elapsed
+    import_results["rows_per_second"] = import_results["rows"] / elapsed if elapsed > 0 else 0.0
+
+    if import_results["rows"]:
+        database.update_rollups()
+
+    return import_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import SensorData measurements")
+    parser.add_argument("path", help="CSV or NDJSON file, optionally gzip compressed")
+    parser.add_argument("--configuration", default=DATABASE_CONFIGURATION_FILE)
+    parser.add_argument("--format", choices=sorted(set(IMPORT_FORMATS.values())),
+                        help="file format (default from the file extension)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--sensor", type=int, help="sensor id of every imported row")
+    parser.add_argument("--restart", action="store_true",
+                        help="import from the start, ignoring the checkpoint")
+    parser.add_argument("--load-data", action="store_true",
+                        help="use LOAD DATA LOCAL INFILE (MySQL with LocalInfile)")
+    args = parser.parse_args()
+
+    sys_db = TemperatureDatabase.from_configuration(
+        load_database_configuration(args.configuration))
+
+    try:
+        sys_db.create_table()
+        results = import_file(
+            sys_db, args.path, args.format, args.chunk_size, args.sensor,
+            args.restart, args.load_data)
+    finally:
+        sys_db.close_connection()
+
+    print("Imported {rows} rows ({rejected} rejected) in {seconds:.1f}s "
+          "({rows_per_second:.0f} rows/s)".format(**results))
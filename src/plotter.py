@@ -13,7 +13,7 @@ https://stackoverflow.com/questions/29473757/pyqtgraph-multiple-y-axis-on-left-s
 import pyqtgraph as pg
 import pyqtgraph.exporters
 import numpy as np
-import datetime
+import time
 
 from src.dht_22 import (
     DHT22_MAXIMUM_HUMIDITY,
@@ -59,7 +59,7 @@ class PlotWidget(pg.GraphicsWindow):
         self.temp_values = None
         self.humidity_values = None
         self.temp_units = "Celsius"
-        self.start_time = datetime.datetime.now()
+        self.start_time = time.time()
         self.temp_curve = None
         self.humidity_curve = None
         self.plot_temp_flag = True
@@ -122,27 +122,48 @@ class PlotWidget(pg.GraphicsWindow):
         Args:
             temp_list: List of temperature readings
             humidity_list: List of humidity readings
-            time_list: List of timestamps
+            time_list: List of epoch timestamps in seconds
         """
 
-        # Set plot values and convert them to floats and adjust to Fahrenheit if needed
-        # https://stackoverflow.com/questions/1614236/in-python-how-do-i-convert-all-of-the-items-in-a-list-to-floats
+        # Set plot values and adjust to Fahrenheit if needed
         if self.temp_units == "Fahrenheit":
-            self.temp_values = [celsius_to_fahrenheit(float(temp)) for temp in temp_list]
+            self.temp_values = [celsius_to_fahrenheit(temp) for temp in temp_list]
         else:
-            self.temp_values = [float(temp) for temp in temp_list]
-        self.humidity_values = [float(humidity) for humidity in humidity_list]
+            self.temp_values = list(temp_list)
+        self.humidity_values = list(humidity_list)
 
-        # Convert time into elapsed seconds from start
-        self.time_values = []
-
-        for time in time_list:
-            timestamp = datetime.datetime.strptime(time, "%m/%d/%y %X")
-            elapsed_time = (timestamp - self.start_time).total_seconds()
-            self.time_values.append(elapsed_time)
+        # Convert epoch timestamps into elapsed seconds from start (no per-point parsing)
+        self.time_values = np.asarray(time_list, dtype=float) - self.start_time
 
         self.plot_values()
 
+    def update_batch(self, batch):
+        """ Updates the plot with the successful readings of a batch
+
+        Args:
+            batch: ReadingBatch (see reading.py), its columns are plotted as is
+        """
+        readings = batch.successful()
+        if not len(readings):
+            return
+
+        self.update_values(readings.temperature, readings.humidity, readings.ts)
+
+    def update_aggregates(self, aggregate_rows):
+        """ Updates the plot with the mean of each time bucket
+
+        Args:
+            aggregate_rows: rows returned by TemperatureDatabase.get_aggregates
+            (bucket, count, temperature min/max/mean, humidity min/max/mean)
+        """
+        if not aggregate_rows:
+            return
+
+        buckets = np.array(aggregate_rows, dtype=float)
+
+        # Plot bucket means at the bucket start times
+        self.update_values(buckets[:, 4], buckets[:, 7], buckets[:, 0])
+
     def plot_values(self):
         """ Updates the plot with local measurements stored
         """
@@ -0,0 +1,216 @@
+"""reading.py: This is the python module for the sensor reading records
+
+This python module is used to pass sensor readings around without building a
+dict per read:
+
+ - Reading is an immutable named tuple returned by DHT22Sensor for every
+   read (status, epoch 'ts' and 'monotonic' time, temperature, humidity,
+   sensor id and sequence number). The acquisition worker and the
+   shared-memory ring publish the same tuples with the filtered values added
+   (see filters.py)
+ - ReadingBatch keeps many readings in a growable NumPy structured array, one
+   fixed-size record of the raw values per reading, which the database
+   writer (store_readings), the AWS publisher (publish_readings) and the plot
+   (update_batch) consume column by column
+
+"""
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+# Sensor of readings stored without one (the original single DHT22 on pin 4)
+DEFAULT_SENSOR_ID = 1
+
+# Read statuses by code (see DHT22Sensor.get_current_reading and AcquisitionWorker.get_latest)
+READING_STATUSES = ("New", "Warming Up", "Busy", "Unavailable", "Offline", "Ready")
+
+# One record per reading, missing values are NaN
+READING_DTYPE = np.dtype([
+    ("sensor_id", np.int32),
+    ("status", np.uint8),
+    ("sequence", np.int64),
+    ("ts", np.float64),
+    ("monotonic", np.float64),
+    ("temperature", np.float64),
+    ("humidity", np.float64),
+])
+
+# Readings a new batch has room for before it grows
+DEFAULT_BATCH_CAPACITY = 1024
+
+
+class Reading(NamedTuple):
+    """ One read of a sensor
+    """
+
+    status: str  # One of READING_STATUSES, 'New' for a successful read
+    ts: Optional[float] = None  # Epoch time of the reading
+    monotonic: Optional[float] = None  # time.monotonic() of the reading
+    temperature: Optional[float] = None  # Celsius
+    humidity: Optional[float] = None  # Percent
+    sensor_id: Optional[int] = None  # Registered sensor (see register_sensor)
+    sequence: Optional[int] = None  # Number of the successful read of the sensor
+    filtered_temperature: Optional[float] = None  # Celsius, see filters.py
+    filtered_humidity: Optional[float] = None  # Percent, see filters.py
+
+    def age(self):
+        """ Gets the seconds since the reading was taken (None without a reading) """
+        return None if self.monotonic is None else time.monotonic() - self.monotonic
+
+    def measurement(self):
+        """ Gets the (temperature, humidity, ts, sensor_id) row stored in the database """
+        return (self.temperature, self.humidity, self.ts,
+                DEFAULT_SENSOR_ID if self.sensor_id is None else self.sensor_id)
+
+
+class ReadingBatch:
+    """ Readings in a growable NumPy structured array
+    """
+
+    def __init__(self, capacity=DEFAULT_BATCH_CAPACITY):
+        """Creates an empty batch
+
+        Args:
+            capacity: readings stored before the array is reallocated (it doubles)
+        """
+        self.records = np.zeros(max(capacity, 1), dtype=READING_DTYPE)
+        self.size = 0
+
+    @classmethod
+    def from_readings(cls, readings):
+        """ Creates a batch holding the given readings """
+        readings = list(readings)
+        batch = cls(len(readings))
+        batch.extend(readings)
+
+        return batch
+
+    @classmethod
+    def from_columns(cls, temperature, humidity, ts, sensor_id=None):
+        """ Creates a batch of successful readings from columns (e.g. database rows)
+
+        Args:
+            temperature: temperatures in celsius
+            humidity: humidity percentages
+            ts: epoch times of the readings
+            sensor_id: sensor ids of the readings (default DEFAULT_SENSOR_ID)
+        """
+        temperature = np.asarray(temperature, dtype=np.float64)
+        batch = cls(len(temperature))
+        records = batch.records[:len(temperature)]
+
+        records["sensor_id"] = DEFAULT_SENSOR_ID if sensor_id is None else sensor_id
+        records["status"] = READING_STATUSES.index("Ready")
+        records["sequence"] = -1
+        records["ts"] = ts
+        records["monotonic"] = np.nan
+        records["temperature"] = temperature
+        records["humidity"] = humidity
+        batch.size = len(temperature)
+
+        return batch
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.to_reading(self.array[index])
+
+    def __iter__(self):
+        for record in self.array:
+            yield self.to_reading(record)
+
+    @property
+    def array(self):
+        """ Structured array view of the readings (no copy) """
+        return self.records[:self.size]
+
+    @property
+    def temperature(self):
+        return self.array["temperature"]
+
+    @property
+    def humidity(self):
+        return self.array["humidity"]
+
+    @property
+    def ts(self):
+        return self.array["ts"]
+
+    @property
+    def sensor_id(self):
+        return self.array["sensor_id"]
+
+    def reserve(self, size):
+        """ Grows the array to hold at least size readings """
+        if size > len(self.records):
+            records = np.zeros(max(size, 2 * len(self.records)), dtype=READING_DTYPE)
+            records[:self.size] = self.array
+            self.records = records
+
+    def append(self, reading):
+        """ Adds a Reading to the batch """
+        self.reserve(self.size + 1)
+        self.records[self.size] = self.to_record(reading)
+        self.size += 1
+
+    def extend(self, readings):
+        """ Adds Readings to the batch """
+        for reading in readings:
+            self.append(reading)
+
+    def clear(self):
+        """ Empties the batch, keeping its array """
+        self.size = 0
+
+    def successful(self):
+        """ Gets a batch of the successful readings ('New' or 'Ready') """
+        array = self.array
+        mask = (array["status"] == READING_STATUSES.index("New")) | \
+               (array["status"] == READING_STATUSES.index("Ready"))
+        selected = array[mask]
+        batch = ReadingBatch(len(selected))
+        batch.records[:len(selected)] = selected
+        batch.size = len(selected)
+
+        return batch
+
+    def measurements(self):
+        """ Gets the (temperature, humidity, ts, sensor_id) rows stored in the database
+
+        Returns:
+            list: one tuple of Python floats and ints per reading
+        """
+        array = self.array
+
+        return list(zip(array["temperature"].tolist(), array["humidity"].tolist(),
+                        array["ts"].tolist(), array["sensor_id"].tolist()))
+
+    @staticmethod
+    def to_record(reading):
+        """ Converts a Reading to a record of READING_DTYPE """
+        return (
+            DEFAULT_SENSOR_ID if reading.sensor_id is None else reading.sensor_id,
+            READING_STATUSES.index(reading.status),
+            -1 if reading.sequence is None else reading.sequence,
+            np.nan if reading.ts is None else reading.ts,
+            np.nan if reading.monotonic is None else reading.monotonic,
+            np.nan if reading.temperature is None else reading.temperature,
+            np.nan if reading.humidity is None else reading.humidity,
+        )
+
+    @staticmethod
+    def to_reading(record):
+        """ Converts a record of READING_DTYPE to a Reading """
+        sensor_id, status, sequence, ts, monotonic, temperature, humidity = record.tolist()
+
+        return Reading(
+            READING_STATUSES[status],
+            None if ts != ts else ts,
+            None if monotonic != monotonic else monotonic,
+            None if temperature != temperature else temperature,
+            None if humidity != humidity else humidity,
+            sensor_id,
+            None if sequence < 0 else sequence,
+        )
@@ -0,0 +1,246 @@
+"""reading_cache.py: This is the python module for the recent readings cache
+
+This python module is used to keep the most recent measurements in memory in
+front of the database. The cache is a fixed size ring of arrays (id,
+temperature, humidity, ts, sensor_id) filled by the writes of the
+TemperatureDatabase it is attached to and refreshed from the database with a single delta query, so
+repeated requests for the last readings are answered without I/O. One cache
+can be shared by several connections (e.g. a connection pool).
+
+The ring holds the newest ids, but imported history can get newer ids than
+live readings, so readings are answered by time (ts, then id) like the
+database query, and only when no uncached measurement is newer.
+
+"""
+import array
+import heapq
+import threading
+import time
+
+# Cached columns, in the order of MEASUREMENT_COLUMNS
+CACHE_COLUMNS = ("id", "temperature", "humidity", "ts", "sensor_id")
+
+
+class RecentReadingsCache:
+    """ Bounded array-backed ring of the most recent measurements
+    """
+
+    def __init__(self, capacity=500, max_staleness=None):
+        """Initializes an empty (cold) cache
+
+        Args:
+            capacity: maximum number of measurements kept
+            max_staleness: seconds the cache is trusted before it is refreshed
+                from the database; None when every write goes through the
+                database the cache is attached to (the writer process)
+        """
+        self.capacity = capacity
+        self.max_staleness = max_staleness
+
+        # Ring buffer columns, oldest measurement at self.start
+        self.columns = {
+            "id": array.array("q", [0] * capacity),
+            "temperature": array.array("d", [0.0] * capacity),
+            "humidity": array.array("d", [0.0] * capacity),
+            "ts": array.array("d", [0.0] * capacity),
+            "sensor_id": array.array("q", [0] * capacity),
+        }
+        self.start = 0
+        self.count = 0
+
+        # Cache state
+        self.warm = False  # Loaded from the database since the last invalidation
+        self.complete = False  # Holds every measurement of the table
+        self.stale = False  # Writes happened that are not cached yet
+        self.refresh_time = None  # Monotonic time of the last refresh
+        self.older_max_ts = None  # Newest ts of the measurements older than the ring (None if complete)
+        self.prunes = None  # Prune count of the database when loaded (see prune_measurements)
+        self.lock = threading.Lock()
+
+        self.counters = {"hits": 0, "misses": 0, "refreshes": 0, "invalidations": 0}
+
+    def needs_refresh(self):
+        """ Checks if the cache must be refreshed from the database before use
+        """
+        with self.lock:
+            if not self.warm or self.stale:
+                return True
+
+            if self.max_staleness is not None:
+                return time.monotonic() - self.refresh_time > self.max_staleness
+
+        return False
+
+    def last_id(self):
+        """ Gets the id of the newest cached measurement (None when empty or cold) """
+        with self.lock:
+            if not self.warm or self.count == 0:
+                return None
+
+            return self.columns["id"][(self.start + self.count - 1) % self.capacity]
+
+    def load(self, rows, complete, older_max_ts=None, prunes=None):
+        """ Replaces the cache content with measurements read from the database
+
+        Args:
+            rows: CACHE_COLUMNS tuples in ascending id order
+            complete: True if rows are all the measurements of the table
+            older_max_ts: newest ts of the measurements with a lower id than
+                rows (None if there are none or it is unknown)
+            prunes: prune count of the database the rows were read after
+        """
+        with self.lock:
+            self.start = 0
+            self.count = 0
+            self.older_max_ts = None if complete else older_max_ts
+            self._append_rows(rows[-self.capacity:])
+            self.complete = complete
+            self.prunes = prunes
+            self.warm = True
+            self.stale = False
+            self.refresh_time = time.monotonic()
+            self.counters["refreshes"] += 1
+
+    def extend(self, rows, refreshed=False):
+        """ Appends new measurements, rows not newer than the cache are ignored
+
+        Args:
+            rows: CACHE_COLUMNS tuples in ascending id order
+            refreshed: True if rows are every measurement written since the
+                newest cached one (a refresh from the database)
+        """
+        with self.lock:
+            if not self.warm:
+                return
+
+            self._append_rows(rows)
+
+            if refreshed:
+                self.stale = False
+                self.refresh_time = time.monotonic()
+                self.counters["refreshes"] += 1
+
+    def append_written(self, row):
+        """ Caches a measurement written through the attached database
+
+        The row is only appended if its id directly follows the newest cached
+        id, otherwise another writer may have written in between and the cache
+        is refreshed before its next use.
+
+        Args:
+            row: CACHE_COLUMNS tuple of the new measurement
+        """
+        with self.lock:
+            if not self.warm:
+                return
+
+            if self.count and row[0] == self.columns["id"][(self.start + self.count - 1) % self.capacity] + 1:
+                self._append_rows((row,))
+            else:
+                self.stale = True
+
+    def mark_stale(self):
+        """ Marks that measurements were written without being cached """
+        with self.lock:
+            self.stale = True
+
+    def invalidate(self):
+        """ Empties the cache, it is reloaded from the database on next use """
+        with self.lock:
+            self.start = 0
+            self.count = 0
+            self.warm = False
+            self.complete = False
+            self.stale = False
+            self.older_max_ts = None
+            self.prunes = None
+            self.counters["invalidations"] += 1
+
+    def get_recent(self, num_of_measurements, since_id=None, columns=CACHE_COLUMNS,
+                   sensor_id=None):
+        """ Gets the most recent measurements if the cache can answer exactly
+
+        Args:
+            num_of_measurements: maximum number of recent measurements to get
+            since_id: only return measurements with an id greater than this
+            columns: measurement columns to return (subset of CACHE_COLUMNS)
+            sensor_id: only return measurements of this sensor (default all)
+
+        Returns:
+            list: measurement tuples ordered by time (ts, then id, see
+            query_recent), None on a miss
+        """
+        with self.lock:
+            ids = self.columns["id"]
+            timestamps = self.columns["ts"]
+            sensor_ids = self.columns["sensor_id"]
+            positions = []
+            scanned = 0
+
+            # Walk back from the newest id until the measurements are not newer
+            # than since_id
+            while scanned < self.count:
+                position = (self.start + self.count - 1 - scanned) % self.capacity
+                if since_id is not None and ids[position] <= since_id:
+                    break
+
+                if sensor_id is None or sensor_ids[position] == sensor_id:
+                    positions.append(position)
+                scanned += 1
+
+            positions = heapq.nlargest(
+                num_of_measurements, positions,
+                key=lambda position: (timestamps[position], ids[position]))
+
+            # Measurements older than the ring may still be newer by time
+            newest_first = not positions or (
+                self.older_max_ts is not None and timestamps[positions[-1]] > self.older_max_ts)
+
+            # Older measurements may exist that were never cached or evicted
+            all_newer_cached = self.complete or scanned < self.count
+            enough = len(positions) == num_of_measurements and newest_first
+            if not self.warm or not (all_newer_cached or enough):
+                self.counters["misses"] += 1
+                return None
+
+            positions.reverse()
+            column_values = [
+                [self.columns[column][position] for position in positions]
+                for column in columns
+            ]
+            self.counters["hits"] += 1
+
+        return list(zip(*column_values))
+
+    def get_counters(self):
+        """ Gets the cache counters
+
+        Returns:
+            dict: 'hits', 'misses', 'refreshes' and 'invalidations' since start
+            up and the number of measurements 'cached'
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            counters["cached"] = self.count
+
+        return counters
+
+    def _append_rows(self, rows):
+        """ Appends rows to the ring, evicting the oldest (lock held) """
+        for row in rows:
+            if self.count and row[0] <= self.columns["id"][(self.start + self.count - 1) % self.capacity]:
+                continue
+
+            if self.count == self.capacity:
+                # Evict oldest measurement
+                evicted_ts = self.columns["ts"][self.start]
+                if self.complete or self.older_max_ts is not None:
+                    self.older_max_ts = max(self.older_max_ts or evicted_ts, evicted_ts)
+                self.start = (self.start + 1) % self.capacity
+                self.count -= 1
+                self.complete = False
+
+            position = (self.start + self.count) % self.capacity
+            for column, value in zip(CACHE_COLUMNS, row):
+                self.columns[column][position] = value
+            self.count += 1
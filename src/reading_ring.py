@@ -0,0 +1,211 @@
+"""reading_ring.py: This is the python module for the shared-memory reading ring
+
+This python module is used to share the sensor readings of the acquisition
+process with the GUI and web server processes. The acquisition process is the
+only writer: it appends every successful reading to a fixed size ring in a
+multiprocessing.shared_memory block and keeps the sensor status in the ring
+header. Any number of reader processes copy readings out of the block without
+locks and without touching the sensor.
+
+Readers and the writer are kept consistent with a sequence lock: the writer
+makes the header sequence odd while it writes and even again when done, and a
+reader retries its copy if the sequence was odd or changed meanwhile. Readers
+that want to wait for a new reading block on an optional shared
+multiprocessing.Condition that the writer notifies after every write.
+
+"""
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from src.reading import Reading
+
+# Readings kept in the ring
+DEFAULT_RING_CAPACITY = 256
+
+# Header: sequence lock, readings written, sensor status code, capacity
+HEADER = struct.Struct("<QQQQ")
+SEQUENCE = struct.Struct("<Q")
+
+# Reading: temperature (celsius), humidity, epoch time, monotonic time, filtered
+# temperature, filtered humidity
+SLOT = struct.Struct("<dddddd")
+
+# Sensor statuses by code (see AcquisitionWorker.get_latest)
+STATUSES = ("Warming Up", "Ready", "Unavailable", "Offline")
+
+
+class ReadingRing:
+    """ Single-writer, multi-reader ring of sensor readings in shared memory
+    """
+
+    def __init__(self, name=None, capacity=DEFAULT_RING_CAPACITY, create=False, condition=None):
+        """Creates a new ring or attaches to an existing one
+
+        Args:
+            name: shared memory block name (generated when creating without one)
+            capacity: readings kept, only used when creating
+            create: True in the process that owns (and later unlinks) the ring
+            condition: multiprocessing.Condition shared by the writer and the
+                readers, needed to wait for new readings
+        """
+        if create:
+            self.memory = shared_memory.SharedMemory(
+                name=name, create=True, size=HEADER.size + capacity * SLOT.size)
+            HEADER.pack_into(self.memory.buf, 0, 0, 0, 0, capacity)
+        else:
+            # Processes started by the owner share its resource tracker, so
+            # attaching does not make them unlink the ring when they exit
+            self.memory = shared_memory.SharedMemory(name=name)
+
+        self.name = self.memory.name
+        self.owner = create
+        self.capacity = HEADER.unpack_from(self.memory.buf, 0)[3]
+        self.condition = condition
+        self.read_retries = 0
+
+    def write(self, status, temperature=None, humidity=None, filtered_temperature=None,
+              filtered_humidity=None, ts=None, monotonic_time=None):
+        """ Publishes the sensor status and, if given, a new reading (writer only)
+
+        Args:
+            status: sensor status, one of STATUSES
+            temperature: new temperature reading (celsius), None for a status update
+            humidity: new humidity reading
+            filtered_temperature: filtered temperature (default the raw one)
+            filtered_humidity: filtered humidity (default the raw one)
+            ts: epoch time the reading was taken (default now)
+            monotonic_time: monotonic time the reading was taken (default now)
+        """
+        buffer = self.memory.buf
+        sequence, head, _, capacity = HEADER.unpack_from(buffer, 0)
+
+        # Odd sequence: readers retry until the write is done
+        SEQUENCE.pack_into(buffer, 0, sequence + 1)
+
+        if temperature is not None:
+            SLOT.pack_into(buffer, HEADER.size + (head % capacity) * SLOT.size,
+                           temperature, humidity, time.time() if ts is None else ts,
+                           time.monotonic() if monotonic_time is None else monotonic_time,
+                           temperature if filtered_temperature is None else filtered_temperature,
+                           humidity if filtered_humidity is None else filtered_humidity)
+            head += 1
+
+        HEADER.pack_into(buffer, 0, sequence + 1, head, STATUSES.index(status), capacity)
+        SEQUENCE.pack_into(buffer, 0, sequence + 2)
+
+        if self.condition is not None:
+            with self.condition:
+                self.condition.notify_all()
+
+    def snapshot(self, num_of_readings=1):
+        """ Copies a consistent view of the ring
+
+        Args:
+            num_of_readings: number of most recent readings to copy
+
+        Returns:
+            tuple: (readings written, status, list of SLOT tuples oldest first)
+        """
+        buffer = self.memory.buf
+
+        while True:
+            sequence, head, status_code, capacity = HEADER.unpack_from(buffer, 0)
+            if sequence % 2:
+                # Write in progress
+                self.read_retries += 1
+                time.sleep(0)
+                continue
+
+            count = max(min(num_of_readings, head, capacity), 0)
+            slots = [
+                SLOT.unpack_from(buffer, HEADER.size + (index % capacity) * SLOT.size)
+                for index in range(head - count, head)
+            ]
+
+            if SEQUENCE.unpack_from(buffer, 0)[0] == sequence:
+                return head, STATUSES[status_code], slots
+
+            self.read_retries += 1
+
+    def get_latest(self):
+        """ Gets the latest reading (see AcquisitionWorker.get_latest) """
+        head, status, slots = self.snapshot(1)
+
+        if not slots:
+            return Reading(status, sequence=head)
+
+        temperature, humidity, ts, monotonic_time, filtered_temperature, filtered_humidity = slots[0]
+
+        return Reading(status, ts, monotonic_time, temperature, humidity, sequence=head,
+                       filtered_temperature=filtered_temperature,
+                       filtered_humidity=filtered_humidity)
+
+    def get_history(self, num_of_readings=None):
+        """ Gets the most recent readings (Readings), oldest first
+
+        Args:
+            num_of_readings: maximum number of readings (default the whole ring)
+        """
+        head, _, slots = self.snapshot(self.capacity if num_of_readings is None else num_of_readings)
+
+        return [
+            Reading("Ready", ts, monotonic_time, temperature, humidity,
+                    sequence=head - len(slots) + position + 1,
+                    filtered_temperature=filtered_temperature,
+                    filtered_humidity=filtered_humidity)
+            for position, (temperature, humidity, ts, monotonic_time, filtered_temperature,
+                           filtered_humidity) in enumerate(slots)
+        ]
+
+    def wait_for_sequence(self, sequence, timeout=None):
+        """ Waits until a reading newer than sequence was written
+
+        Args:
+            sequence: sequence number of the last Reading seen
+            timeout: maximum seconds to wait, None waits forever
+
+        Returns:
+            bool: True if a newer reading is available
+        """
+        if self.condition is None:
+            raise ValueError("Waiting needs the ring condition")
+
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.snapshot(0)[0] > sequence, timeout)
+
+    def when_ready(self, callback):
+        """ Calls callback once the sensor has warmed up (from a helper thread)
+
+        Args:
+            callback: function without arguments
+        """
+        def wait_ready():
+            with self.condition:
+                self.condition.wait_for(lambda: self.snapshot(0)[1] != "Warming Up")
+            callback()
+
+        if self.snapshot(0)[1] != "Warming Up":
+            callback()
+        else:
+            threading.Thread(target=wait_ready, name="ring-ready", daemon=True).start()
+
+    def get_metrics(self):
+        """ Gets the ring metrics
+
+        Returns:
+            dict: number of 'readings' written, sensor 'status' and the
+            'read_retries' of this process caused by concurrent writes
+        """
+        head, status, _ = self.snapshot(0)
+
+        return {"readings": head, "status": status, "read_retries": self.read_retries}
+
+    def close(self):
+        """ Detaches from the ring, the owner also removes the shared memory block """
+        self.memory.close()
+
+        if self.owner:
+            self.memory.unlink()
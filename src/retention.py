@@ -0,0 +1,173 @@
+"""retention.py: This is the python module for the data retention job
+
+This python module is used to enforce the retention policy of the database:
+raw SensorData measurements are kept for a configurable number of days while
+the minute/hour/day rollups are kept forever. The job runs on a background
+thread with its own database connection and prunes in small transactions
+(see TemperatureDatabase.prune_measurements), so the GUI and the web server
+never wait on it.
+
+Run once from the repository root:
+    python3 -m src.retention [--configuration FILE] [--days 30]
+
+"""
+import argparse
+import threading
+import time
+
+from src.database import PRUNE_BATCH_SIZE, TemperatureDatabase
+from src.storage import DATABASE_CONFIGURATION_FILE, load_database_configuration
+
+
+class RetentionJob(threading.Thread):
+    """ Background thread pruning raw measurements past their retention
+    """
+
+    def __init__(self, configuration, retention_days=30, interval=3600.0,
+                 batch_size=PRUNE_BATCH_SIZE, pause=0.05, cache=None):
+        """Initializes the retention job
+
+        Args:
+            configuration: database configuration (see load_database_configuration)
+            retention_days: days raw measurements are kept, None keeps them forever
+            interval: seconds between prune runs
+            batch_size: rows deleted per transaction
+            pause: seconds to sleep between batches to spread the I/O
+            cache: RecentReadingsCache of the application, cleared when
+                measurements are pruned
+        """
+        super().__init__(name="retention", daemon=True)
+
+        self.configuration = configuration
+        self.retention_days = retention_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.cache = cache
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+        self.metrics = {
+            "runs": 0,
+            "failures": 0,
+            "rows_pruned": 0,
+            "last_pruned": 0,
+            "last_run_time": None,
+            "last_duration": 0.0,
+            "total_duration": 0.0,
+        }
+
+    @classmethod
+    def from_configuration(cls, configuration, cache=None):
+        """ Creates the job with the retention settings of a database configuration
+
+        Args:
+            configuration: dict with the optional keys 'RawRetentionDays' (null
+                keeps raw measurements forever) and 'RetentionIntervalSeconds'
+            cache: RecentReadingsCache of the application
+        """
+        return cls(
+            configuration,
+            retention_days=configuration.get("RawRetentionDays", 30),
+            interval=configuration.get("RetentionIntervalSeconds", 3600.0),
+            cache=cache)
+
+    def run(self):
+        """ Prunes once per interval until stopped """
+        if self.retention_days is None:
+            print("Retention: raw measurements are kept forever")
+            return
+
+        database = None
+
+        while not self.stop_event.is_set():
+            try:
+                if database is None:
+                    database = TemperatureDatabase.from_configuration(self.configuration)
+                    if self.cache is not None:
+                        database.enable_cache(self.cache, warm=False)
+                self.run_once(database)
+            except Exception as error:
+                with self.lock:
+                    self.metrics["failures"] += 1
+                print("Retention run failed: {}".format(error))
+
+                # Reconnect on the next run
+                if database is not None:
+                    try:
+                        database.close_connection()
+                    except Exception:
+                        pass
+                    database = None
+
+            self.stop_event.wait(self.interval)
+
+        if database is not None:
+            database.close_connection()
+
+    def run_once(self, database):
+        """ Deletes the raw measurements older than the retention period
+
+        Args:
+            database: TemperatureDatabase to prune
+
+        Returns:
+            dict: results of TemperatureDatabase.prune_measurements
+        """
+        cutoff = time.time() - self.retention_days * 86400
+        prune_results = database.prune_measurements(
+            cutoff, self.batch_size, self.pause, self.stop_event)
+
+        with self.lock:
+            self.metrics["runs"] += 1
+            self.metrics["rows_pruned"] += prune_results["pruned"]
+            self.metrics["last_pruned"] = prune_results["pruned"]
+            self.metrics["last_run_time"] = time.time()
+            self.metrics["last_duration"] = prune_results["seconds"]
+            self.metrics["total_duration"] += prune_results["seconds"]
+
+        if prune_results["pruned"]:
+            print("Retention: pruned {pruned} rows in {batches} batches ({seconds:.2f}s)".format(
+                **prune_results))
+
+        return prune_results
+
+    def stop(self, timeout=None):
+        """ Stops the job after the current batch and waits for the thread """
+        self.stop_event.set()
+
+        if self.is_alive():
+            self.join(timeout)
+
+    def get_metrics(self):
+        """ Gets the retention job metrics
+
+        Returns:
+            dict: number of 'runs' and 'failures', rows pruned in total and in
+            the last run, time of the last run and seconds taken
+        """
+        with self.lock:
+            return dict(self.metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune raw measurements past their retention")
+    parser.add_argument("--configuration", default=DATABASE_CONFIGURATION_FILE)
+    parser.add_argument("--days", type=float, help="days of raw measurements kept "
+                        "(default RawRetentionDays of the configuration)")
+    args = parser.parse_args()
+
+    retention_configuration = load_database_configuration(args.configuration)
+    retention_job = RetentionJob.from_configuration(retention_configuration)
+    if args.days is not None:
+        retention_job.retention_days = args.days
+
+    if retention_job.retention_days is None:
+        print("RawRetentionDays is null, raw measurements are kept forever")
+    else:
+        sys_db = TemperatureDatabase.from_configuration(retention_configuration)
+        try:
+            retention_job.run_once(sys_db)
+        finally:
+            sys_db.close_connection()
+        print(retention_job.get_metrics())
@@ -0,0 +1,289 @@
+"""sensor_drivers.py: This is the python module for the temperature sensor drivers
+
+This python module is used to read temperature and humidity from a source
+behind one interface, so the rest of the application (DHT22Sensor, the
+acquisition worker, the GUI, the web server and the database writer) runs the
+same with or without sensor hardware:
+
+ - DHT22Driver reads a DHT22/AM2302 on a GPIO pin through Adafruit_DHT, which
+   is only imported when the driver is created
+ - SimulatedDriver generates deterministic synthetic readings with noise,
+   drift, dropouts and read latency
+ - ReplayDriver plays back recorded readings (e.g. an export) in real time,
+   accelerated or as fast as they are read
+
+The driver is selected in the sensor configuration file
+(src/sensor_configuration.json), e.g.
+    {"Driver": "simulated", "Seed": 1, "DropoutRate": 0.05, "MinimumInterval": 0}
+    {"Driver": "replay", "Path": "readings.csv.gz", "Speed": 60}
+and several sensors polled by the sensor manager are listed under "Sensors"
+(see sensor_manager.py).
+
+"""
+import bisect
+import json
+import os
+import random
+import time
+
+# Default location of the sensor configuration file
+SENSOR_CONFIGURATION_FILE = "src/sensor_configuration.json"
+
+# Configuration used when no configuration file exists (DHT22 on pin 4)
+DEFAULT_SENSOR_CONFIGURATION = {
+    "Driver": "dht22",
+    "Pin": 4,
+}
+
+# Seconds a DHT22 needs between reads (and after power up)
+DHT22_MINIMUM_INTERVAL = 2.0
+
+
+def load_sensor_configuration(configuration_file=SENSOR_CONFIGURATION_FILE):
+    """ Loads the sensor configuration, missing settings use the defaults
+
+    Args:
+        configuration_file: JSON file with the sensor settings
+
+    Returns:
+        dict: sensor configuration
+    """
+    configuration = dict(DEFAULT_SENSOR_CONFIGURATION)
+
+    if os.path.exists(configuration_file):
+        with open(configuration_file, "r") as json_config_file:
+            configuration.update(json.load(json_config_file))
+
+    return configuration
+
+
+def sensor_name(configuration):
+    """ Gets the name a sensor is registered with (see register_sensor)
+
+    Args:
+        configuration: dict from load_sensor_configuration
+
+    Returns:
+        str: its 'Name', default 'DHT22' for the DHT22 driver (the original
+        sensor) and the driver name for the others
+    """
+    driver_name = configuration.get("Driver", "dht22").lower()
+
+    return configuration.get("Name", "DHT22" if driver_name == "dht22" else driver_name)
+
+
+def create_driver(configuration=None):
+    """ Creates the sensor driver selected by a configuration
+
+    Args:
+        configuration: dict from load_sensor_configuration (default loads the
+            sensor configuration file)
+
+    Returns:
+        SensorDriver: driver to read
+    """
+    if configuration is None:
+        configuration = load_sensor_configuration()
+
+    driver_name = configuration.get("Driver", "dht22").lower()
+
+    if driver_name == "dht22":
+        return DHT22Driver(configuration.get("Pin", 4))
+    if driver_name == "simulated":
+        return SimulatedDriver(
+            seed=configuration.get("Seed", 0),
+            temperature=configuration.get("Temperature", 21.0),
+            humidity=configuration.get("Humidity", 40.0),
+            noise=configuration.get("Noise", 0.2),
+            drift=configuration.get("Drift", 0.0),
+            dropout_rate=configuration.get("DropoutRate", 0.0),
+            latency=configuration.get("LatencySeconds", 0.0),
+            minimum_interval=configuration.get("MinimumInterval", DHT22_MINIMUM_INTERVAL))
+    if driver_name == "replay":
+        return ReplayDriver.from_file(
+            configuration["Path"],
+            speed=configuration.get("Speed", 1.0),
+            loop=configuration.get("Loop", False),
+            minimum_interval=configuration.get("MinimumInterval", 0.0))
+
+    raise ValueError("Unknown sensor driver: {}".format(driver_name))
+
+
+class SensorDriver:
+    """ Interface of the temperature and humidity sources
+    """
+
+    # Driver name used in configuration files
+    name = None
+
+    def __init__(self, minimum_interval=DHT22_MINIMUM_INTERVAL):
+        """Initializes the driver
+
+        Args:
+            minimum_interval: seconds needed between reads and after start up
+        """
+        self.minimum_interval = minimum_interval
+
+    def read(self):
+        """ Reads the sensor once
+
+        Returns:
+            tuple: (humidity, temperature in celsius), (None, None) if the read
+            failed (same order as Adafruit_DHT.read)
+        """
+        raise NotImplementedError
+
+
+class DHT22Driver(SensorDriver):
+    """ DHT22/AM2302 sensor on a Raspberry Pi GPIO pin (Adafruit_DHT)
+    """
+
+    name = "dht22"
+
+    def __init__(self, pin):
+        """Initializes the driver
+
+        Args:
+            pin: GPIO pin the sensor data line is connected to
+        """
+        import Adafruit_DHT
+
+        super().__init__(DHT22_MINIMUM_INTERVAL)
+
+        self.adafruit_dht = Adafruit_DHT
+        self.pin = pin
+
+    def read(self):
+        return self.adafruit_dht.read(self.adafruit_dht.DHT22, self.pin)
+
+
+class SimulatedDriver(SensorDriver):
+    """ Deterministic synthetic sensor for tests and load tests
+    """
+
+    name = "simulated"
+
+    def __init__(self, seed=0, temperature=21.0, humidity=40.0, noise=0.2, drift=0.0,
+                 dropout_rate=0.0, latency=0.0, minimum_interval=DHT22_MINIMUM_INTERVAL):
+        """Initializes the driver, the same seed always gives the same readings
+
+        Args:
+            seed: random seed
+            temperature: mean temperature in celsius
+            humidity: mean humidity in percent
+            noise: standard deviation of the gaussian noise of each reading
+            drift: celsius added to the mean temperature after each read
+            dropout_rate: fraction of reads that fail (0 to 1)
+            latency: seconds each read takes
+            minimum_interval: seconds needed between reads (0 for load tests)
+        """
+        super().__init__(minimum_interval)
+
+        self.random = random.Random(seed)
+        self.temperature = temperature
+        self.humidity = humidity
+        self.noise = noise
+        self.drift = drift
+        self.dropout_rate = dropout_rate
+        self.latency = latency
+        self.reads = 0
+
+    def read(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+        self.reads += 1
+
+        # Draw every value on each read so dropouts do not shift the sequence
+        dropout = self.random.random() < self.dropout_rate
+        temperature = self.temperature + self.drift * self.reads + self.random.gauss(0, self.noise)
+        humidity = self.humidity + self.random.gauss(0, self.noise)
+
+        if dropout:
+            return None, None
+
+        return round(min(max(humidity, 0.0), 100.0), 1), round(temperature, 1)
+
+
+class ReplayDriver(SensorDriver):
+    """ Plays back recorded readings
+    """
+
+    name = "replay"
+
+    def __init__(self, readings, speed=1.0, loop=False, minimum_interval=0.0):
+        """Initializes the driver, playback starts with the first read
+
+        Args:
+            readings: (ts, temperature, humidity) tuples in time order
+            speed: playback speed (1 is real time, 60 plays an hour per
+                minute), None returns the next recorded reading on every read
+            loop: start over at the end of the recording, otherwise reads
+                fail once it is played back
+            minimum_interval: seconds needed between reads
+        """
+        super().__init__(minimum_interval)
+
+        if not readings:
+            raise ValueError("Nothing to replay")
+
+        self.readings = list(readings)
+        self.times = [reading[0] for reading in self.readings]
+
+        # The last reading is replayed for one average interval
+        if len(self.times) > 1:
+            self.end_time = self.times[-1] + (self.times[-1] - self.times[0]) / (len(self.times) - 1)
+        else:
+            self.end_time = self.times[-1]
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        self.start_time = None
+
+    @classmethod
+    def from_file(cls, path, speed=1.0, loop=False, minimum_interval=0.0):
+        """ Creates a driver replaying a CSV or NDJSON file (see importer.py)
+
+        Rows that fail the import validation are skipped.
+        """
+        from src.importer import convert_chunk, guess_format, open_source, read_chunks
+
+        readings = []
+        with open_source(path) as source_file:
+            for columns, _ in read_chunks(source_file, guess_format(path)):
+                arrays, _ = convert_chunk(columns)
+                readings.extend(zip(
+                    arrays["ts"].tolist(), arrays["temperature"].tolist(),
+                    arrays["humidity"].tolist()))
+
+        readings.sort()
+
+        return cls(readings, speed, loop, minimum_interval)
+
+    def read(self):
+        if self.speed is None:
+            index = self.position
+            self.position += 1
+        else:
+            now = time.monotonic()
+            if self.start_time is None:
+                self.start_time = now
+
+            replay_time = self.times[0] + (now - self.start_time) * self.speed
+            index = bisect.bisect_right(self.times, replay_time) - 1
+
+            if replay_time > self.end_time:
+                index = len(self.readings)
+
+        if index >= len(self.readings):
+            if not self.loop:
+                return None, None
+
+            # Start over
+            index = 0
+            self.position = 1
+            self.start_time = time.monotonic()
+
+        _, temperature, humidity = self.readings[index]
+
+        return humidity, temperature
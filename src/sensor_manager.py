@@ -0,0 +1,465 @@
+"""sensor_manager.py: This is the python module for reading several sensors on one hub
+
+This python module is used to poll many sensors (DHT22s on different GPIO
+pins, or any other sensor driver) from a single scheduler thread:
+
+ - reads run one at a time, so the timing-critical DHT22 transfers of two
+   sensors never overlap
+ - each sensor is read every interval but never before the minimum interval
+   of its driver has passed since its last read
+ - the first reads are staggered over the interval, so sensors with the same
+   interval keep apart instead of queueing behind each other every cycle
+
+Every read result is published as a Reading (see reading.py) on a common
+stream (a bounded queue) and to the subscribed callbacks, and per-sensor
+success rate, read latency and achieved sample rate are kept as metrics.
+
+The sensors are listed in the sensor configuration file, e.g.
+    {"Sensors": [{"Name": "attic", "Pin": 4}, {"Name": "cellar", "Pin": 17, "Interval": 10}]}
+without a "Sensors" list the single sensor of the file is polled. Run from the
+repository root to log all sensors to the database:
+    python3 -m src.sensor_manager [--seconds 60] [--no-store]
+and to run its test code with simulated sensors:
+    python3 -m src.sensor_manager --test
+
+"""
+import argparse
+import collections
+import heapq
+import queue
+import sys
+import threading
+import time
+
+from src.acquisition import DEFAULT_READ_INTERVAL
+from src.database import TemperatureDatabase
+from src.dht_22 import DHT22Sensor
+from src.reading import ReadingBatch
+from src.sensor_drivers import (
+    SENSOR_CONFIGURATION_FILE,
+    SimulatedDriver,
+    create_driver,
+    load_sensor_configuration,
+    sensor_name,
+)
+from src.sensor_retry import RetryPolicy
+from src.storage import DATABASE_CONFIGURATION_FILE, load_database_configuration
+
+# Read results kept on the stream for slow consumers
+DEFAULT_STREAM_SIZE = 1000
+
+# Readings of the stream stored together by the command line logger
+DEFAULT_STORE_BATCH_SIZE = 20
+
+
+class ScheduledSensor:
+    """ A sensor polled by the manager with its schedule and metrics
+    """
+
+    def __init__(self, name, sensor, interval, sensor_id=None):
+        """Initializes the entry
+
+        Args:
+            name: name of the sensor (unique per manager)
+            sensor: DHT22Sensor reading the sensor driver
+            interval: seconds between reads, at least the minimum interval of the driver
+            sensor_id: registered sensor of the readings (see register_sensor)
+        """
+        self.name = name
+        self.sensor = sensor
+        self.interval = max(interval, sensor.minimum_interval)
+        self.sensor_id = sensor_id
+
+        self.next_read_time = None  # Monotonic time the next read is due
+        self.last_read_end = None  # Monotonic time the last read finished
+        self.sensor_ready_time = None  # Monotonic time the sensor may be read again
+        self.latest = None  # Last read result
+
+        self.metrics = {
+            "reads": 0,
+            "successes": 0,
+            "failures": 0,
+            "late_reads": 0,
+            "not_ready": 0,
+            "total_read_seconds": 0.0,
+            "max_read_seconds": 0.0,
+            "first_read_time": None,
+            "last_read_time": None,
+        }
+
+
+class SensorManager(threading.Thread):
+    """ Scheduler thread polling several sensors without overlapping reads
+    """
+
+    def __init__(self, stream_size=DEFAULT_STREAM_SIZE):
+        """Initializes the manager, sensors are added before it is started
+
+        Args:
+            stream_size: read results kept on the stream, the oldest are
+                dropped when nobody consumes them
+        """
+        super().__init__(name="sensor-manager", daemon=True)
+
+        self.sensors = []
+        self.stream = queue.Queue(maxsize=stream_size)
+        self.subscribers = []
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+        self.start_time = None
+        self.counters = {"bus_seconds": 0.0, "published": 0, "dropped": 0}
+
+    @classmethod
+    def from_configuration(cls, configuration=None):
+        """ Creates a manager polling the sensors of a sensor configuration
+
+        Args:
+            configuration: dict from load_sensor_configuration, its optional
+                'Sensors' list holds one configuration per sensor (default
+                loads the sensor configuration file). Sensors are named as the
+                GUI registers them (see sensor_name), with the pin appended
+                when several would get the same name
+        """
+        if configuration is None:
+            configuration = load_sensor_configuration()
+
+        manager = cls()
+        sensor_list = configuration.get("Sensors") or [configuration]
+
+        # Settings missing for a sensor are taken from the top level
+        sensor_configurations = [dict(configuration, **sensor_configuration)
+                                 for sensor_configuration in sensor_list]
+        names = [sensor_name(sensor_configuration) for sensor_configuration in sensor_configurations]
+
+        for sensor_configuration, name in zip(sensor_configurations, names):
+            sensor_configuration.pop("Sensors", None)
+            if names.count(name) > 1:
+                name = "{}-{}".format(name, sensor_configuration["Pin"])
+
+            manager.add_sensor(
+                name,
+                create_driver(sensor_configuration),
+                pin=sensor_configuration["Pin"],
+                interval=sensor_configuration.get("Interval", DEFAULT_READ_INTERVAL),
+                retry_policy=RetryPolicy.from_configuration(sensor_configuration))
+
+        return manager
+
+    def add_sensor(self, name, driver, pin=None, interval=DEFAULT_READ_INTERVAL, sensor_id=None,
+                   retry_policy=None):
+        """ Adds a sensor to poll (before the manager is started)
+
+        Args:
+            name: name of the sensor, unique per manager
+            driver: SensorDriver reading the sensor
+            pin: GPIO pin of the sensor
+            interval: seconds between reads
+            sensor_id: registered sensor of the readings
+            retry_policy: RetryPolicy of failed reads (default RetryPolicy())
+
+        Returns:
+            ScheduledSensor: the scheduled sensor
+        """
+        if self.is_alive():
+            raise RuntimeError("Sensors must be added before the manager is started")
+        if any(entry.name == name for entry in self.sensors):
+            raise ValueError("Sensor {} is already managed".format(name))
+
+        entry = ScheduledSensor(name, DHT22Sensor(pin, driver, retry_policy), interval, sensor_id)
+        self.sensors.append(entry)
+
+        return entry
+
+    def register_sensors(self, database, hub_id):
+        """ Registers the managed sensors in the Sensors table to get their sensor ids
+
+        Args:
+            database: TemperatureDatabase
+            hub_id: hub the sensors are connected to
+        """
+        for entry in self.sensors:
+            entry.sensor_id = database.register_sensor(hub_id, entry.name, entry.sensor.pin_number)
+
+    def subscribe(self, callback):
+        """ Calls callback(reading) on the manager thread for every read result
+
+        Callbacks must return quickly, they delay the next read.
+        """
+        self.subscribers.append(callback)
+
+    def get_reading(self, timeout=None):
+        """ Gets the next read result from the stream
+
+        Args:
+            timeout: maximum seconds to wait, None waits until a result arrives
+
+        Returns:
+            Reading: read result (see publish), None if the timeout expired
+        """
+        try:
+            return self.stream.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def schedule_first_reads(self):
+        """ Staggers the first reads over the interval once the sensors have warmed up
+
+        Returns:
+            list: heap of (read time, position, sensor)
+        """
+        now = time.monotonic()
+        schedule = []
+
+        for position, entry in enumerate(self.sensors):
+            # Scheduled on the clock of the sensor timers (absolute monotonic time)
+            stagger = position * entry.interval / len(self.sensors)
+            entry.next_read_time = max(entry.sensor.ready_time, now) + stagger
+            schedule.append((entry.next_read_time, position, entry))
+
+        heapq.heapify(schedule)
+
+        return schedule
+
+    def run(self):
+        """ Reads the sensor due next until stopped """
+        self.start_time = time.monotonic()
+        schedule = self.schedule_first_reads()
+
+        while schedule and not self.stop_event.is_set():
+            read_time, position, entry = heapq.heappop(schedule)
+
+            if self.stop_event.wait(max(read_time - time.monotonic(), 0.0)):
+                break
+
+            succeeded = self.read_sensor(entry)
+
+            # Keep the cadence, but never read before the sensor allows it (minimum
+            # interval after a reading, retry backoff after a failure, warm up)
+            if succeeded:
+                entry.next_read_time = max(read_time + entry.interval, entry.sensor_ready_time)
+            else:
+                entry.next_read_time = entry.sensor_ready_time
+            heapq.heappush(schedule, (entry.next_read_time, position, entry))
+
+    def read_sensor(self, entry):
+        """ Reads one sensor, updates its metrics and publishes the result
+
+        Args:
+            entry: ScheduledSensor to read
+
+        A sensor that was not ready ('Busy' or 'Warming Up') was not read, the
+        result is neither counted nor published and the sensor is requeued.
+
+        Returns:
+            bool: True if the read gave a new reading
+        """
+        start_time = time.monotonic()
+        result = entry.sensor.get_current_reading()
+        entry.last_read_end = time.monotonic()
+        entry.sensor_ready_time = entry.sensor.next_read_time
+        read_seconds = entry.last_read_end - start_time
+
+        if result.status in ("Busy", "Warming Up"):
+            with self.lock:
+                entry.metrics["not_ready"] += 1
+            return False
+
+        with self.lock:
+            metrics = entry.metrics
+            metrics["reads"] += 1
+            metrics["total_read_seconds"] += read_seconds
+            metrics["max_read_seconds"] = max(metrics["max_read_seconds"], read_seconds)
+            if metrics["first_read_time"] is None:
+                metrics["first_read_time"] = start_time
+            metrics["last_read_time"] = start_time
+
+            # Started later than a tenth of the interval after it was due
+            if start_time - entry.next_read_time > entry.interval / 10:
+                metrics["late_reads"] += 1
+
+            if result.status == "New":
+                metrics["successes"] += 1
+            else:
+                metrics["failures"] += 1
+
+            self.counters["bus_seconds"] += read_seconds
+
+        self.publish(result._replace(
+            status="Ready" if result.status == "New" else result.status,
+            sensor_id=entry.sensor_id), entry)
+
+        return result.status == "New"
+
+    def publish(self, reading, entry):
+        """ Puts a read result on the stream and passes it to the subscribers
+
+        Args:
+            reading: Reading with the sensor_id of the sensor and its status
+                ('Ready', 'Unavailable' or 'Offline')
+            entry: ScheduledSensor that was read
+        """
+        entry.latest = reading
+
+        try:
+            self.stream.put_nowait(reading)
+        except queue.Full:
+            # Drop the oldest result for the newest
+            try:
+                self.stream.get_nowait()
+            except queue.Empty:
+                pass
+            self.stream.put_nowait(reading)
+            self.counters["dropped"] += 1
+
+        self.counters["published"] += 1
+
+        for callback in self.subscribers:
+            callback(reading)
+
+    def get_latest(self, name):
+        """ Gets the last read result of a sensor (None before its first read) """
+        for entry in self.sensors:
+            if entry.name == name:
+                return entry.latest
+
+        raise KeyError(name)
+
+    def get_metrics(self):
+        """ Gets the manager metrics
+
+        Returns:
+            dict: per sensor ('sensors') reads, successes, failures, late reads,
+            'not_ready' attempts requeued because the sensor was busy or warming up,
+            'success_rate', 'mean_read_seconds', 'max_read_seconds' and the
+            achieved 'sample_rate' (successful readings per second) with the
+            read 'telemetry' of the sensor (see DHT22Sensor.get_read_metrics), and the
+            share of time the sensors were being read ('bus_utilization')
+        """
+        with self.lock:
+            sensor_metrics = {}
+            for entry in self.sensors:
+                metrics = dict(entry.metrics)
+                first_read_time = metrics.pop("first_read_time")
+                last_read_time = metrics.pop("last_read_time")
+                total_read_seconds = metrics.pop("total_read_seconds")
+
+                metrics["interval"] = entry.interval
+                metrics["success_rate"] = (
+                    metrics["successes"] / metrics["reads"] if metrics["reads"] else None)
+                metrics["mean_read_seconds"] = (
+                    total_read_seconds / metrics["reads"] if metrics["reads"] else None)
+
+                # Readings per second over the reads so far (one interval per read)
+                metrics["sample_rate"] = (
+                    metrics["successes"] / (last_read_time - first_read_time + entry.interval)
+                    if metrics["reads"] else None)
+
+                metrics["telemetry"] = entry.sensor.get_read_metrics()
+                sensor_metrics[entry.name] = metrics
+
+            counters = dict(self.counters)
+
+        elapsed = time.monotonic() - self.start_time if self.start_time else 0.0
+        counters["bus_utilization"] = counters["bus_seconds"] / elapsed if elapsed else None
+        counters["sensors"] = sensor_metrics
+
+        return counters
+
+    def stop(self, timeout=None):
+        """ Stops the manager after the current read and waits for the thread """
+        self.stop_event.set()
+
+        if self.is_alive():
+            self.join(timeout)
+
+
+def test_code():
+    """Test code for the sensor manager, polls simulated sensors with a slow subscriber"""
+    manager = SensorManager()
+    for position in range(3):
+        manager.add_sensor("simulated-{}".format(position),
+                           SimulatedDriver(seed=position, dropout_rate=0.3, minimum_interval=0.02),
+                           interval=0.02, retry_policy=RetryPolicy(base_delay=0.02, seed=position))
+
+    # A subscriber slower than the minimum interval must not make the manager read early
+    statuses = collections.Counter()
+
+    def slow_subscriber(reading):
+        statuses[reading.status] += 1
+        time.sleep(0.002)
+
+    manager.subscribe(slow_subscriber)
+    manager.start()
+    time.sleep(1.5)
+    manager.stop()
+
+    print(dict(statuses))
+    assert statuses["Ready"] > 0
+    assert statuses["Busy"] == 0 and statuses["Warming Up"] == 0
+
+    # Failures counted by the manager are the failed reads of the drivers
+    for entry in manager.sensors:
+        metrics = entry.metrics
+        totals = entry.sensor.get_read_metrics()["totals"]
+        print(entry.name, metrics["failures"], totals["failures"], metrics["not_ready"])
+        assert metrics["successes"] == totals["successes"]
+        assert metrics["failures"] == totals["failures"]
+
+    print("Sensor Manager Test Passed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Poll the configured sensors")
+    parser.add_argument("--configuration", default=SENSOR_CONFIGURATION_FILE,
+                        help="sensor configuration file")
+    parser.add_argument("--database-configuration", default=DATABASE_CONFIGURATION_FILE)
+    parser.add_argument("--seconds", type=float, default=60.0, help="seconds to poll")
+    parser.add_argument("--no-store", action="store_true",
+                        help="print the readings instead of storing them")
+    parser.add_argument("--test", action="store_true",
+                        help="run the test code with simulated sensors and exit")
+    args = parser.parse_args()
+
+    if args.test:
+        test_code()
+        sys.exit(0)
+
+    sensor_manager = SensorManager.from_configuration(load_sensor_configuration(args.configuration))
+
+    sys_db = None
+    if not args.no_store:
+        db_configuration = load_database_configuration(args.database_configuration)
+        sys_db = TemperatureDatabase.from_configuration(db_configuration)
+        sys_db.create_table()
+        sys_db.enable_batched_writes()
+        sensor_manager.register_sensors(sys_db, db_configuration["HubId"])
+
+    sensor_manager.start()
+    end_time = time.monotonic() + args.seconds
+
+    # Readings are stored a batch at a time
+    stream_batch = ReadingBatch(DEFAULT_STORE_BATCH_SIZE)
+
+    while time.monotonic() < end_time:
+        stream_reading = sensor_manager.get_reading(timeout=max(end_time - time.monotonic(), 0.0))
+        if stream_reading is None or stream_reading.status != "Ready":
+            continue
+
+        if sys_db is None:
+            print(stream_reading)
+        else:
+            stream_batch.append(stream_reading)
+            if len(stream_batch) >= DEFAULT_STORE_BATCH_SIZE:
+                sys_db.store_readings(stream_batch)
+                stream_batch.clear()
+
+    sensor_manager.stop()
+
+    if sys_db is not None:
+        sys_db.store_readings(stream_batch)
+        sys_db.flush()
+        print("Writer: {}".format(sys_db.get_writer_counters()))
+        sys_db.close_connection()
+
+    print("Sensors: {}".format(sensor_manager.get_metrics()))
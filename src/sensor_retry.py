@@ -0,0 +1,176 @@
+"""sensor_retry.py: This is the python module for the sensor retry policy and read telemetry
+
+This python module is used to decide when a failed sensor read is retried and
+to keep rolling statistics of the reads. A DHT22 read that fails immediately
+after another one fails again for the same timing reason, so retries are
+scheduled with an exponential, jittered backoff that never comes sooner than
+the minimum interval of the sensor driver. The read telemetry keeps a rolling
+window of attempts to report the success rate, attempts per good reading,
+failure reasons, a read latency histogram and the achieved sample rate.
+
+The policy is set in the sensor configuration file, e.g.
+    {"Retry": {"BaseDelay": 2.0, "Multiplier": 2.0, "MaxDelay": 30.0, "Jitter": 0.2, "OfflineAfter": 3}}
+
+"""
+import collections
+import random
+import threading
+import time
+
+# Upper bounds (seconds) of the read latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.01, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Read attempts kept in the rolling window
+DEFAULT_TELEMETRY_WINDOW = 500
+
+
+class RetryPolicy:
+    """ Jittered exponential backoff between failed reads
+    """
+
+    def __init__(self, base_delay=2.0, multiplier=2.0, max_delay=30.0, jitter=0.2,
+                 offline_after=3, seed=None):
+        """Initializes the policy
+
+        Args:
+            base_delay: seconds before the first retry
+            multiplier: factor the delay grows by with every further failure
+            max_delay: longest delay between retries
+            jitter: random fraction (+/-) applied to each delay, so sensors
+                failing together do not retry in lock step
+            offline_after: consecutive failures before the sensor is reported
+                offline (reads still continue at the backoff delay)
+            seed: random seed of the jitter (None seeds from the system)
+        """
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.offline_after = offline_after
+        self.random = random.Random(seed)
+
+    @classmethod
+    def from_configuration(cls, configuration):
+        """ Creates the policy of a sensor configuration
+
+        Args:
+            configuration: dict with the optional 'Retry' settings
+                ('BaseDelay', 'Multiplier', 'MaxDelay', 'Jitter', 'OfflineAfter')
+        """
+        retry_configuration = configuration.get("Retry", {})
+
+        return cls(
+            base_delay=retry_configuration.get("BaseDelay", 2.0),
+            multiplier=retry_configuration.get("Multiplier", 2.0),
+            max_delay=retry_configuration.get("MaxDelay", 30.0),
+            jitter=retry_configuration.get("Jitter", 0.2),
+            offline_after=retry_configuration.get("OfflineAfter", 3))
+
+    def retry_delay(self, failures, minimum_interval=0.0):
+        """ Gets the seconds to wait before the next attempt
+
+        Args:
+            failures: consecutive failed attempts so far (at least 1)
+            minimum_interval: seconds the sensor needs between reads
+
+        Returns:
+            float: delay, never shorter than minimum_interval
+        """
+        delay = min(self.base_delay * self.multiplier ** max(failures - 1, 0), self.max_delay)
+        delay *= 1 + self.random.uniform(-self.jitter, self.jitter)
+
+        return max(delay, minimum_interval)
+
+
+class ReadTelemetry:
+    """ Rolling counters of the read attempts of one sensor
+    """
+
+    def __init__(self, window=DEFAULT_TELEMETRY_WINDOW):
+        """Initializes the telemetry
+
+        Args:
+            window: number of most recent attempts the rates and histogram cover
+        """
+        self.lock = threading.Lock()
+
+        # (monotonic time, success, latency) of the most recent attempts
+        self.attempts = collections.deque(maxlen=window)
+
+        # Attempts each of the most recent good readings took
+        self.attempts_per_reading = collections.deque(maxlen=window)
+        self.pending_attempts = 0
+
+        self.totals = {"attempts": 0, "successes": 0, "failures": 0}
+        self.failure_reasons = collections.Counter()
+
+    def record(self, success, latency, reason=None):
+        """ Records one read attempt
+
+        Args:
+            success: True if the attempt gave a valid reading
+            latency: seconds the attempt took
+            reason: why the attempt failed ('no_data', 'out_of_range' or the
+                name of the driver exception)
+        """
+        with self.lock:
+            self.attempts.append((time.monotonic(), success, latency))
+            self.pending_attempts += 1
+            self.totals["attempts"] += 1
+
+            if success:
+                self.totals["successes"] += 1
+                self.attempts_per_reading.append(self.pending_attempts)
+                self.pending_attempts = 0
+            else:
+                self.totals["failures"] += 1
+                self.failure_reasons[reason] += 1
+
+    def get_metrics(self):
+        """ Gets the read telemetry
+
+        Returns:
+            dict: 'totals' since start up, 'failure_reasons', and over the
+            rolling window the 'success_rate', mean 'attempts_per_reading',
+            'sample_rate' (good readings per second between the first and last
+            good reading), mean and maximum latency
+            and the 'latency_histogram' (attempts per bucket upper bound in
+            seconds, '+Inf' for slower ones)
+        """
+        with self.lock:
+            attempts = list(self.attempts)
+            attempts_per_reading = list(self.attempts_per_reading)
+            metrics = {
+                "totals": dict(self.totals),
+                "failure_reasons": dict(self.failure_reasons),
+                "window": len(attempts),
+            }
+
+        success_times = [attempt_time for attempt_time, success, _ in attempts if success]
+        successes = len(success_times)
+        latencies = [latency for _, _, latency in attempts]
+
+        histogram = collections.OrderedDict((str(bound), 0) for bound in LATENCY_BUCKETS)
+        histogram["+Inf"] = 0
+        for latency in latencies:
+            for bound in LATENCY_BUCKETS:
+                if latency <= bound:
+                    histogram[str(bound)] += 1
+                    break
+            else:
+                histogram["+Inf"] += 1
+
+        # Between the first and last good reading, failed attempts around them do not count
+        span = success_times[-1] - success_times[0] if successes > 1 else 0.0
+
+        metrics.update({
+            "success_rate": successes / len(attempts) if attempts else None,
+            "attempts_per_reading": (
+                sum(attempts_per_reading) / len(attempts_per_reading) if attempts_per_reading else None),
+            "sample_rate": (successes - 1) / span if span and successes > 1 else None,
+            "mean_latency": sum(latencies) / len(latencies) if latencies else None,
+            "max_latency": max(latencies) if latencies else None,
+            "latency_histogram": dict(histogram),
+        })
+
+        return metrics
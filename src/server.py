@@ -12,32 +12,89 @@ http://fabacademy.org/archives/2015/doc/WebSocketConsole.html
 """
 import json
 import datetime
+import math
 import os
+import time
 
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
-from tornado.web import Application, RequestHandler
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.iostream import StreamClosedError
+from tornado.web import Application, HTTPError, RequestHandler
 from tornado.websocket import WebSocketHandler
 
-from PyQt5.QtCore import QObject, QProcess
-
+from src.acquisition import AcquisitionWorker
 from src.dht_22 import DHT22Sensor
+from src.async_database import AsyncTemperatureDatabase
 from src.database import TemperatureDatabase
+from src.database_pool import DatabasePool, PoolTimeoutError
+from src.export import EXPORT_FORMATS, format_chunk, format_header
+from src.filters import SignalConditioner
+from src.reading_cache import RecentReadingsCache
+from src.sensor_drivers import load_sensor_configuration, sensor_name
+from src.storage import create_storage_backend, load_database_configuration
 
 
 class TempomaticWebServer:
     """ Class that handles the webserver functions and setup
     """
 
-    def __init__(self):
+    def __init__(self, reading_source=None):
         """ initializes the instance of the webserver class
+
+        Args:
+            reading_source: ReadingRing of the acquisition process, None to read
+                the sensor in this process
         """
+        # Database connections shared by all handlers
+        self.db_configuration = load_database_configuration()
+        self.db_pool = DatabasePool(self.open_database, max_size=5)
+        self.pool_recycle_interval_ms = 60000   # How often idle connections are recycled
+        self.pool_recycle_callback = None
+
+        # Recent readings shared by the pooled connections, the readings are
+        # written by the GUI process so the cache is refreshed every few seconds
+        self.reading_cache = RecentReadingsCache(capacity=500, max_staleness=2.0)
+
+        # Non-blocking queries for the handlers, failing with these errors when
+        # the pool is exhausted or the database is down
+        self.async_db = AsyncTemperatureDatabase(self.db_pool)
+        self.database_errors = (
+            PoolTimeoutError, create_storage_backend(self.db_configuration).Error)
+
+        # Sensor of this hub (registered as by the GUI), NA and PD requests
+        # without a sensor id return its readings
+        sensor_configuration = load_sensor_configuration()
+        with self.db_pool.connection() as database:
+            database.create_table()
+            self.sensor_id = database.register_sensor(
+                self.db_configuration["HubId"], sensor_name(sensor_configuration),
+                sensor_configuration["Pin"])
+
+        # System DHT22 Sensor, read in the background and shared by all handlers
+        # unless another process owns it
+        if reading_source is None:
+            self.temperature_sensor = DHT22Sensor.from_configuration()
+            self.acquisition_worker = AcquisitionWorker(
+                self.temperature_sensor,
+                conditioner=SignalConditioner.from_configuration(sensor_configuration))
+            self.readings = self.acquisition_worker
+        else:
+            self.temperature_sensor = None
+            self.acquisition_worker = None
+            self.readings = reading_source
+
         # Create application
         self.application = Application([
             (r"/", MainHandler),
+            (r"/metrics", MetricsHandler,
+             dict(db_pool=self.db_pool, reading_cache=self.reading_cache,
+                  readings=self.readings)),
+            (r"/export", ExportHandler, dict(async_db=self.async_db)),
             (r"/(.*.css)", WebServerFileHandler),
             (r"/(.*.js)", WebServerFileHandler),
-            (r'/ws', TempomaticHandler,)])
+            (r'/ws', TempomaticHandler,
+             dict(async_db=self.async_db, readings=self.readings, sensor_id=self.sensor_id,
+                  database_errors=self.database_errors))])
 
         # Create http server
         self.http_server = HTTPServer(self.application)
@@ -45,8 +102,13 @@ class TempomaticWebServer:
         # Server parameters
         self.port = 8888    # The port number http should listen on
 
-        # System DHT22 Sensor
-        self.temperature_sensor = DHT22Sensor(4)
+    def open_database(self):
+        """ Opens a database connection for the pool with the shared cache
+        """
+        database = TemperatureDatabase.from_configuration(self.db_configuration)
+        database.enable_cache(self.reading_cache)
+
+        return database
 
     def start_server(self):
         """ Starts the http server for websockets
@@ -54,8 +116,24 @@ class TempomaticWebServer:
         # Set server to listen to port 8888
         self.http_server.listen(self.port)
 
+        # Read the sensor in the background
+        if self.acquisition_worker is not None:
+            self.acquisition_worker.start()
+
+        # Close database connections that sit idle
+        self.pool_recycle_callback = PeriodicCallback(
+            self.db_pool.recycle_idle, self.pool_recycle_interval_ms)
+        self.pool_recycle_callback.start()
+
         # Start IO Loop
-        IOLoop.instance().start()
+        try:
+            IOLoop.instance().start()
+        finally:
+            self.pool_recycle_callback.stop()
+            if self.acquisition_worker is not None:
+                self.acquisition_worker.stop()
+            self.async_db.close()
+            self.db_pool.close_all()
 
 
 class MainHandler(RequestHandler):
@@ -65,6 +143,79 @@ class MainHandler(RequestHandler):
         self.render("client/index.html")
 
 
+class MetricsHandler(RequestHandler):
+    """ Handler reporting server metrics as JSON """
+
+    def initialize(self, db_pool, reading_cache, readings):
+        self.db_pool = db_pool
+        self.reading_cache = reading_cache
+        self.readings = readings
+
+    def get(self):
+        self.write({
+            "databasePool": self.db_pool.get_metrics(),
+            "readingCache": self.reading_cache.get_counters(),
+            "acquisition": self.readings.get_metrics(),
+        })
+
+
+class ExportHandler(RequestHandler):
+    """ Handler streaming the stored measurements as a chunked download
+
+    GET /export?format=csv|ndjson&start=EPOCH&end=EPOCH&sensor=ID (range and
+    sensor optional)
+    """
+
+    def initialize(self, async_db):
+        self.async_db = async_db
+
+    def get_time_argument(self, name):
+        """ Gets an optional epoch time query argument """
+        value = self.get_argument(name, None)
+
+        if value is None:
+            return None
+
+        try:
+            return float(value)
+        except ValueError:
+            raise HTTPError(400, "Invalid {} time: {}".format(name, value))
+
+    async def get(self):
+        export_format = self.get_argument("format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            raise HTTPError(400, "Unknown export format: {}".format(export_format))
+
+        start = self.get_time_argument("start")
+        end = self.get_time_argument("end")
+
+        sensor = self.get_argument("sensor", None)
+        try:
+            sensor_id = int(sensor) if sensor is not None else None
+        except ValueError:
+            raise HTTPError(400, "Invalid sensor id: {}".format(sensor))
+
+        self.set_header("Content-Type", EXPORT_FORMATS[export_format])
+        self.set_header(
+            "Content-Disposition",
+            'attachment; filename="sensor_data.{}"'.format(export_format))
+        self.write(format_header(export_format))
+
+        chunks = self.async_db.iter_measurements(start, end, sensor_id=sensor_id)
+
+        try:
+            async for chunk in chunks:
+                self.write(format_chunk(chunk, export_format))
+
+                # Send the chunk before reading the next one, so a slow client
+                # never makes the server buffer the table
+                await self.flush()
+        except StreamClosedError:
+            print("Export download closed by client")
+        finally:
+            await chunks.aclose()
+
+
 class WebServerFileHandler(RequestHandler):
     """ Static file handler for web code in server """
 
@@ -81,33 +232,40 @@ class TempomaticHandler(WebSocketHandler):
         """ Overriding init method to add additional class elements """
         super().__init__(application, request, **kwargs)
 
-        # Temperature sensor
-        self.temperature_sensor = DHT22Sensor(4)
-
         # Parameters
         self.current_temperature = None
         self.current_humidity = None
-        
-        # System Database
-        self.sys_db = TemperatureDatabase("TEST_DATABASE", "TEMP_MONITOR", "PASSWORD")
 
         # Get current start time for time elapsed
         self.start_time = datetime.datetime.now()
 
-        # Wait for sensor to load
-        # TODO: Fix this so the GUI doesn't lock while waiting for sensor
-        while not self.temperature_sensor.sensor_initialized:
-            self.temperature_sensor.initialize_sensor()
+        # The shared sensor warms up in the background, readings report
+        # 'Warming Up' until then
+
+    def initialize(self, async_db, readings, sensor_id=None, database_errors=(PoolTimeoutError,)):
+        """ Stores the database access and sensor readings shared by all handlers
+
+        Args:
+            async_db: AsyncTemperatureDatabase
+            readings: AcquisitionWorker or ReadingRing with the latest readings
+            sensor_id: sensor of the hub, the default of NA and PD requests
+            database_errors: exceptions of failed queries, answered with a
+                'Failure' status
+        """
+        self.async_db = async_db
+        self.readings = readings
+        self.sensor_id = sensor_id
+        self.database_errors = database_errors
 
     def open(self):
         print("New Connection!")
 
-    def on_message(self, message):
+    async def on_message(self, message):
         # Debug message output
         print("New Message Received: {}".format(message))
 
         # Determine action from received message
-        self.decode_message(message)
+        await self.decode_message(message)
 
     def on_close(self):
         print("Closed Connection!")
@@ -116,8 +274,15 @@ class TempomaticHandler(WebSocketHandler):
         print("Origin: {}".format(origin))
         return True
 
-    def decode_message(self, message):
-        """ Determines what action is required from the server """
+    async def decode_message(self, message):
+        """ Determines what action is required from the server
+
+        NA and PD take an optional sensor id ("PD 3") and default to the
+        sensor of the hub, AG takes it after the bucket and defaults to all
+        sensors.
+        """
+        command = message.split(" ")[0]
+
         # Current readings request
         if message == "CR":
             print("Send Current Readings")
@@ -125,43 +290,74 @@ class TempomaticHandler(WebSocketHandler):
             if current_reading:
                 self.send_current_readings(current_reading)
         # Previous stored readings request
-        elif message == "NA":
+        elif command == "NA":
             print("Get Network Activity")
-            activity = self.get_network_activity()
+            activity = await self.get_network_activity(
+                self.get_sensor_argument(message, 1, self.sensor_id))
             if activity:
                 self.send_network_activity(activity)
         # Plot data request
-        elif message == "PD":
+        elif command == "PD":
             print("Send Plot Data")
-            plot_data = self.get_plot_data()
+            plot_data = await self.get_plot_data(
+                self.get_sensor_argument(message, 1, self.sensor_id))
             if plot_data:
                 self.send_plot_data(plot_data)
+        # Aggregated history request: "AG [start end [bucket [sensor]]]" (epoch seconds)
+        elif command == "AG":
+            print("Send Aggregate Data")
+            aggregate_data = await self.get_aggregate_data(message)
+            self.send_aggregate_data(aggregate_data)
         # Unknown request
         else:
             print("Unsupported message, nothing to do!")
 
+    @staticmethod
+    def get_sensor_argument(message, position, default=None):
+        """ Gets the optional sensor id of a request
+
+        Args:
+            message: request message
+            position: index of the sensor id among the space separated words
+            default: sensor id when it is missing or invalid (None for all sensors)
+
+        Returns:
+            int: sensor id
+        """
+        arguments = message.split()
+
+        try:
+            return int(arguments[position])
+        except (IndexError, ValueError):
+            return default
+
     def get_reading(self):
         """ Get current temperature and humidity reading and update sensor status
 
         Returns: 
-            dict: reading dict with temperature, humidity, and sensor status
+            dict: reading dict with temperature, humidity, reading age (seconds)
+            and sensor status
         """
         # Reading Status
         current_reading = {}
 
-        # Get reading
-        result = self.temperature_sensor.get_current_reading()
+        # Get latest reading of the acquisition worker (never waits on the sensor)
+        result = self.readings.get_latest()
 
-        # Only update values if sensor is not busy
-        if result["status"] == "Busy":
-            current_reading['sensorStatus'] = "Busy"
-        elif result["status"] == "Unavailable":
+        # Only update values if the sensor has a current reading
+        if result.status == "Warming Up":
+            current_reading['sensorStatus'] = "Warming Up"
+        elif result.status == "Unavailable":
             current_reading['sensorStatus'] = "Read Error"
-        elif result["status"] == "Offline":
+        elif result.status == "Offline":
             current_reading['sensorStatus'] = "Offline"
         else:
-            current_reading['currentTemperature'] = "{:.1f}".format(result["temperature"])
-            current_reading['currentHumidity'] = "{:.1f}".format(result["humidity"])
+            current_reading['currentTemperature'] = "{:.1f}".format(result.temperature)
+            current_reading['currentHumidity'] = "{:.1f}".format(result.humidity)
+            current_reading['filteredTemperature'] = "{:.1f}".format(result.filtered_temperature)
+            current_reading['filteredHumidity'] = "{:.1f}".format(result.filtered_humidity)
+            current_reading['readingAge'] = "{:.1f}".format(result.age())
+            current_reading['readingTime'] = result.ts
             current_reading['sensorStatus'] = "Ready"
 
         return current_reading
@@ -172,11 +368,8 @@ class TempomaticHandler(WebSocketHandler):
         # Send current data
         self.write_message(json.dumps(msg))
 
-    def get_network_activity(self):
+    async def get_network_activity(self, sensor_id=None):
         """ Gets network activity status """
-        # System Database
-        self.sys_db = TemperatureDatabase("TEST_DATABASE", "TEMP_MONITOR", "PASSWORD")
-
         # Network Results JSON Obj (Dict)
         network_results = {}
 
@@ -187,12 +380,17 @@ class TempomaticHandler(WebSocketHandler):
         network_results['starttime'] = start_time.strftime("%H:%M:%S.%f")[:-3]
 
         # Get Last 10 Humidity Readings
-        last_readings = self.sys_db.get_last_measurements(10)
-
-        if last_readings is not None:
-            for idx, reading in enumerate(last_readings):
+        try:
+            last_readings = await self.async_db.get_recent(
+                10, columns=("humidity",), sensor_id=sensor_id)
+        except self.database_errors as error:
+            print("Network activity query failed: {}".format(error))
+            last_readings = []
+
+        if last_readings:
+            for idx, (humidity,) in enumerate(last_readings):
                 dataset_key = "dataset{}".format(idx + 1)
-                network_results[dataset_key] = reading[2]
+                network_results[dataset_key] = humidity
 
             network_results["status"] = "Success"
         else:
@@ -220,36 +418,38 @@ class TempomaticHandler(WebSocketHandler):
         # Send network data
         self.write_message(json.dumps(status))
 
-    def get_plot_data(self):
+    async def get_plot_data(self, sensor_id=None):
         """ Gets plot data for server """
-        # System Database
-        self.sys_db = TemperatureDatabase("TEST_DATABASE", "TEMP_MONITOR", "PASSWORD")
-
         # Plot Results JSON Obj (Dict)
         plot_data = {}
 
-        # Get Last 10 Humidity Readings
-        last_readings = self.sys_db.get_last_measurements(10)
+        # Get Last 10 Readings (oldest first)
+        try:
+            last_readings = await self.async_db.get_recent(
+                10, columns=("temperature", "humidity", "ts"), sensor_id=sensor_id)
+        except self.database_errors as error:
+            print("Plot data query failed: {}".format(error))
+            last_readings = []
 
         # Empty data list
         temperature_list = []
         humidity_list = []
         time_list = []
+        timestamp_list = []
 
-        if last_readings is not None:
-            start_time = datetime.datetime.strptime(last_readings[0][3], "%m/%d/%y %X %p")
+        if last_readings:
+            start_time = last_readings[0][2]
             
-            for reading in last_readings:
-                # Get elapsed time
-                timestamp = datetime.datetime.strptime(reading[3], "%m/%d/%y %X %p")
-                elapsed_time = (timestamp - start_time).total_seconds()
-                time_list.append(elapsed_time)
+            for temperature, humidity, timestamp in last_readings:
+                # Get epoch and elapsed time
+                timestamp_list.append(timestamp)
+                time_list.append(timestamp - start_time)
 
                 # Get temperature
-                temperature_list.append(reading[1])
+                temperature_list.append(temperature)
 
                 # Get humidity
-                humidity_list.append(reading[2])
+                humidity_list.append(humidity)
 
                 # Add status
                 plot_data["status"] = "Success"
@@ -260,6 +460,7 @@ class TempomaticHandler(WebSocketHandler):
         # Add data
         plot_data["temperatures"] = temperature_list
         plot_data["times"] = time_list
+        plot_data["timestamps"] = timestamp_list
         plot_data["humidities"] = humidity_list
 
         # Add command
@@ -274,14 +475,67 @@ class TempomaticHandler(WebSocketHandler):
         self.write_message(json.dumps(outgoing_plot_data))
         
 
-def run_server():
+    async def get_aggregate_data(self, message):
+        """ Gets min/max/mean/count per time bucket for a time range
+
+        Args:
+            message: "AG [start end [bucket [sensor]]]", defaults to the last
+            day of all sensors in 15 minute buckets
+
+        Returns:
+            dict: aggregate data message for the client
+        """
+        # Aggregate Results JSON Obj (Dict)
+        aggregate_data = {"command": "aggregateData"}
+
+        try:
+            arguments = [float(argument) for argument in message.split()[1:]]
+            if not all(math.isfinite(argument) for argument in arguments):
+                raise ValueError("Arguments must be finite: {}".format(arguments))
+            end = arguments[1] if len(arguments) > 1 else time.time()
+            start = arguments[0] if arguments else end - 86400
+            bucket = arguments[2] if len(arguments) > 2 else 900
+            sensor_id = int(arguments[3]) if len(arguments) > 3 else None
+            buckets = await self.async_db.get_aggregates(start, end, bucket, sensor_id)
+        except (ValueError, OverflowError) as error:
+            print("Bad aggregate request: {}".format(error))
+            aggregate_data["status"] = "Failure"
+            return aggregate_data
+        except self.database_errors as error:
+            print("Aggregate query failed: {}".format(error))
+            aggregate_data["status"] = "Failure"
+            return aggregate_data
+
+        aggregate_data["status"] = "Success" if buckets else "Failure"
+        aggregate_data["bucket"] = bucket
+        aggregate_data["times"] = [row[0] for row in buckets]
+        aggregate_data["counts"] = [row[1] for row in buckets]
+        aggregate_data["temperatureMins"] = [row[2] for row in buckets]
+        aggregate_data["temperatureMaxs"] = [row[3] for row in buckets]
+        aggregate_data["temperatures"] = [row[4] for row in buckets]
+        aggregate_data["humidityMins"] = [row[5] for row in buckets]
+        aggregate_data["humidityMaxs"] = [row[6] for row in buckets]
+        aggregate_data["humidities"] = [row[7] for row in buckets]
+
+        return aggregate_data
+
+    def send_aggregate_data(self, outgoing_aggregate_data):
+        """ Sends aggregate data to client """
+        self.write_message(json.dumps(outgoing_aggregate_data))
+
+
+def run_server(reading_source=None):
     """ This is the test function to test functionality of the
     server class
+
+    Args:
+        reading_source: ReadingRing of the acquisition process, None to read
+            the sensor in this process
     """
     print("Web Service!")
 
     # Create websockets server instance
-    my_server = TempomaticWebServer()
+    my_server = TempomaticWebServer(reading_source)
 
     # Start server
     my_server.start_server()
@@ -0,0 +1,298 @@
+"""spool.py: This is the python module for the local measurement spool
+
+This python module is used to keep sensor readings on disk while the database
+cannot be written to. Readings are appended to an NDJSON spool file (one
+reading per line, fsync'ed before the write returns) and a background drainer
+replays them in batches once the database answers again, reconnecting with
+exponential backoff.
+
+Crash safety: the replay position is kept in a sidecar offset file that is
+replaced atomically after every committed batch, and a torn last line left by
+a crash is dropped when the spool is opened. A crash between a batch commit
+and the offset update replays that batch again (at least once delivery).
+
+"""
+import json
+import os
+import threading
+import time
+
+from src.database import DEFAULT_SENSOR_ID, TemperatureDatabase
+
+
+class MeasurementSpool:
+    """ Append-only on-disk spool of measurements waiting for the database
+    """
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, max_age=7 * 86400):
+        """Opens the spool, recovering the state left by an earlier run
+
+        Args:
+            path: spool file (the replay offset is kept in path + '.offset')
+            max_bytes: spool file size limit, readings past it are dropped
+            max_age: readings older than this many seconds are not replayed
+        """
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.pending_event = threading.Event()
+
+        self.counters = {"spooled": 0, "replayed": 0, "dropped": 0, "expired": 0, "corrupt": 0}
+
+        # Replay position and number of readings not replayed yet
+        self.read_offset = 0
+        self.pending_rows = 0
+        self.recover()
+
+        self.spool_file = open(self.path, "ab")
+
+    def recover(self):
+        """ Loads the replay offset, drops a torn last line and counts pending readings
+        """
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path, "r") as offset_file:
+                self.read_offset = int(offset_file.read() or 0)
+
+        if not os.path.exists(self.path):
+            self.read_offset = 0
+            return
+
+        with open(self.path, "r+b") as spool_file:
+            spool_file.seek(0, os.SEEK_END)
+            if self.read_offset > spool_file.tell():
+                # Spool was compacted after the offset was written
+                self.read_offset = 0
+
+            spool_file.seek(self.read_offset)
+            unread = spool_file.read()
+            complete_length = unread.rfind(b"\n") + 1
+
+            if complete_length < len(unread):
+                spool_file.truncate(self.read_offset + complete_length)
+
+        self.pending_rows = unread[:complete_length].count(b"\n")
+        if self.pending_rows:
+            print("Spool holds {} readings to replay".format(self.pending_rows))
+            self.pending_event.set()
+
+    def append(self, measurements):
+        """ Durably appends measurements to the spool
+
+        Args:
+            measurements: (temperature, humidity, ts, sensor_id) tuples
+
+        Returns:
+            int: number of measurements spooled, the rest were dropped (spool full)
+        """
+        data = b"".join(
+            json.dumps(list(measurement)).encode() + b"\n" for measurement in measurements)
+
+        with self.lock:
+            if self.spool_file.tell() + len(data) > self.max_bytes:
+                self.counters["dropped"] += len(measurements)
+                print("Spool full, dropped {} readings".format(len(measurements)))
+                return 0
+
+            self.spool_file.write(data)
+            self.spool_file.flush()
+            os.fsync(self.spool_file.fileno())
+
+            self.pending_rows += len(measurements)
+            self.counters["spooled"] += len(measurements)
+            self.pending_event.set()
+
+        return len(measurements)
+
+    def pending(self):
+        """ Checks if readings are waiting to be replayed """
+        with self.lock:
+            return self.pending_rows > 0
+
+    def read_batch(self, max_rows):
+        """ Reads the next readings to replay, starting at the replay offset
+
+        Returns:
+            dict: 'measurements' to write, 'lines' read, 'expired' and 'corrupt'
+            lines skipped and the 'end_offset' to commit once written
+        """
+        with self.lock:
+            start_offset = self.read_offset
+
+        batch = {"measurements": [], "lines": 0, "expired": 0, "corrupt": 0}
+        oldest_ts = time.time() - self.max_age
+
+        with open(self.path, "rb") as spool_file:
+            spool_file.seek(start_offset)
+
+            while batch["lines"] < max_rows:
+                line = spool_file.readline()
+                if not line.endswith(b"\n"):
+                    break
+
+                batch["lines"] += 1
+                try:
+                    measurement = json.loads(line)
+                    if len(measurement) == 3:
+                        # Spooled before readings had a sensor
+                        measurement.append(DEFAULT_SENSOR_ID)
+                    temperature, humidity, ts, sensor_id = measurement
+                except (TypeError, ValueError):
+                    batch["corrupt"] += 1
+                    continue
+
+                if ts < oldest_ts:
+                    batch["expired"] += 1
+                else:
+                    batch["measurements"].append((temperature, humidity, ts, sensor_id))
+
+            batch["end_offset"] = spool_file.tell()
+
+        return batch
+
+    def commit(self, batch):
+        """ Records a batch from read_batch as replayed
+
+        The spool file is emptied once every reading was replayed.
+        """
+        with self.lock:
+            self.read_offset = batch["end_offset"]
+            self.pending_rows -= batch["lines"]
+            self.counters["replayed"] += len(batch["measurements"])
+            self.counters["expired"] += batch["expired"]
+            self.counters["corrupt"] += batch["corrupt"]
+
+            if self.pending_rows == 0:
+                # Fully drained, start over with an empty file
+                self.spool_file.truncate(0)
+                self.spool_file.seek(0)
+                self.read_offset = 0
+                self.pending_event.clear()
+
+            self.write_offset(self.read_offset)
+
+    def write_offset(self, offset):
+        """ Atomically replaces the offset file (lock held) """
+        temporary_path = self.offset_path + ".tmp"
+
+        with open(temporary_path, "w") as offset_file:
+            offset_file.write(str(offset))
+            offset_file.flush()
+            os.fsync(offset_file.fileno())
+
+        os.replace(temporary_path, self.offset_path)
+
+    def get_metrics(self):
+        """ Gets the spool counters
+
+        Returns:
+            dict: readings 'spooled', 'replayed', 'dropped', 'expired' and
+            'corrupt' since start up, spool 'depth' (readings) and 'bytes'
+        """
+        with self.lock:
+            metrics = dict(self.counters)
+            metrics["depth"] = self.pending_rows
+            metrics["bytes"] = self.spool_file.tell() - self.read_offset
+
+        return metrics
+
+    def close(self):
+        """ Closes the spool file, pending readings are replayed on next start """
+        with self.lock:
+            self.spool_file.close()
+
+
+class SpoolDrainer(threading.Thread):
+    """ Background thread replaying spooled measurements into the database
+    """
+
+    def __init__(self, spool, configuration, batch_size=500, min_backoff=1.0,
+                 max_backoff=60.0):
+        """Initializes the drainer
+
+        Args:
+            spool: MeasurementSpool to drain
+            configuration: database configuration (the drainer has its own connection)
+            batch_size: readings written per transaction
+            min_backoff: first delay in seconds after a failed connect or write
+            max_backoff: longest delay between reconnect attempts
+        """
+        super().__init__(name="spool-drainer", daemon=True)
+
+        self.spool = spool
+        self.configuration = configuration
+        self.batch_size = batch_size
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+        self.metrics = {"batches": 0, "failures": 0, "connects": 0, "replay_rate": 0.0}
+
+    def run(self):
+        """ Replays spooled readings until stopped """
+        database = None
+        backoff = self.min_backoff
+
+        while not self.stop_event.is_set():
+            if not self.spool.pending_event.wait(1.0):
+                continue
+
+            try:
+                if database is None:
+                    database = TemperatureDatabase.from_configuration(self.configuration)
+                    with self.lock:
+                        self.metrics["connects"] += 1
+
+                batch = self.spool.read_batch(self.batch_size)
+                start_time = time.perf_counter()
+                database.insert_measurements(batch["measurements"])
+                self.spool.commit(batch)
+                elapsed = time.perf_counter() - start_time
+
+                with self.lock:
+                    self.metrics["batches"] += 1
+                    if elapsed > 0:
+                        self.metrics["replay_rate"] = len(batch["measurements"]) / elapsed
+
+                backoff = self.min_backoff
+            except Exception as error:
+                with self.lock:
+                    self.metrics["failures"] += 1
+                print("Spool replay failed, retrying in {:.0f}s: {}".format(backoff, error))
+
+                if database is not None:
+                    try:
+                        database.db_connection.close()
+                    except Exception:
+                        pass
+                    database = None
+
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+        if database is not None:
+            database.close_connection()
+
+    def stop(self, timeout=None):
+        """ Stops the drainer after the current batch and waits for the thread """
+        self.stop_event.set()
+
+        if self.is_alive():
+            self.join(timeout)
+
+    def get_metrics(self):
+        """ Gets the drainer and spool metrics
+
+        Returns:
+            dict: spool metrics (see MeasurementSpool.get_metrics), replayed
+            'batches', 'failures', database 'connects' and the 'replay_rate'
+            of the last batch in readings per second
+        """
+        with self.lock:
+            metrics = dict(self.metrics)
+
+        metrics.update(self.spool.get_metrics())
+
+        return metrics
@@ -0,0 +1,410 @@
+"""storage.py: This is the python module for the database storage backends
+
+This python module is used to select and open the database engine the sensor
+readings are stored in. Each backend opens connections with a pymysql style
+interface (%s placeholders, cursors usable as context managers, ping) and
+provides the few SQL fragments that differ between engines, so the
+TemperatureDatabase queries are written once. The backend is selected with the
+database configuration file.
+
+"""
+import json
+import os
+import sqlite3
+
+# Default location of the database configuration file
+DATABASE_CONFIGURATION_FILE = "src/database_configuration.json"
+
+# Configuration used when no configuration file exists (original MySQL setup)
+DEFAULT_DATABASE_CONFIGURATION = {
+    "Backend": "mysql",
+    "Database": "TEST_DATABASE",
+    "User": "TEMP_MONITOR",
+    "Password": "PASSWORD",
+    "Host": "localhost",
+    "Path": "tempomatic.db",
+    "HubId": "local",
+    "LocalInfile": False,
+    "RawRetentionDays": 30,
+    "RetentionIntervalSeconds": 3600,
+    "SpoolPath": "tempomatic_spool.ndjson",
+    "SpoolMaxBytes": 16 * 1024 * 1024,
+    "SpoolMaxAgeDays": 7,
+}
+
+# SQLite settings tuned for a Raspberry Pi: write-ahead log so readers never
+# block the writer, fsync only at checkpoints (a power cut can lose the last
+# transactions but never corrupts the database), small page cache
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", 5000),
+    ("cache_size", -2048),
+    ("temp_store", "MEMORY"),
+    ("mmap_size", 16 * 1024 * 1024),
+    ("wal_autocheckpoint", 1000),
+)
+
+
+def load_database_configuration(configuration_file=DATABASE_CONFIGURATION_FILE):
+    """ Loads the database configuration, missing settings use the defaults
+
+    Args:
+        configuration_file: path to a JSON file with any of the keys 'Backend'
+            ('mysql' or 'sqlite'), 'Database', 'User', 'Password', 'Host' (MySQL)
+            and 'Path' (SQLite database file), 'RawRetentionDays' and
+            'RetentionIntervalSeconds' (see retention.py), 'SpoolPath',
+            'SpoolMaxBytes' and 'SpoolMaxAgeDays' (see spool.py)
+
+    Returns:
+        dict: database configuration
+    """
+    configuration = dict(DEFAULT_DATABASE_CONFIGURATION)
+
+    if os.path.exists(configuration_file):
+        with open(configuration_file, "r") as json_config_file:
+            configuration.update(json.load(json_config_file))
+    else:
+        print("No database configuration at {}, using defaults".format(configuration_file))
+
+    return configuration
+
+
+def create_storage_backend(configuration):
+    """ Creates the storage backend selected by a database configuration
+
+    Args:
+        configuration: dict from load_database_configuration
+
+    Returns:
+        StorageBackend: backend that opens connections to the configured database
+    """
+    backend_name = configuration.get("Backend", "mysql").lower()
+
+    if backend_name == "mysql":
+        return MySQLBackend(
+            configuration["Database"], configuration["User"],
+            configuration["Password"], configuration.get("Host", "localhost"),
+            configuration.get("LocalInfile", False))
+    if backend_name == "sqlite":
+        return SQLiteBackend(configuration["Path"])
+
+    raise ValueError("Unknown database backend: {}".format(backend_name))
+
+
+class StorageBackend:
+    """ Interface of the database engines readings can be stored in
+    """
+
+    # Backend name used in configuration files
+    name = None
+
+    # Base exception class of the database driver
+    Error = Exception
+
+    # Statement prefix inserting a row only if its key does not exist yet
+    insert_ignore = "INSERT IGNORE"
+
+    # Column definition of an auto-incremented integer primary key
+    auto_id_sql = "INT NOT NULL AUTO_INCREMENT PRIMARY KEY"
+
+    # Bulk loads from client files are allowed (LOAD DATA LOCAL INFILE)
+    local_infile = False
+
+    def connect(self):
+        """ Opens a new connection
+
+        Returns:
+            connection with the pymysql interface (cursor(), commit(), rollback(),
+            ping(), close())
+        """
+        raise NotImplementedError
+
+    def table_exists(self, connection, table_name):
+        """ Checks if a table exists in the database """
+        raise NotImplementedError
+
+    def streaming_cursor(self, connection):
+        """ Opens a cursor that fetches result rows as they are read
+
+        The whole result set is never held in memory. The connection cannot
+        run other queries until every row was read or the cursor is closed.
+        """
+        raise NotImplementedError
+
+    def sensor_data_table_sql(self, table):
+        """ Gets the statements creating a typed sensor data table
+
+        Returns:
+            list: CREATE statements (tables and indexes)
+        """
+        raise NotImplementedError
+
+    def create_table_sql(self, table, definition, indexes=()):
+        """ Gets the statements creating a table and its secondary indexes
+
+        Args:
+            table: table name
+            definition: column and key definitions
+            indexes: (index name, indexed columns) pairs
+
+        Returns:
+            list: CREATE statements, no-ops if the table exists
+        """
+        raise NotImplementedError
+
+    def bucket_sql(self, column):
+        """ Gets an expression flooring a column to a bucket start
+
+        The expression takes the bucket width twice as parameters.
+        """
+        raise NotImplementedError
+
+    def upsert_sql(self, key_columns, updates):
+        """ Gets the clause merging an inserted row into an existing one
+
+        Args:
+            key_columns: unique key (comma separated columns) the insert can
+                conflict on
+            updates: (column, operation) pairs, operation is 'add', 'min', 'max'
+                or 'set' (replace with the inserted value)
+
+        Returns:
+            str: clause appended to an INSERT statement
+        """
+        raise NotImplementedError
+
+    def rename_tables_sql(self, renames):
+        """ Gets the statements renaming tables
+
+        Args:
+            renames: (old name, new name) pairs
+
+        Returns:
+            list: statements to run in order
+        """
+        raise NotImplementedError
+
+
+class MySQLBackend(StorageBackend):
+    """ MySQL/MariaDB server backend (pymysql)
+    """
+
+    name = "mysql"
+
+    def __init__(self, database_name, user, password, host="localhost", local_infile=False):
+        """Initializes the MySQL backend
+
+        Args:
+            database_name: database name on machine
+            user: user/login id to access database
+            password: password to identify user
+            host: where the database server is
+            local_infile: allow LOAD DATA LOCAL INFILE (the server must allow
+                it too, local_infile=ON)
+        """
+        import pymysql
+
+        self.pymysql = pymysql
+        self.Error = pymysql.Error
+        self.database_name = database_name
+        self.user = user
+        self.password = password
+        self.host = host
+        self.local_infile = local_infile
+
+    def connect(self):
+        return self.pymysql.connect(
+            host=self.host, user=self.user, password=self.password,
+            database=self.database_name, local_infile=self.local_infile
+        )
+
+    def table_exists(self, connection, table_name):
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+            result = cursor.fetchone()
+
+        return result is not None
+
+    def streaming_cursor(self, connection):
+        # Unbuffered cursor, rows stay on the server until fetched
+        return connection.cursor(self.pymysql.cursors.SSCursor)
+
+    def sensor_data_table_sql(self, table):
+        return [
+            "CREATE TABLE IF NOT EXISTS {table}("
+            "id INT NOT NULL AUTO_INCREMENT, temperature FLOAT NOT NULL, "
+            "humidity FLOAT NOT NULL, ts DOUBLE NOT NULL, sensor_id INT NOT NULL DEFAULT 1, "
+            "PRIMARY KEY (id), INDEX idx_{table}_ts (ts), "
+            "INDEX idx_{table}_sensor_ts (sensor_id, ts))".format(table=table)
+        ]
+
+    def create_table_sql(self, table, definition, indexes=()):
+        # Indexes are declared inline, MySQL has no CREATE INDEX IF NOT EXISTS
+        index_sql = "".join(
+            ", INDEX {} ({})".format(name, columns) for name, columns in indexes)
+        return ["CREATE TABLE IF NOT EXISTS {}({}{})".format(table, definition, index_sql)]
+
+    def bucket_sql(self, column):
+        return "FLOOR({} / %s) * %s".format(column)
+
+    def upsert_sql(self, key_columns, updates):
+        operations = {
+            "add": "{0} = {0} + VALUES({0})",
+            "min": "{0} = LEAST({0}, VALUES({0}))",
+            "max": "{0} = GREATEST({0}, VALUES({0}))",
+            "set": "{0} = VALUES({0})",
+        }
+        return "ON DUPLICATE KEY UPDATE " + ", ".join(
+            operations[operation].format(column) for column, operation in updates)
+
+    def rename_tables_sql(self, renames):
+        # Single atomic statement
+        return ["RENAME TABLE " + ", ".join(
+            "{} TO {}".format(old_name, new_name) for old_name, new_name in renames)]
+
+
+class SQLiteBackend(StorageBackend):
+    """ Embedded SQLite backend in WAL mode
+    """
+
+    name = "sqlite"
+    Error = sqlite3.Error
+    insert_ignore = "INSERT OR IGNORE"
+    auto_id_sql = "INTEGER PRIMARY KEY AUTOINCREMENT"
+
+    def __init__(self, path, pragmas=SQLITE_PRAGMAS):
+        """Initializes the SQLite backend
+
+        Args:
+            path: database file (created if missing)
+            pragmas: (name, value) PRAGMA settings applied to every connection
+        """
+        self.path = path
+        self.pragmas = pragmas
+
+    def connect(self):
+        # Connections are handed between threads by the pool, one at a time
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+
+        for pragma, value in self.pragmas:
+            connection.execute("PRAGMA {} = {}".format(pragma, value))
+
+        return SQLiteConnection(connection)
+
+    def table_exists(self, connection, table_name):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s",
+                (table_name,))
+            result = cursor.fetchone()
+
+        return result is not None
+
+    def streaming_cursor(self, connection):
+        # sqlite3 steps through the result set as rows are fetched
+        return connection.cursor()
+
+    def sensor_data_table_sql(self, table):
+        # AUTOINCREMENT so ids of deleted rows are never reused
+        return [
+            "CREATE TABLE IF NOT EXISTS {table}("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, temperature REAL NOT NULL, "
+            "humidity REAL NOT NULL, ts REAL NOT NULL, "
+            "sensor_id INTEGER NOT NULL DEFAULT 1)".format(table=table),
+            "CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table} (ts)".format(table=table),
+            "CREATE INDEX IF NOT EXISTS idx_{table}_sensor_ts ON {table} (sensor_id, ts)".format(
+                table=table),
+        ]
+
+    def create_table_sql(self, table, definition, indexes=()):
+        return ["CREATE TABLE IF NOT EXISTS {}({})".format(table, definition)] + [
+            "CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(name, table, columns)
+            for name, columns in indexes
+        ]
+
+    def bucket_sql(self, column):
+        # Timestamps are positive, so truncation is the floor
+        return "CAST({} / %s AS INTEGER) * %s".format(column)
+
+    def upsert_sql(self, key_columns, updates):
+        operations = {
+            "add": "{0} = {0} + excluded.{0}",
+            "min": "{0} = MIN({0}, excluded.{0})",
+            "max": "{0} = MAX({0}, excluded.{0})",
+            "set": "{0} = excluded.{0}",
+        }
+        return "ON CONFLICT({}) DO UPDATE SET ".format(key_columns) + ", ".join(
+            operations[operation].format(column) for column, operation in updates)
+
+    def rename_tables_sql(self, renames):
+        return [
+            "ALTER TABLE {} RENAME TO {}".format(old_name, new_name)
+            for old_name, new_name in renames
+        ]
+
+
+class SQLiteConnection:
+    """ sqlite3 connection with the pymysql interface used by TemperatureDatabase
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self):
+        return SQLiteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def ping(self, reconnect=False):
+        self.connection.execute("SELECT 1")
+
+    def close(self):
+        self.connection.close()
+
+
+class SQLiteCursor:
+    """ sqlite3 cursor accepting %s placeholders, usable as a context manager
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor.execute(sql.replace("%s", "?"), parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor.executemany(sql.replace("%s", "?"), parameters)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cursor.close()
@@ -9,9 +9,19 @@ application.
 import sys
 
 from PyQt5.QtWidgets import QMainWindow, QPushButton, QApplication
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
 
+from src.acquisition import AcquisitionWorker
+from src.adaptive_sampling import AdaptiveSampler
 from src.database import TemperatureDatabase
+from src.filters import SignalConditioner
+from src.reading import ReadingBatch
+from src.reading_cache import RecentReadingsCache
+from src.retention import RetentionJob
+from src.spool import MeasurementSpool, SpoolDrainer
+from src.sensor_drivers import load_sensor_configuration, sensor_name
+from src.storage import load_database_configuration
+from src.timestamps import format_timestamp
 from src.dht_22 import (
     DHT22_MAXIMUM_HUMIDITY,
     DHT22_MAXIMUM_TEMPERATURE,
@@ -25,14 +35,31 @@ from src.ui.tempomatic import Ui_MainWindow
 from src.aws import AWSHandler
 
 
+class SensorReadyNotifier(QObject):
+    '''SensorReadyNotifier: Qt adapter emitting a signal once a sensor has warmed up'''
+
+    # Emitted once, delivered in the thread of the connected receivers
+    ready = pyqtSignal()
+
+    def watch(self, sensor):
+        '''Emits ready when the sensor is ready (connect the signal before calling)
+
+        Args:
+            sensor: DHT22Sensor, AcquisitionWorker or ReadingRing to watch
+        '''
+        sensor.when_ready(self.ready.emit)
+
+
 class MainWindow(QMainWindow):
     '''MainWindow: a class that is the main object for main screen ui'''
 
-    def __init__(self, sensor_type='DHT_22'):
+    def __init__(self, sensor_type='DHT_22', reading_source=None):
         '''Returns a the main window of the temp-o-matic application.
 
         Args:
             sensor (str): Temperature/Humidity Sensor Type
+            reading_source (ReadingRing): readings of the acquisition process, None to
+                read the sensor in this process
         '''
         super(MainWindow, self).__init__()
 
@@ -60,16 +87,66 @@ class MainWindow(QMainWindow):
 
         # Logging Timer Parameters
         self.logging_timer = None  # logging timer object
-        self.logging_interval_ms = 15000  # 15 second logging intervals in ms
+        self.logging_interval_ms = 15000  # Logging interval in ms, set by the sampler
+        self.last_logged_ts = None  # Epoch time of the last logged reading
         self.logging_count = 0  # Current running tally of logged measurements
         self.max_logging_count = 30  # Max number of current logs before stopping
 
-        # System DHT22 Sensor
-        self.temperature_sensor = DHT22Sensor(4)
+        # AWS Parameters
+        self.aws_batch_size = 4  # Readings per AWS 'Readings' message
+
+        # Database Writer Parameters
+        self.db_batch_size = 4  # Logged measurements per database commit
+        self.db_batch_max_age_s = 60  # Longest time a measurement waits for its commit
+        self.db_flush_timer = None  # Timer flushing measurements by age
+        self.db_cache_size = 500  # Recent measurements kept in memory
+
+        # System DHT22 Sensor, read in the background by the acquisition worker unless
+        # another process owns it
+        sensor_configuration = load_sensor_configuration()
+        if reading_source is None:
+            self.temperature_sensor = DHT22Sensor.from_configuration(sensor_configuration)
+            self.acquisition_worker = AcquisitionWorker(
+                self.temperature_sensor,
+                conditioner=SignalConditioner.from_configuration(sensor_configuration))
+            self.acquisition_worker.start()
+            self.readings = self.acquisition_worker
+        else:
+            self.temperature_sensor = None
+            self.acquisition_worker = None
+            self.readings = reading_source
+
+        # Logging interval adapted to the readings (see adaptive_sampling.py)
+        self.sampler = AdaptiveSampler.from_configuration(sensor_configuration)
+        self.logging_interval_ms = int(self.sampler.interval * 1000)
 
         # System database
-        self.sys_db = TemperatureDatabase('TEST_DATABASE', 'TEMP_MONITOR', 'PASSWORD')
+        db_configuration = load_database_configuration()
+        self.sys_db = TemperatureDatabase.from_configuration(db_configuration)
         self.sys_db.create_table()
+        self.sensor_id = self.sys_db.register_sensor(
+            db_configuration["HubId"], sensor_name(sensor_configuration), sensor_configuration["Pin"])
+        self.sys_db.enable_batched_writes(self.db_batch_size, self.db_batch_max_age_s)
+        self.sys_db.maintain_rollups = True
+        self.sys_db.enable_cache(RecentReadingsCache(capacity=self.db_cache_size))
+
+        # Spool readings to disk while the database is unreachable
+        self.db_spool = MeasurementSpool(
+            db_configuration["SpoolPath"], db_configuration["SpoolMaxBytes"],
+            db_configuration["SpoolMaxAgeDays"] * 86400)
+        self.sys_db.enable_spool(self.db_spool)
+        self.spool_drainer = SpoolDrainer(self.db_spool, db_configuration)
+        self.spool_drainer.start()
+
+        # Flush buffered measurements (and readings waiting for AWS) that reach their maximum age
+        self.db_flush_timer = QTimer()
+        self.db_flush_timer.timeout.connect(self.flush_buffers)
+        self.db_flush_timer.start(self.db_batch_max_age_s * 1000)
+
+        # Prune raw measurements past their retention in the background
+        self.retention_job = RetentionJob.from_configuration(
+            db_configuration, cache=self.sys_db.cache)
+        self.retention_job.start()
 
         # System plot
         self.plot = self.screen_ui.plot
@@ -78,9 +155,21 @@ class MainWindow(QMainWindow):
         self.temperature_display = '-'
         self.humidity_display = '-'
         self.last_time_read = '-'
+        self.last_reading = None  # Displayed Reading (see reading.py)
+        self.last_reading_ts = None  # Epoch time of the displayed reading
+        self.last_reading_monotonic = None  # Monotonic time of the displayed reading
+
+        # Filtered reading (celsius) the alarms act on, so a single spike does not fire them
+        self.filtered_temperature = None
+        self.filtered_humidity = None
+
+        # Alarms already sent to AWS, a message is sent when an alarm starts
+        self.temperature_alarm_active = False
+        self.humidity_alarm_active = False
         
-        # System AWS Handler
+        # System AWS Handler, readings are sent in batches (see publish_readings)
         self.aws_handler = AWSHandler()
+        self.aws_batch = ReadingBatch(self.aws_batch_size)
 
         # Initialize AWS
         self.aws_handler.load_configuration('src/aws_configuration.json')
@@ -140,10 +229,14 @@ class MainWindow(QMainWindow):
         self.screen_ui.temp_plot_switch.setChecked(True)
         self.screen_ui.humid_plot_switch.setChecked(True)
 
-        # Wait for sensor to load
-        # TODO: Fix this so the GUI doesn't lock while waiting for sensor
-        while not self.temperature_sensor.sensor_initialized:
-            self.temperature_sensor.initialize_sensor()
+        # Show the sensor as ready once it has warmed up, the GUI keeps running meanwhile
+        self.sensor_ready_notifier = SensorReadyNotifier()
+        self.sensor_ready_notifier.ready.connect(self.show_sensor_ready)
+        self.sensor_ready_notifier.watch(self.readings)
+
+    def show_sensor_ready(self):
+        '''Updates the sensor status once the sensor has warmed up
+        '''
         self.screen_ui.sensor_status.setText('<font color="forestgreen">Ready</font>')
 
     def update_temperature_alarm(self):
@@ -270,42 +363,44 @@ class MainWindow(QMainWindow):
         # Reading Status
         reading_status = False
 
-        # Get reading
-        result = self.temperature_sensor.get_current_reading()
+        # Get latest reading of the acquisition worker (never waits on the sensor)
+        result = self.readings.get_latest()
 
-        # Only update values if sensor is not busy
-        if result['status'] == 'Busy':
-            self.screen_ui.sensor_status.setText('<font color="goldenrod">Busy</font>')
-        elif result['status'] == 'Unavailable':
+        # Only update values if the sensor has a current reading
+        if result.status == 'Warming Up':
+            self.screen_ui.sensor_status.setText('<font color="goldenrod">Loading</font>')
+        elif result.status == 'Unavailable':
             self.screen_ui.sensor_status.setText('<font color="red">Read Error</font>')
-        elif result['status'] == 'Offline':
+        elif result.status == 'Offline':
             self.screen_ui.sensor_status.setText('<font color="red">Offline</font>')
         else:
             self.screen_ui.sensor_status.setText('<font color="green">Ready</font>')
             if self.system_temp_setting == 'Celsius':
-                self.temperature_display = '{:.1f}'.format(result['temperature'])
+                self.temperature_display = '{:.1f}'.format(result.temperature)
             else:
                 # Convert reading to fahrenehit because celsius by default
                 self.temperature_display = '{:.1f}'.format(
-                    celsius_to_fahrenheit(result['temperature'])
+                    celsius_to_fahrenheit(result.temperature)
                 )
-            self.humidity_display = '{:.1f}'.format(result['humidity'])
-            self.last_time_read = '{}'.format(result['timestamp'])
+            self.humidity_display = '{:.1f}'.format(result.humidity)
+            self.last_time_read = format_timestamp(result.ts)
+            self.filtered_temperature = result.filtered_temperature
+            self.filtered_humidity = result.filtered_humidity
 
             # Check for alarm warnings
             self.check_alarms()
 
             self.set_temperature_display()
 
-            # Send to AWS SQS
-            msg_payload = {}
-            msg_payload['Command'] = 'Reading'
-            msg_payload['Temperature'] = '{:.1f}'.format(result['temperature'])
-            msg_payload['Units'] = 'Celsius'
-            msg_payload['Humidity'] = self.humidity_display
-            msg_payload['Timestamp'] = self.last_time_read
+            # Send to AWS SQS once per reading, a batch at a time
+            if self.last_reading is None or result.sequence != self.last_reading.sequence:
+                self.aws_batch.append(result._replace(sensor_id=self.sensor_id))
+                if len(self.aws_batch) >= self.aws_batch_size:
+                    self.publish_readings()
 
-            self.aws_handler.send_message('temperature', msg_payload)
+            self.last_reading = result
+            self.last_reading_ts = result.ts
+            self.last_reading_monotonic = result.monotonic
 
             # Successful read
             reading_status = True
@@ -315,58 +410,65 @@ class MainWindow(QMainWindow):
     def check_alarms(self):
         ''' Checks alarm statuses and updates system status
         '''
-        # Check for alarm warnings, ignore if no readings
-        if self.temperature_display == '-' or self.humidity_display == '-':
+        # Check for alarm warnings on the filtered reading, ignore if no readings
+        if self.filtered_temperature is None or self.filtered_humidity is None:
             pass
         else:
-            if float(self.temperature_display) > self.alarm_temperature_high:
+            if self.system_temp_setting == 'Celsius':
+                alarm_temperature = '{:.1f}'.format(self.filtered_temperature)
+            else:
+                alarm_temperature = '{:.1f}'.format(
+                    celsius_to_fahrenheit(self.filtered_temperature)
+                )
+            alarm_humidity = '{:.1f}'.format(self.filtered_humidity)
+
+            if float(alarm_temperature) > self.alarm_temperature_high:
                 # Over temperature warning
-                if float(self.humidity_display) > self.alarm_humidity_high:
+                if float(alarm_humidity) > self.alarm_humidity_high:
                     # Over humidity warning
                     self.screen_ui.system_status.setText(
                         '<font color="red">Temp and Humidity Err</font>'
                     )
 
-                    # Send AWS Humidity Warning
-                    msg_payload = {}
-                    msg_payload['Command'] = 'Humidity Alarm'
-                    msg_payload['Humidity'] = self.humidity_display
-                    msg_payload['Trigger'] = str(self.alarm_humidity_high)
-
-                    self.aws_handler.send_message('temperature', msg_payload)
-
                 else:
                     self.screen_ui.system_status.setText(
                         '<font color="red">Temp Err</font>'
                     )
-
-                # Send AWS Temperature Warning
-                msg_payload = {}
-                msg_payload['Command'] = 'Temperature Alarm'
-                msg_payload['Temperature'] = self.temperature_display
-                msg_payload['Units'] = self.system_temp_setting
-                msg_payload['Trigger'] = str(self.alarm_temperature_high)
-
-                self.aws_handler.send_message('temperature', msg_payload)
             else:
-                if float(self.humidity_display) > self.alarm_humidity_high:
+                if float(alarm_humidity) > self.alarm_humidity_high:
                     # Over humidity warning
                     self.screen_ui.system_status.setText(
                         '<font color="red">Humidity Err</font>'
                     )
-
-                    # Send AWS Humidity Warning
-                    msg_payload = {}
-                    msg_payload['Command'] = 'Humidity Alarm'
-                    msg_payload['Humidity'] = self.humidity_display
-                    msg_payload['Trigger'] = str(self.alarm_humidity_high)
-
-                    self.aws_handler.send_message('temperature', msg_payload)
                 else:
                     self.screen_ui.system_status.setText(
                         '<font color="forestgreen">Good</font>'
                     )
 
+            # Send AWS warnings when an alarm starts, not for every reading while it lasts
+            temperature_alarm = float(alarm_temperature) > self.alarm_temperature_high
+            humidity_alarm = float(alarm_humidity) > self.alarm_humidity_high
+
+            if humidity_alarm and not self.humidity_alarm_active:
+                msg_payload = {}
+                msg_payload['Command'] = 'Humidity Alarm'
+                msg_payload['Humidity'] = alarm_humidity
+                msg_payload['Trigger'] = str(self.alarm_humidity_high)
+
+                self.aws_handler.send_message('temperature', msg_payload)
+
+            if temperature_alarm and not self.temperature_alarm_active:
+                msg_payload = {}
+                msg_payload['Command'] = 'Temperature Alarm'
+                msg_payload['Temperature'] = alarm_temperature
+                msg_payload['Units'] = self.system_temp_setting
+                msg_payload['Trigger'] = str(self.alarm_temperature_high)
+
+                self.aws_handler.send_message('temperature', msg_payload)
+
+            self.temperature_alarm_active = temperature_alarm
+            self.humidity_alarm_active = humidity_alarm
+
     def set_temperature_display(self):
         '''Function to update the temperature monitor display
         '''
@@ -379,28 +481,14 @@ class MainWindow(QMainWindow):
     def update_plot(self):
         ''' Initiaze plotting function for the temperature and humidity
         '''
-        # Get last 10 measurements
-        values = self.sys_db.get_last_measurements(10)
-        
-        # Measurement groups
-        temperatures = []
-        humidities = []
-        timestamps = []
-
-        # Group measurement data to pass to plot
-        if values is not None:
-            for reading in values:
-                # Convert tuple reading to list
-                reading_list = list(reading)
-
-                # Add each item to corresponding group
-                # id - item 0, temp - item 1, humidity - item 2, time = item 3
-                temperatures.append(reading_list[1])
-                humidities.append(reading_list[2])
-                timestamps.append(reading_list[3])
-
-            # Send data to plot function
-            self.plot.update_values(temperatures, humidities, timestamps)
+        # Get last 10 measurements (oldest first)
+        values = self.sys_db.get_recent(
+            10, columns=('temperature', 'humidity', 'ts'), sensor_id=self.sensor_id)
+
+        # Group measurement data column by column to pass to plot
+        if values:
+            self.plot.update_batch(
+                ReadingBatch.from_columns(*zip(*values), sensor_id=self.sensor_id))
 
     def configure_logging(self):
         '''Toggles the logging functionality of the application
@@ -416,6 +504,7 @@ class MainWindow(QMainWindow):
 
             # Clear logging count to 0
             self.logging_count = 0
+            self.sampler.reset()
 
             # Set logging status to false
             self.logging_status = False
@@ -454,17 +543,20 @@ class MainWindow(QMainWindow):
 
         # Set sensor status to busy
         if self.get_reading():
-            # Store measurement always as celsius for consistency
-            if self.system_temp_setting == 'Celsius':
-                temp_reading = self.temperature_display
-            else:
-                temp_reading = '{:.1f}'.format(fahrenheit_to_celsius(float(self.temperature_display)))
-            self.sys_db.store_measurement(
-                temp_reading, self.humidity_display, self.last_time_read
-            )
+            # Only store a reading once when logging faster than the sensor is read
+            # (stored as celsius, the reading is never converted for display)
+            if self.last_reading_ts != self.last_logged_ts:
+                reading = self.last_reading
+                self.sys_db.store_measurement(
+                    reading.temperature, reading.humidity, reading.ts, self.sensor_id
+                )
+                self.last_logged_ts = self.last_reading_ts
+
+                # Increment logging count
+                self.logging_count += 1
 
-            # Increment logging count
-            self.logging_count += 1
+                # Pick the next interval from the filtered reading and the alarms
+                self.update_logging_interval()
 
         # Stop logging if count reaches max number of logs
         if self.logging_count >= self.max_logging_count:
@@ -477,6 +569,36 @@ class MainWindow(QMainWindow):
         # Enable now button
         self.screen_ui.current_reading_button.setEnabled(True)
 
+    def publish_readings(self):
+        ''' Sends the readings waiting for AWS as one message
+        '''
+        self.aws_handler.publish_readings('temperature', self.aws_batch)
+        self.aws_batch.clear()
+
+    def flush_buffers(self):
+        ''' Flushes the measurements and AWS readings that reached their maximum age
+        '''
+        self.sys_db.flush_if_due()
+        self.publish_readings()
+
+    def update_logging_interval(self):
+        ''' Sets the logging interval from the last filtered reading and the alarm thresholds
+        '''
+        if self.filtered_temperature is None or self.filtered_humidity is None:
+            return
+
+        # The sampler works in celsius like the filtered readings; only the high alarm
+        # follows the display units, the low alarm is always celsius
+        alarm_temperature_high = self.alarm_temperature_high
+        if self.system_temp_setting != 'Celsius':
+            alarm_temperature_high = fahrenheit_to_celsius(alarm_temperature_high)
+        temperature_limits = (self.alarm_temperature_low, alarm_temperature_high)
+
+        interval = self.sampler.update(
+            self.filtered_temperature, self.filtered_humidity, self.last_reading_monotonic,
+            temperature_limits, (self.alarm_humidity_low, self.alarm_humidity_high))
+        self.logging_interval_ms = int(interval * 1000)
+
     def update_temp_curve(self):
         # Hide plot if when false
         if self.screen_ui.temp_plot_switch.isChecked():
@@ -506,7 +628,23 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         ''' Adds additional close events to application
         '''
-        # Close database before closing application
+        # Stop reading the sensor
+        if self.acquisition_worker is not None:
+            self.acquisition_worker.stop()
+        print('Acquisition: {}'.format(self.readings.get_metrics()))
+        print('Sampling: {}'.format(self.sampler.get_metrics()))
+
+        # Write buffered measurements and close database before closing application
+        self.db_flush_timer.stop()
+        self.publish_readings()
+        self.retention_job.stop()
+        print('Retention: {}'.format(self.retention_job.get_metrics()))
+        self.sys_db.flush()
+        self.spool_drainer.stop()
+        print('Spool: {}'.format(self.spool_drainer.get_metrics()))
+        self.db_spool.close()
+        print('Database Writer: {}'.format(self.sys_db.get_writer_counters()))
+        print('Reading Cache: {}'.format(self.sys_db.get_cache_counters()))
         self.sys_db.close_connection()
 
         print('Closing Application')
@@ -0,0 +1,52 @@
+"""timestamps.py: This is the python module for the reading timestamps
+
+This python module is used to take and format the timestamps of the sensor
+readings. A reading carries two timestamps taken when it was acquired:
+
+ - ts: epoch seconds (float), used by storage, queries, websocket and AWS
+   payloads and plots
+ - monotonic: time.monotonic() seconds, used for ages and intervals, which
+   must not jump when the clock is set
+
+Readings are only turned into text for display, with format_timestamp. Its
+results are cached per second, so redrawing a screen or a table of recent
+readings does not call strftime again for each value.
+
+"""
+import datetime
+import functools
+import time
+
+# Display format of reading timestamps (e.g. 10/20/19 16:16:23)
+DISPLAY_TIMESTAMP_FORMAT = "%m/%d/%y %X"
+
+
+def acquisition_time():
+    """ Gets the timestamps of a reading taken now
+
+    Returns:
+        tuple: (epoch seconds, monotonic seconds)
+    """
+    return time.time(), time.monotonic()
+
+
+@functools.lru_cache(maxsize=1024)
+def format_seconds(seconds, timestamp_format):
+    """ Formats whole epoch seconds in local time (cached) """
+    return datetime.datetime.fromtimestamp(seconds).strftime(timestamp_format)
+
+
+def format_timestamp(ts, timestamp_format=DISPLAY_TIMESTAMP_FORMAT):
+    """ Formats an epoch timestamp for display
+
+    Args:
+        ts: epoch seconds, None if there is no reading
+        timestamp_format: strftime format (whole seconds only)
+
+    Returns:
+        str: formatted local time, '-' without a timestamp
+    """
+    if ts is None:
+        return "-"
+
+    return format_seconds(int(ts), timestamp_format)
@@ -0,0 +1,178 @@
+"""benchmark_database.py: Benchmarks the database read paths of the application
+
+Compares the legacy N+1 way of fetching the last measurements (one MAX(id)
+query followed by one query per id) with the single windowed query of
+TemperatureDatabase.get_recent. Round trips are counted by wrapping the
+database connection and latency is the best of several repeats.
+
+Run from the repository root against a scratch database (the sensor tables
+are recreated), either a SQLite file or the database of a configuration file:
+    python3 -m tools.benchmark_database [--sqlite benchmark.db]
+    python3 -m tools.benchmark_database --configuration benchmark_mysql.json
+
+The start-up time (connect and create tables) and the resident memory of the
+benchmark process are reported first to compare the backends.
+
+"""
+import argparse
+import time
+
+from src.database import TemperatureDatabase
+from src.storage import load_database_configuration
+
+# Window sizes to benchmark
+WINDOW_SIZES = (10, 1000, 100000)
+
+
+class CountingCursor:
+    """ Cursor proxy that counts the statements sent to the server """
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter["round_trips"] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counter["round_trips"] += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class CountingConnection:
+    """ Connection proxy that hands out counting cursors """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.counter = {"round_trips": 0}
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._connection.cursor(*args, **kwargs), self.counter)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def add_database_arguments(parser):
+    """ Adds the arguments selecting the scratch database of a benchmark """
+    parser.add_argument(
+        "--configuration",
+        help="database configuration file of a scratch database (its tables are reset)")
+    parser.add_argument(
+        "--sqlite", default="benchmark.db",
+        help="SQLite database file used when no configuration is given")
+
+
+def open_database(args):
+    """ Opens the scratch database selected by the benchmark arguments """
+    if args.configuration:
+        configuration = load_database_configuration(args.configuration)
+    else:
+        configuration = {"Backend": "sqlite", "Path": args.sqlite}
+
+    return TemperatureDatabase.from_configuration(configuration)
+
+
+def resident_memory_mb():
+    """ Gets the resident memory of this process in MB (Linux) """
+    with open("/proc/self/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+    return 0.0
+
+
+def legacy_get_last_measurements(database, num_of_measurements):
+    """ Original implementation: MAX(id) then one query per id """
+    last_measurement_id = database.get_last_measurement_id()
+    measurements = []
+
+    if last_measurement_id is not None:
+        first_id = max(last_measurement_id - num_of_measurements, 0)
+        for meas in range(last_measurement_id, first_id, -1):
+            measurements.append(database.get_measurement(meas))
+
+    return measurements
+
+
+def seed_measurements(database, num_of_rows, batch_size=5000):
+    """ Fills the SensorData table with synthetic measurements """
+    database.create_table()
+    database.delete_table()
+    database.create_table()
+
+    with database.db_connection.cursor() as cursor:
+        sql = "INSERT INTO SensorData (temperature, humidity, ts) VALUES (%s, %s, %s)"
+        for start in range(0, num_of_rows, batch_size):
+            rows = [
+                (20 + (idx % 50) / 10, 40 + (idx % 30) / 10, 1571600000 + idx * 15)
+                for idx in range(start, min(start + batch_size, num_of_rows))
+            ]
+            cursor.executemany(sql, rows)
+    database.db_connection.commit()
+
+
+def measure(connection, function, repeats):
+    """ Runs function repeats times and returns (round trips per call, best latency) """
+    best_latency = None
+
+    for _ in range(repeats):
+        connection.counter["round_trips"] = 0
+        start = time.perf_counter()
+        function()
+        latency = time.perf_counter() - start
+
+        if best_latency is None or latency < best_latency:
+            best_latency = latency
+
+    return connection.counter["round_trips"], best_latency
+
+
+def run_benchmark(database, repeats):
+    """ Benchmarks the legacy and windowed queries for each window size """
+    connection = CountingConnection(database.db_connection)
+    database.db_connection = connection
+
+    print("{:>8} {:>22} {:>22}".format("n", "legacy (trips / ms)", "get_recent (trips / ms)"))
+
+    for window in WINDOW_SIZES:
+        legacy_trips, legacy_latency = measure(
+            connection, lambda: legacy_get_last_measurements(database, window),
+            1 if window > 1000 else repeats)
+        recent_trips, recent_latency = measure(
+            connection, lambda: database.get_recent(window), repeats)
+
+        print("{:>8} {:>10} / {:>9.2f} {:>10} / {:>9.2f}".format(
+            window, legacy_trips, legacy_latency * 1000,
+            recent_trips, recent_latency * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark database read paths")
+    add_database_arguments(parser)
+    parser.add_argument("--rows", type=int, default=max(WINDOW_SIZES))
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    memory_before = resident_memory_mb()
+    startup_start = time.perf_counter()
+    benchmark_db = open_database(args)
+    benchmark_db.create_table()
+    print("Start-up: {:.1f} ms, resident memory +{:.1f} MB ({:.1f} MB total)".format(
+        (time.perf_counter() - startup_start) * 1000,
+        resident_memory_mb() - memory_before, resident_memory_mb()))
+
+    seed_measurements(benchmark_db, args.rows)
+    run_benchmark(benchmark_db, args.repeats)
+    benchmark_db.close_connection()
@@ -0,0 +1,95 @@
+"""benchmark_filters.py: Benchmarks the reading filters
+
+Measures the per-sample cost of each filter of filters.py and of the default
+chain (rate of change, median, EWMA), streaming with update() and in NumPy
+batch mode with apply(), on a synthetic DHT22 trace: a slow drift quantized
+to 0.1 degree with a spike every spike-interval samples. It then counts the
+samples over an alarm threshold in the raw and the filtered trace, which is
+how often check_alarms would fire.
+
+No sensor or database is needed. Run from the repository root:
+    python3 -m tools.benchmark_filters [--samples 100000] [--spike-interval 97]
+
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.filters import (
+    DEFAULT_FILTER_CONFIGURATION,
+    EWMAFilter,
+    MedianFilter,
+    RateOfChangeFilter,
+    SignalConditioner,
+)
+
+# Seconds between the synthetic readings (acquisition worker default)
+SAMPLE_INTERVAL = 2.5
+
+
+def synthetic_trace(num_of_samples, spike_interval, seed=0):
+    """ Creates a drifting, quantized temperature trace with spikes
+
+    Returns:
+        tuple: (temperatures, timestamps) arrays
+    """
+    generator = np.random.RandomState(seed)
+    temperatures = 24 + np.cumsum(generator.normal(0, 0.02, num_of_samples))
+    temperatures += generator.normal(0, 0.05, num_of_samples)
+    temperatures[::spike_interval] += 10
+    temperatures = np.round(temperatures, 1)
+
+    return temperatures, np.arange(num_of_samples) * SAMPLE_INTERVAL
+
+
+def create_filters():
+    """ Creates one of each filter and the default temperature chain by name """
+    settings = DEFAULT_FILTER_CONFIGURATION
+
+    return (
+        ("rate of change", RateOfChangeFilter(settings["MaxTemperatureRate"])),
+        ("median", MedianFilter(settings["MedianWindow"])),
+        ("EWMA", EWMAFilter(settings["EwmaAlpha"])),
+        ("chain", SignalConditioner.from_configuration().temperature_chain),
+    )
+
+
+def run_benchmark(num_of_samples, spike_interval, alarm_threshold):
+    """ Times the filters and counts the alarm samples """
+    temperatures, timestamps = synthetic_trace(num_of_samples, spike_interval)
+    samples = list(zip(temperatures.tolist(), timestamps.tolist()))
+
+    print("{:>16} {:>18} {:>18}".format("", "update (us/sample)", "apply (us/sample)"))
+
+    for name, stream_filter in create_filters():
+        start = time.perf_counter()
+        for value, timestamp in samples:
+            stream_filter.update(value, timestamp)
+        stream_seconds = time.perf_counter() - start
+
+        stream_filter.reset()
+        start = time.perf_counter()
+        stream_filter.apply(temperatures, timestamps)
+        batch_seconds = time.perf_counter() - start
+
+        print("{:>16} {:>18.3f} {:>18.3f}".format(
+            name, stream_seconds * 1e6 / num_of_samples, batch_seconds * 1e6 / num_of_samples))
+
+    filtered = SignalConditioner.from_configuration().temperature_chain.apply(temperatures, timestamps)
+
+    print("Samples over {} C: raw {}, filtered {} ({} spikes, {} rejected)".format(
+        alarm_threshold, int(np.sum(temperatures > alarm_threshold)),
+        int(np.sum(filtered > alarm_threshold)), len(temperatures[::spike_interval]),
+        int(np.sum(np.isnan(filtered)))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the reading filters")
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--spike-interval", type=int, default=97,
+                        help="samples between spikes of +10 C")
+    parser.add_argument("--alarm", type=float, default=28.0, help="alarm threshold (C)")
+    args = parser.parse_args()
+
+    run_benchmark(args.samples, args.spike_interval, args.alarm)
@@ -0,0 +1,120 @@
+"""benchmark_readings.py: Benchmarks the memory of buffered sensor readings
+
+Measures with tracemalloc the memory held by a buffer of readings, kept as:
+
+ - a list of dicts, one per reading (how get_current_reading used to return them)
+ - a list of Reading named tuples
+ - a ReadingBatch (one NumPy structured array record per reading)
+
+and the time to turn each buffer into the database rows of store_readings.
+The memory is reported per 1M readings. No sensor or database is needed. Run
+from the repository root:
+    python3 -m tools.benchmark_readings [--readings 1000000]
+
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from src.reading import DEFAULT_SENSOR_ID, Reading, ReadingBatch
+
+# Seconds between the buffered readings
+READING_INTERVAL = 2.0
+
+
+def create_dicts(num_of_readings, generator, start_time):
+    """ Creates the readings as dicts """
+    return [
+        {
+            "status": "New",
+            "ts": start_time + READING_INTERVAL * index,
+            "monotonic": READING_INTERVAL * index,
+            "temperature": round(generator.gauss(24, 0.5), 1),
+            "humidity": round(generator.gauss(40, 2), 1),
+            "sensor_id": DEFAULT_SENSOR_ID,
+            "sequence": index + 1,
+        }
+        for index in range(num_of_readings)
+    ]
+
+
+def create_readings(num_of_readings, generator, start_time):
+    """ Creates the readings as Reading named tuples """
+    return [
+        Reading("New", start_time + READING_INTERVAL * index, READING_INTERVAL * index,
+                round(generator.gauss(24, 0.5), 1), round(generator.gauss(40, 2), 1),
+                DEFAULT_SENSOR_ID, index + 1)
+        for index in range(num_of_readings)
+    ]
+
+
+def create_batch(num_of_readings, generator, start_time):
+    """ Creates the readings in a ReadingBatch """
+    batch = ReadingBatch(num_of_readings)
+    for index in range(num_of_readings):
+        batch.append(Reading(
+            "New", start_time + READING_INTERVAL * index, READING_INTERVAL * index,
+            round(generator.gauss(24, 0.5), 1), round(generator.gauss(40, 2), 1),
+            DEFAULT_SENSOR_ID, index + 1))
+
+    return batch
+
+
+def dict_rows(readings):
+    return [(reading["temperature"], reading["humidity"], reading["ts"], reading["sensor_id"])
+            for reading in readings]
+
+
+def reading_rows(readings):
+    return [reading.measurement() for reading in readings]
+
+
+def batch_rows(batch):
+    return batch.measurements()
+
+
+def measure_memory(create, num_of_readings):
+    """ Creates a buffer and returns it with the bytes it holds """
+    generator = random.Random(0)
+    start_time = time.time()
+
+    tracemalloc.start()
+    buffer = create(num_of_readings, generator, start_time)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return buffer, allocated
+
+
+def run_benchmark(num_of_readings):
+    """ Measures each buffer and prints the memory per 1M readings """
+    print("{:>20} {:>16} {:>14} {:>16}".format(
+        "", "MB per 1M", "bytes each", "rows (us each)"))
+
+    baseline = None
+    for name, create, rows in (
+            ("list of dicts", create_dicts, dict_rows),
+            ("list of Readings", create_readings, reading_rows),
+            ("ReadingBatch", create_batch, batch_rows)):
+        buffer, allocated = measure_memory(create, num_of_readings)
+
+        start = time.perf_counter()
+        rows(buffer)
+        row_seconds = time.perf_counter() - start
+
+        per_reading = allocated / num_of_readings
+        baseline = baseline or per_reading
+        print("{:>20} {:>16.1f} {:>14.1f} {:>16.3f}   ({:.0%} of dicts)".format(
+            name, per_reading * 1e6 / 2 ** 20, per_reading,
+            row_seconds * 1e6 / num_of_readings, per_reading / baseline))
+
+        del buffer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the memory of buffered readings")
+    parser.add_argument("--readings", type=int, default=1000000, help="readings buffered")
+    args = parser.parse_args()
+
+    run_benchmark(args.readings)
@@ -0,0 +1,87 @@
+"""benchmark_rollups.py: Benchmarks rollup queries against raw aggregation
+
+Seeds a scratch database with synthetic 15 second readings (10M rows by
+default, almost five years), builds the minute/hour/day rollups and compares
+the latency of aggregating the raw rows with get_aggregates against reading
+the same buckets from the rollup chosen by the get_history query router.
+
+Run from the repository root against a scratch database (the sensor tables
+are recreated, seeding 10M rows takes a while):
+    python3 -m tools.benchmark_rollups [--configuration benchmark_mysql.json]
+
+"""
+import argparse
+import time
+
+from tools.benchmark_database import add_database_arguments, open_database, seed_measurements
+
+# Seconds between seeded readings (see seed_measurements)
+SEED_INTERVAL = 15
+SEED_START = 1571600000
+
+# History ranges to query
+QUERY_RANGES = (
+    ("day", 86400),
+    ("week", 7 * 86400),
+    ("month", 30 * 86400),
+    ("year", 365 * 86400),
+)
+
+
+def best_latency(function, repeats):
+    """ Runs function repeats times and returns (result, best latency) """
+    best = None
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        latency = time.perf_counter() - start
+
+        if best is None or latency < best:
+            best = latency
+
+    return result, best
+
+
+def run_benchmark(database, num_of_rows, max_points, repeats):
+    """ Compares raw aggregation with rollup reads for each query range """
+    end = SEED_START + num_of_rows * SEED_INTERVAL
+
+    start_time = time.perf_counter()
+    database.rebuild_rollups()
+    print("Rollups built from {} rows in {:.1f}s".format(
+        num_of_rows, time.perf_counter() - start_time))
+
+    print("{:>6} {:>10} {:>8} {:>12} {:>12}".format(
+        "range", "resolution", "points", "raw (ms)", "rollup (ms)"))
+
+    for name, span in QUERY_RANGES:
+        start = end - span
+        (resolution, rows), rollup_latency = best_latency(
+            lambda: database.get_history(start, end, max_points), repeats)
+
+        if resolution == 0:
+            raw_latency = rollup_latency
+        else:
+            _, raw_latency = best_latency(
+                lambda: database.get_aggregates(start, end, resolution), repeats)
+
+        print("{:>6} {:>10} {:>8} {:>12.1f} {:>12.1f}".format(
+            name, resolution or "raw", len(rows), raw_latency * 1000, rollup_latency * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark rollup against raw queries")
+    add_database_arguments(parser)
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--max-points", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--skip-seed", action="store_true",
+                        help="reuse the rows seeded by an earlier run")
+    args = parser.parse_args()
+
+    benchmark_db = open_database(args)
+    if not args.skip_seed:
+        seed_measurements(benchmark_db, args.rows, batch_size=10000)
+    run_benchmark(benchmark_db, args.rows, args.max_points, args.repeats)
+    benchmark_db.close_connection()
@@ -0,0 +1,86 @@
+"""benchmark_sensor_ready.py: Benchmarks waiting for the DHT22 warm up
+
+Compares the original busy-wait warm up loop (calling initialize_sensor until
+sensor_initialized is set) with the readiness event of DHT22Sensor:
+
+ - start-up: wall and CPU time spent until a new sensor can be read
+ - per connection: latency added to each new websocket connection, which used
+   to create and warm up its own sensor and now awaits the shared sensor with
+   wait_ready_async
+
+The sensor is never read and uses the simulated driver (with the 2 second
+DHT22 warm up), so neither a DHT22 nor Adafruit_DHT is needed. Run from the
+repository root:
+    python3 -m tools.benchmark_sensor_ready [--connections 3]
+
+"""
+import argparse
+import asyncio
+import datetime
+import time
+
+from src.dht_22 import DHT22Sensor
+from src.sensor_drivers import SimulatedDriver
+
+
+def create_sensor():
+    """ Creates a sensor that warms up like a DHT22 without the hardware """
+    return DHT22Sensor(4, SimulatedDriver())
+
+
+def legacy_warm_up(sensor):
+    """ Original warm up: polls the time since the sensor was created """
+    while (datetime.datetime.now() - sensor.last_reading_time).total_seconds() <= 2:
+        pass
+
+
+def event_warm_up(sensor):
+    """ Blocks on the readiness event """
+    sensor.wait_ready()
+
+
+def measure(function):
+    """ Runs function and returns (wall seconds, CPU seconds) """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    function()
+
+    return time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+
+def run_benchmark(num_of_connections):
+    """ Times the start-up and per-connection waits of both approaches """
+    print("{:>30} {:>12} {:>12}".format("", "wall (ms)", "CPU (ms)"))
+
+    for name, warm_up in (("start-up, busy-wait", legacy_warm_up),
+                          ("start-up, readiness event", event_warm_up)):
+        wall, cpu = measure(lambda: warm_up(create_sensor()))
+        print("{:>30} {:>12.1f} {:>12.1f}".format(name, wall * 1000, cpu * 1000))
+
+    # Each legacy connection created its own sensor and waited for its warm up
+    wall, cpu = measure(lambda: [legacy_warm_up(create_sensor()) for _ in range(num_of_connections)])
+    print("{:>30} {:>12.1f} {:>12.1f}".format(
+        "connection, own sensor", wall * 1000 / num_of_connections,
+        cpu * 1000 / num_of_connections))
+
+    # Connections now share one sensor that is already warm
+    shared_sensor = create_sensor()
+    shared_sensor.wait_ready()
+
+    async def connect_all():
+        for _ in range(num_of_connections):
+            await shared_sensor.wait_ready_async()
+
+    wall, cpu = measure(lambda: asyncio.run(connect_all()))
+    print("{:>30} {:>12.3f} {:>12.3f}".format(
+        "connection, shared sensor", wall * 1000 / num_of_connections,
+        cpu * 1000 / num_of_connections))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DHT22 warm up waits")
+    parser.add_argument("--connections", type=int, default=3,
+                        help="websocket connections simulated (the busy-wait takes 2s each)")
+    args = parser.parse_args()
+
+    run_benchmark(args.connections)
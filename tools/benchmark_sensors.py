@@ -0,0 +1,126 @@
+"""benchmark_sensors.py: Benchmarks the per-sensor queries of a multi-sensor hub
+
+Seeds a scratch database with synthetic readings of many sensors (100 sensors
+sampled every 15 minutes for one year by default, 3.5M rows written in time
+order so the sensors are interleaved like on a real hub), builds the rollups
+and times the queries the GUI and web server run per sensor: the last
+readings, a one day range, a one year history and a one day aggregate of all
+sensors.
+
+With --without-index the composite (sensor_id, ts) index is dropped before
+the queries are timed, to compare against filtering on the ts index alone.
+
+Run from the repository root against a scratch database (the sensor tables
+are recreated, seeding takes a while):
+    python3 -m tools.benchmark_sensors [--sensors 100] [--days 365] [--interval 900]
+    python3 -m tools.benchmark_sensors --configuration benchmark_mysql.json
+
+"""
+import argparse
+import time
+
+from tools.benchmark_database import add_database_arguments, open_database
+from tools.benchmark_rollups import SEED_START, best_latency
+
+
+def seed_sensors(database, num_of_sensors, num_of_steps, interval, batch_size=10000):
+    """ Registers the sensors and fills SensorData with their readings
+
+    Returns:
+        list: sensor ids of the seeded sensors
+    """
+    database.create_table()
+    database.delete_table()
+    database.create_table()
+
+    sensor_ids = [
+        database.register_sensor("benchmark", "sensor-{:03d}".format(sensor), sensor)
+        for sensor in range(num_of_sensors)
+    ]
+
+    batch = []
+    for step in range(num_of_steps):
+        ts = SEED_START + step * interval
+        for index, sensor_id in enumerate(sensor_ids):
+            batch.append((20 + ((step + index) % 50) / 10, 40 + ((step + index) % 30) / 10,
+                          ts, sensor_id))
+
+        if len(batch) >= batch_size:
+            database.insert_measurements(batch)
+            batch = []
+
+    if batch:
+        database.insert_measurements(batch)
+
+    return sensor_ids
+
+
+def drop_sensor_index(database):
+    """ Drops the composite (sensor_id, ts) index of SensorData """
+    sql = "DROP INDEX idx_SensorData_sensor_ts"
+    if database.backend.name == "mysql":
+        sql += " ON SensorData"
+
+    with database.db_connection.cursor() as cursor:
+        cursor.execute(sql)
+    database.db_connection.commit()
+
+
+def run_benchmark(database, sensor_ids, end, max_points, repeats):
+    """ Times the per-sensor and all-sensor queries """
+    sensor_id = sensor_ids[len(sensor_ids) // 2]
+    year_start = end - 365 * 86400
+    day_start = end - 86400
+
+    queries = (
+        ("last 10, every sensor",
+         lambda: [database.get_last_measurements(10, sensor) for sensor in sensor_ids]),
+        ("last 10, one sensor", lambda: database.get_last_measurements(10, sensor_id)),
+        ("day range, one sensor",
+         lambda: database.get_range(day_start, end, sensor_id=sensor_id)),
+        ("year history, one sensor",
+         lambda: database.get_history(year_start, end, max_points, sensor_id)[1]),
+        ("year history, all sensors",
+         lambda: database.get_history(year_start, end, max_points)[1]),
+        ("day aggregates, all sensors", lambda: database.get_aggregates(day_start, end, 900)),
+    )
+
+    print("{:>28} {:>8} {:>12}".format("query", "rows", "best (ms)"))
+
+    for name, query in queries:
+        rows, latency = best_latency(query, repeats)
+        print("{:>28} {:>8} {:>12.2f}".format(name, len(rows), latency * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark multi-sensor queries")
+    add_database_arguments(parser)
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--days", type=float, default=365)
+    parser.add_argument("--interval", type=float, default=900,
+                        help="seconds between the readings of a sensor")
+    parser.add_argument("--max-points", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--without-index", action="store_true",
+                        help="drop the composite (sensor_id, ts) index before querying")
+    args = parser.parse_args()
+
+    steps = int(args.days * 86400 / args.interval)
+
+    benchmark_db = open_database(args)
+
+    start_time = time.perf_counter()
+    benchmark_sensor_ids = seed_sensors(benchmark_db, args.sensors, steps, args.interval)
+    print("Seeded {} rows of {} sensors in {:.1f}s".format(
+        steps * args.sensors, args.sensors, time.perf_counter() - start_time))
+
+    start_time = time.perf_counter()
+    benchmark_db.rebuild_rollups()
+    print("Rollups built in {:.1f}s".format(time.perf_counter() - start_time))
+
+    if args.without_index:
+        drop_sensor_index(benchmark_db)
+
+    run_benchmark(benchmark_db, benchmark_sensor_ids, SEED_START + steps * args.interval,
+                  args.max_points, args.repeats)
+    benchmark_db.close_connection()
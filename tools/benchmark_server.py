@@ -0,0 +1,116 @@
+"""benchmark_server.py: Load test for the websocket server database requests
+
+Starts the Tornado web server in-process, connects several websocket clients
+that keep requesting plot data ("PD") and records the latency of every
+request in three phases:
+    baseline  - clients only
+    async     - one deliberately slow query (SELECT SLEEP) runs through the
+                async database layer at the same time
+    blocking  - the same slow query runs directly on the IOLoop, the way every
+                query ran before the async layer
+
+Run from the repository root:
+    python3 -m tools.benchmark_server --clients 20 --slow-query 2
+
+"""
+import argparse
+import asyncio
+import time
+
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect
+
+from src.server import TempomaticWebServer
+
+
+def slow_query(database, seconds):
+    """ Query that keeps a connection busy for a while
+
+    SQLite has no server side sleep, the connection is held for the same time.
+    """
+    if database.backend.name == "mysql":
+        with database.db_connection.cursor() as cursor:
+            cursor.execute("SELECT SLEEP(%s)", (seconds,))
+            cursor.fetchall()
+    else:
+        time.sleep(seconds)
+
+
+def percentile(values, fraction):
+    """ Gets a percentile from a list of values """
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def client_loop(url, duration, latencies):
+    """ Requests plot data back to back for duration seconds """
+    connection = await websocket_connect(url)
+    end_time = time.monotonic() + duration
+
+    while time.monotonic() < end_time:
+        start = time.perf_counter()
+        await connection.write_message("PD")
+        await connection.read_message()
+        latencies.append(time.perf_counter() - start)
+
+    connection.close()
+
+
+async def run_phase(server, url, clients, duration, slow_query_seconds=None, blocking=False):
+    """ Runs all clients for one phase and returns their latencies """
+    latencies = []
+    loops = [
+        asyncio.ensure_future(client_loop(url, duration, latencies)) for _ in range(clients)
+    ]
+
+    if slow_query_seconds is not None:
+        # Let the clients get going before the slow query starts
+        await asyncio.sleep(duration / 4)
+
+        if blocking:
+            with server.db_pool.connection() as database:
+                slow_query(database, slow_query_seconds)
+        else:
+            await server.async_db.run(slow_query, slow_query_seconds)
+
+    await asyncio.gather(*loops)
+
+    return latencies
+
+
+async def run_benchmark(server, port, clients, duration, slow_query_seconds):
+    """ Runs the three load test phases and prints the latency percentiles """
+    url = "ws://localhost:{}/ws".format(port)
+    phases = (
+        ("baseline", None, False),
+        ("async", slow_query_seconds, False),
+        ("blocking", slow_query_seconds, True),
+    )
+
+    print("{:>10} {:>9} {:>10} {:>10} {:>10}".format(
+        "phase", "requests", "p50 (ms)", "p99 (ms)", "max (ms)"))
+
+    for name, slow_seconds, blocking in phases:
+        latencies = await run_phase(server, url, clients, duration, slow_seconds, blocking)
+        print("{:>10} {:>9} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            name, len(latencies), percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000, max(latencies) * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Websocket server load test")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=8.0)
+    parser.add_argument("--slow-query", type=float, default=2.0)
+    args = parser.parse_args()
+
+    web_server = TempomaticWebServer()
+    web_server.http_server.listen(args.port)
+
+    IOLoop.current().run_sync(lambda: run_benchmark(
+        web_server, args.port, args.clients, args.duration, args.slow_query))
+
+    web_server.async_db.close()
+    web_server.db_pool.close_all()
@@ -0,0 +1,84 @@
+"""benchmark_timestamps.py: Benchmarks string against epoch reading timestamps
+
+Compares, per point of a history of readings taken every 15 seconds:
+
+ - plot: parsing '%m/%d/%y %X' strings back with strptime (how the plot and the
+   websocket plot data used to get their x values) against subtracting epoch
+   timestamps with NumPy
+ - display: calling strftime for every value shown against the cached
+   format_timestamp of timestamps.py, redrawing the last 500 readings (a
+   table or plot labels of recent readings) 100 times
+
+No sensor or database is needed. Run from the repository root:
+    python3 -m tools.benchmark_timestamps [--points 100000]
+
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+
+from src.timestamps import DISPLAY_TIMESTAMP_FORMAT, format_timestamp
+
+# Seconds between the readings of the history
+READING_INTERVAL = 15
+
+# Readings shown and times they are redrawn in the display benchmark
+DISPLAY_POINTS = 500
+REDRAWS = 100
+
+
+def measure(function):
+    """ Runs function and returns the seconds it took """
+    start = time.perf_counter()
+    function()
+
+    return time.perf_counter() - start
+
+
+def run_benchmark(num_of_points):
+    """ Times the string and epoch paths and prints the cost per point """
+    timestamps = time.time() - READING_INTERVAL * np.arange(num_of_points)[::-1]
+    timestamp_list = timestamps.tolist()
+    strings = [
+        datetime.datetime.fromtimestamp(ts).strftime(DISPLAY_TIMESTAMP_FORMAT) for ts in timestamp_list
+    ]
+
+    def parse_strings():
+        start_time = datetime.datetime.strptime(strings[0], DISPLAY_TIMESTAMP_FORMAT).timestamp()
+        return [
+            datetime.datetime.strptime(string, DISPLAY_TIMESTAMP_FORMAT).timestamp() - start_time
+            for string in strings
+        ]
+
+    def subtract_epochs():
+        return np.asarray(timestamp_list, dtype=float) - timestamp_list[0]
+
+    displayed = timestamp_list[-DISPLAY_POINTS:]
+
+    def format_each_time():
+        for _ in range(REDRAWS):
+            for ts in displayed:
+                datetime.datetime.fromtimestamp(ts).strftime(DISPLAY_TIMESTAMP_FORMAT)
+
+    def format_cached():
+        for _ in range(REDRAWS):
+            for ts in displayed:
+                format_timestamp(ts)
+
+    print("{:>28} {:>14}".format("", "us per point"))
+    for name, function, count in (
+            ("plot, strptime strings", parse_strings, num_of_points),
+            ("plot, epoch floats", subtract_epochs, num_of_points),
+            ("display, strftime", format_each_time, len(displayed) * REDRAWS),
+            ("display, cached format", format_cached, len(displayed) * REDRAWS)):
+        print("{:>28} {:>14.3f}".format(name, measure(function) * 1e6 / count))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark reading timestamp handling")
+    parser.add_argument("--points", type=int, default=100000, help="readings in the history")
+    args = parser.parse_args()
+
+    run_benchmark(args.points)
@@ -0,0 +1,125 @@
+"""load_test.py: Load tests the acquisition and database write path without hardware
+
+Reads simulated sensors (see sensor_drivers.py) through DHT22Sensor, the same
+way the acquisition worker does but without the 2 second minimum interval, and
+stores every reading with the batched database writer. Reports the readings
+per second read and written, the failed reads and the read telemetry of the
+sensors (failed reads are retried without backoff unless --retry-delay is set).
+
+The simulated sensors are seeded, so two runs with the same arguments read
+the same values. A recording can be replayed as fast as possible instead.
+
+Run from the repository root against a scratch database:
+    python3 -m tools.load_test [--sensors 4] [--readings 5000] [--dropout-rate 0.05]
+    python3 -m tools.load_test --replay readings.csv.gz
+    python3 -m tools.load_test --configuration benchmark_mysql.json
+
+The AWS IoT publishing of the GUI needs credentials and is not exercised.
+
+"""
+import argparse
+import time
+
+from src.dht_22 import DHT22Sensor
+from src.sensor_drivers import ReplayDriver, SimulatedDriver
+from src.sensor_retry import RetryPolicy
+from tools.benchmark_database import add_database_arguments, open_database
+
+
+def create_sensors(args):
+    """ Creates the sensors to read, all without a minimum interval """
+    if args.replay:
+        drivers = [ReplayDriver.from_file(args.replay, speed=None, loop=True)]
+    else:
+        drivers = [
+            SimulatedDriver(seed=seed, temperature=20.0 + seed, noise=args.noise,
+                            drift=args.drift, dropout_rate=args.dropout_rate,
+                            latency=args.latency, minimum_interval=0.0)
+            for seed in range(args.sensors)
+        ]
+
+    sensors = []
+    for pin, driver in enumerate(drivers):
+        sensor = DHT22Sensor(pin, driver, RetryPolicy(base_delay=args.retry_delay, seed=pin))
+        sensor.wait_ready()
+        sensors.append(sensor)
+
+    return sensors
+
+
+def run_load_test(database, sensors, num_of_readings, batch_size):
+    """ Reads each sensor num_of_readings times and stores the readings
+
+    Returns:
+        dict: 'reads', 'failures', 'backed_off' reads skipped during a retry
+        backoff, 'stored' rows, 'seconds' and 'readings_per_second'
+    """
+    database.create_table()
+    database.delete_table()
+    database.create_table()
+    database.enable_batched_writes(batch_size=batch_size)
+
+    sensor_ids = [
+        database.register_sensor("load-test", "simulated-{}".format(pin), pin)
+        for pin in range(len(sensors))
+    ]
+
+    results = {"reads": 0, "failures": 0, "backed_off": 0}
+    start_time = time.perf_counter()
+
+    for _ in range(num_of_readings):
+        for sensor, sensor_id in zip(sensors, sensor_ids):
+            reading = sensor.get_current_reading()
+            results["reads"] += 1
+
+            if reading.status == "New":
+                database.store_measurement(
+                    reading.temperature, reading.humidity, reading.ts, sensor_id)
+            elif reading.status == "Busy":
+                results["backed_off"] += 1
+            else:
+                results["failures"] += 1
+
+    database.flush()
+
+    results["seconds"] = time.perf_counter() - start_time
+    results["stored"] = database.get_writer_counters()["flushed"]
+    results["readings_per_second"] = results["stored"] / max(results["seconds"], 1e-9)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the sensor to database path")
+    add_database_arguments(parser)
+    parser.add_argument("--sensors", type=int, default=4, help="simulated sensors read")
+    parser.add_argument("--readings", type=int, default=5000, help="reads of each sensor")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="rows per database commit")
+    parser.add_argument("--noise", type=float, default=0.2, help="reading noise (celsius)")
+    parser.add_argument("--drift", type=float, default=0.0, help="celsius drift per read")
+    parser.add_argument("--dropout-rate", type=float, default=0.0,
+                        help="fraction of failed reads")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per read")
+    parser.add_argument("--retry-delay", type=float, default=0.0,
+                        help="base retry backoff after a failed read (seconds)")
+    parser.add_argument("--replay", help="CSV or NDJSON recording to replay instead")
+    args = parser.parse_args()
+
+    load_test_db = open_database(args)
+    load_test_sensors = create_sensors(args)
+    load_test_results = run_load_test(
+        load_test_db, load_test_sensors, args.readings, args.batch_size)
+    load_test_db.close_connection()
+
+    print("{} sensor(s): {} reads, {} failed, {} backed off, {} rows stored in {:.2f}s "
+          "({:.0f} readings/s)".format(
+              len(load_test_sensors), load_test_results["reads"], load_test_results["failures"],
+              load_test_results["backed_off"], load_test_results["stored"],
+              load_test_results["seconds"], load_test_results["readings_per_second"]))
+
+    for load_test_sensor in load_test_sensors:
+        read_metrics = load_test_sensor.get_read_metrics()
+        print("Sensor {}: success rate {:.3f}, {:.2f} attempts per reading, failures {}".format(
+            load_test_sensor.pin_number, read_metrics["success_rate"],
+            read_metrics["attempts_per_reading"], read_metrics["failure_reasons"]))
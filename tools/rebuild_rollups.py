@@ -0,0 +1,38 @@
+"""rebuild_rollups.py: Rebuilds or catches up the minute/hour/day rollup tables
+
+Backfills the rollup tables from the raw SensorData measurements. By default
+the rollups are cleared and rebuilt; with --catch-up only the measurements
+past the stored high-water mark are folded in.
+
+Run from the repository root:
+    python3 -m tools.rebuild_rollups [--catch-up] [--configuration FILE]
+
+"""
+import argparse
+import time
+
+from src.database import TemperatureDatabase
+from src.storage import DATABASE_CONFIGURATION_FILE, load_database_configuration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the SensorData rollup tables")
+    parser.add_argument("--configuration", default=DATABASE_CONFIGURATION_FILE)
+    parser.add_argument("--catch-up", action="store_true",
+                        help="only fold in measurements past the high-water mark")
+    args = parser.parse_args()
+
+    sys_db = TemperatureDatabase.from_configuration(
+        load_database_configuration(args.configuration))
+    sys_db.create_table()
+
+    start_time = time.perf_counter()
+    if args.catch_up:
+        last_id = sys_db.update_rollups()
+    else:
+        last_id = sys_db.rebuild_rollups()
+
+    print("Rollups up to measurement {} in {:.1f}s".format(
+        last_id, time.perf_counter() - start_time))
+
+    sys_db.close_connection()
@@ -0,0 +1,113 @@
+"""simulate_sampling.py: Compares the fixed and adaptive logging intervals
+
+Runs the GUI logging loop against a synthetic trace: a stable room (0.1
+degree quantization and noise) with a heat excursion ramping over the alarm
+threshold and back. The acquisition worker reads it every 2.5 seconds through
+the default filters, and the log either runs every 15 seconds or at the
+interval of the adaptive sampler. For each it reports the readings logged
+(the database writes and AWS publishes), how long after the filtered reading
+crossed the threshold the first logged one was over it, and the peak logged.
+
+No sensor or database is needed. Run from the repository root:
+    python3 -m tools.simulate_sampling [--hours 6] [--rise-rate 1.5] [--quiet]
+
+"""
+import argparse
+import contextlib
+import io
+
+import numpy as np
+
+from src.acquisition import DEFAULT_READ_INTERVAL
+from src.adaptive_sampling import AdaptiveSampler
+from src.filters import SignalConditioner
+
+# Fixed logging interval of the GUI before the adaptive sampler
+FIXED_INTERVAL = 15.0
+
+# Alarm thresholds of the GUI (celsius, percent)
+TEMPERATURE_LIMITS = (0.0, 28.0)
+HUMIDITY_LIMITS = (15.0, 80.0)
+
+
+def synthetic_readings(hours, rise_rate, seed=0):
+    """ Creates the filtered readings of the acquisition worker over a trace with an excursion
+
+    Returns:
+        tuple: (times, temperatures, humidities) arrays, one per sensor read
+    """
+    generator = np.random.RandomState(seed)
+    times = np.arange(0.0, hours * 3600, DEFAULT_READ_INTERVAL)
+
+    # Ramp from 22 to 30 C in the middle of the trace, hold 10 minutes and fall back
+    ramp_start = times[-1] / 2
+    ramp_seconds = 8.0 / rise_rate * 60
+    excursion = np.interp(times, [ramp_start, ramp_start + ramp_seconds,
+                                  ramp_start + ramp_seconds + 600, ramp_start + 2 * ramp_seconds + 600],
+                          [0.0, 8.0, 8.0, 0.0])
+    temperatures = np.round(22 + excursion + generator.normal(0, 0.05, len(times)), 1)
+    humidities = np.round(40 - excursion + generator.normal(0, 0.2, len(times)), 1)
+
+    conditioner = SignalConditioner.from_configuration()
+    filtered_temperatures, filtered_humidities = conditioner.apply(temperatures, humidities, times)
+
+    return times, filtered_temperatures, filtered_humidities
+
+
+def run_log(times, temperatures, humidities, sampler):
+    """ Logs the latest reading at the intervals of the sampler (fixed if None)
+
+    Returns:
+        list: (time, temperature) of the logged readings
+    """
+    logged = []
+    log_time = DEFAULT_READ_INTERVAL
+    last_index = None
+
+    while log_time < times[-1]:
+        index = int(np.searchsorted(times, log_time, side="right")) - 1
+        interval = FIXED_INTERVAL
+        if index != last_index and not np.isnan(temperatures[index]):
+            logged.append((times[index], temperatures[index]))
+            last_index = index
+            if sampler is not None:
+                interval = sampler.update(float(temperatures[index]), float(humidities[index]),
+                                          float(times[index]), TEMPERATURE_LIMITS, HUMIDITY_LIMITS)
+        elif sampler is not None:
+            interval = sampler.interval
+        log_time += interval
+
+    return logged
+
+
+def run_simulation(hours, rise_rate, quiet):
+    """ Runs the fixed and the adaptive log and prints their results """
+    times, temperatures, humidities = synthetic_readings(hours, rise_rate)
+    threshold = TEMPERATURE_LIMITS[1]
+    crossing = times[np.argmax(temperatures > threshold)]
+
+    print("{:>10} {:>8} {:>14} {:>12}".format("", "logged", "alarm delay s", "peak C"))
+    for name, sampler in (("fixed", None), ("adaptive", AdaptiveSampler.from_configuration())):
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            logged = run_log(times, temperatures, humidities, sampler)
+
+        logged_times, logged_temperatures = np.array(logged).T
+        over = logged_times[logged_temperatures > threshold]
+        delay = over[0] - crossing if len(over) else float("nan")
+
+        print("{:>10} {:>8} {:>14.1f} {:>12.2f}".format(
+            name, len(logged), delay, logged_temperatures.max()))
+
+    print("True peak {:.2f} C, {:.1f} hours, rise {} C/min".format(
+        np.nanmax(temperatures), hours, rise_rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare fixed and adaptive logging intervals")
+    parser.add_argument("--hours", type=float, default=6.0, help="length of the trace")
+    parser.add_argument("--rise-rate", type=float, default=1.5,
+                        help="celsius per minute of the excursion")
+    parser.add_argument("--quiet", action="store_true", help="hide the sampler decisions")
+    args = parser.parse_args()
+
+    run_simulation(args.hours, args.rise_rate, args.quiet)